@@ -0,0 +1,2 @@
+from aio.app import AsyncApp, Router, async_database_uri
+from aio.views import aio_views
@@ -0,0 +1,292 @@
+import asyncio
+import contextvars
+import json
+import logging
+import re
+import time
+import zlib
+from urllib.parse import parse_qs
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from database import db
+from schemas import encode
+from services import metrics
+
+log = logging.getLogger(__name__)
+
+# The SQL statement count and time of the request being handled, while metrics are enabled
+_request_sql = contextvars.ContextVar('request_sql', default=None)
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_uri(config) -> str:
+    """
+    Returns the async driver URI for the configured database.
+
+    SQLALCHEMY_ASYNC_DATABASE_URI wins if set, otherwise the driver of
+    SQLALCHEMY_DATABASE_URI is swapped for asyncpg or aiosqlite.
+    """
+    uri = config.get('SQLALCHEMY_ASYNC_DATABASE_URI')
+    if uri:
+        return uri
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    scheme, sep, rest = uri.partition('://')
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+
+class Request:
+    """The parts of an ASGI HTTP request the handlers need."""
+
+    def __init__(self, app, scope, body: bytes, session):
+        self.app = app
+        self.config = app.config
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        self.headers = {
+            name.decode('latin-1').lower(): value.decode('latin-1')
+            for name, value in scope.get('headers', [])
+        }
+        self.body = body
+        self.session = session
+        client = scope.get('client')
+        self.remote_addr = client[0] if client else None
+
+    def get_json(self):
+        """Returns the decoded JSON body, or None when there is none."""
+        if not self.body:
+            return None
+        return json.loads(self.body)
+
+    def arg(self, name, default=None):
+        """Returns the first value of a query string parameter."""
+        values = self.query.get(name)
+        return values[0] if values else default
+
+
+class Response:
+    """
+    An HTTP response. body is either the complete bytes, or an async
+    iterator of byte chunks that are sent as they are produced.
+    """
+
+    def __init__(self, body, status=200, headers=None, content_type='application/json'):
+        self.body = body
+        self.status = status
+        self.headers = dict(headers or {})
+        self.headers.setdefault('content-type', content_type)
+
+    @property
+    def streaming(self) -> bool:
+        """True when body is an async iterator of chunks."""
+        return not isinstance(self.body, bytes)
+
+
+def jsonify(payload, status=200, headers=None) -> Response:
+    """Builds a JSON response, the async counterpart of flask.jsonify(...), status."""
+    return Response(encode(payload), status, headers)
+
+
+def ndjson_response(chunks, gzip=False) -> Response:
+    """
+    Async counterpart of schemas.ndjson_response: streams the NDJSON byte
+    chunks of the async iterator chunks, each compressed and flushed on
+    its own with gzip.
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    if gzip:
+        chunks = _gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return Response(chunks, 200, headers, content_type='application/x-ndjson')
+
+
+async def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+async def _close_after(chunks, session):
+    # A streamed body may still read from the session of its request
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await session.close()
+
+
+class Router:
+    """Collects async handlers, the async counterpart of a Flask Blueprint."""
+
+    _param = re.compile(r'<(\w+)>')
+
+    def __init__(self):
+        self.routes = []
+
+    def route(self, rule: str, methods=("GET",)):
+        """Registers the decorated coroutine for rule, using Flask's <name> placeholders."""
+        pattern = re.compile('^' + self._param.sub(r'(?P<\1>[^/]+)', rule) + '$')
+
+        def decorator(handler):
+            self.routes.append((rule, pattern, tuple(methods), handler))
+            return handler
+        return decorator
+
+
+class AsyncApp:
+    """
+    An ASGI application that serves the API with native coroutines and an
+    async SQLAlchemy engine (asyncpg on Postgres, aiosqlite on SQLite).
+
+    The routes and JSON contracts are the same as the Flask app_views
+    blueprint. Build it with create_app(mode='async').
+    """
+
+    def __init__(self, config, router: Router):
+        self.config = config
+        uri = async_database_uri(config)
+        options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        if uri.startswith('sqlite') and ':memory:' in uri:
+            # Every connection to an in-memory database would get its own empty schema
+            options.setdefault('poolclass', StaticPool)
+        self.engine = create_async_engine(uri, **options)
+        self.sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.routes = list(router.routes)
+        self._schema_ready = False
+        self._schema_lock = asyncio.Lock()
+        if metrics.enabled:
+            event.listen(self.engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(self.engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+
+    async def create_all(self):
+        """Checks the schema version, creating the schema of an empty database, like create_app does."""
+        from migrations.version import ensure_schema
+        async with self.engine.begin() as conn:
+            await conn.run_sync(ensure_schema)
+        self._schema_ready = True
+
+    async def drop_all(self):
+        """Drops every table."""
+        async with self.engine.begin() as conn:
+            await conn.run_sync(db.metadata.drop_all)
+        self._schema_ready = False
+
+    async def dispose(self):
+        """Closes pooled connections."""
+        await self.engine.dispose()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        response = await self.handle(scope, body)
+        await send({
+            'type': 'http.response.start',
+            'status': response.status,
+            'headers': [
+                (name.encode('latin-1'), str(value).encode('latin-1'))
+                for name, value in response.headers.items()
+            ],
+        })
+        if not response.streaming:
+            await send({'type': 'http.response.body', 'body': response.body})
+            return
+        async for chunk in response.body:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def handle(self, scope, body: bytes) -> Response:
+        """
+        Routes one request and returns its response. While metrics are
+        enabled its latency and SQL statements are recorded like
+        middlewares.metrics does for the Flask app.
+        """
+        if not metrics.enabled:
+            _, response = await self._dispatch(scope, body)
+            return response
+        start = time.perf_counter()
+        sql = {'queries': 0, 'seconds': 0.0}
+        token = _request_sql.set(sql)
+        try:
+            endpoint, response = await self._dispatch(scope, body)
+        finally:
+            _request_sql.reset(token)
+        method = scope['method']
+        metrics.request_duration.observe(time.perf_counter() - start, endpoint, method, response.status)
+        metrics.request_queries.observe(sql['queries'], endpoint, method)
+        metrics.request_query_duration.observe(sql['seconds'], endpoint, method)
+        return response
+
+    async def _dispatch(self, scope, body: bytes):
+        """Returns the rule of the matching route, or 'unmatched', and the response."""
+        if not self._schema_ready:
+            async with self._schema_lock:
+                # Only the first of several concurrent first requests checks the schema
+                if not self._schema_ready:
+                    await self.create_all()
+        method_allowed = True
+        for rule, pattern, methods, handler in self.routes:
+            match = pattern.match(scope['path'])
+            if match is None:
+                continue
+            if scope['method'] not in methods:
+                method_allowed = False
+                continue
+            session = self.sessionmaker()
+            try:
+                response = await handler(Request(self, scope, body, session), **match.groupdict())
+            except Exception:
+                await session.close()
+                log.exception("%s %s failed", scope['method'], scope['path'])
+                return rule, Response(b'Internal Server Error', 500, content_type='text/plain')
+            if response.streaming:
+                response.body = _close_after(response.body, session)
+            else:
+                await session.close()
+            return rule, response
+        if not method_allowed:
+            return 'unmatched', Response(b'Method Not Allowed', 405, content_type='text/plain')
+        return 'unmatched', Response(b'Not Found', 404, content_type='text/plain')
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.create_all()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _request_sql.get() is not None:
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    sql = _request_sql.get()
+    starts = conn.info.get('metrics_query_start')
+    if sql is None or not starts:
+        return
+    sql['queries'] += 1
+    sql['seconds'] += time.perf_counter() - starts.pop()
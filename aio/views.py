@@ -0,0 +1,654 @@
+"""
+Async handlers for the routes of views/user.py, views/organization.py,
+views/metrics.py and views/admin.py.
+
+Each handler keeps the status codes and JSON bodies of its Flask
+counterpart, so the two serving modes are interchangeable for clients.
+"""
+import asyncio
+import hmac
+import logging
+import uuid
+from functools import wraps
+
+import jwt
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from aio.app import Response, Router, jsonify, ndjson_response
+from models import User, Organization, user_organization, membership_exists, membership_name_exists
+from schemas import (AddUserPayload, AddUsersPayload, AuthData, LoginPayload, OrganizationData, OrganizationPayload,
+                     Pagination, PayloadError, RegisterPayload, UserData, encode_lines)
+from services import (password_hasher, HashingUnavailable, encode_access_token, decode_access_token,
+                      InvalidPageRequest, encode_cursor, parse_page_args, login_throttle, profile_cache,
+                      profile_data, revocation_list, key_ring, organization_search, metrics,
+                      membership_cache, token_cache)
+
+aio_views = Router()
+log = logging.getLogger(__name__)
+
+
+def auth_error(message):
+    return jsonify({"errors": [{"message": message}]}, 401)
+
+
+def protected_route(handler):
+    """Async counterpart of middlewares.user_validation.protected_route.
+
+    The verified userId is stored on request.user_id and the claims on
+    request.token_claims.
+    """
+    @wraps(handler)
+    async def wrapper(request, **kwargs):
+        authorization = request.headers.get('authorization')
+        if authorization is None:
+            return auth_error("Authorization header is required")
+        if not authorization.startswith('Bearer '):
+            return auth_error("Invalid authorization header")
+        token = authorization.split(' ')[1]
+        if token == "":
+            return auth_error("Token is required")
+        try:
+            payload = decode_access_token(token, request.config['SECRET_KEY'])
+        except jwt.InvalidTokenError:
+            return auth_error("Invalid token")
+        request.user_id = payload['userId']
+        request.token_claims = payload
+        return await handler(request, **kwargs)
+    return wrapper
+
+
+def validate_payload(schema):
+    """Async counterpart of middlewares.user_validation.validate_payload.
+
+    The decoded Struct is stored on request.payload.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request, **kwargs):
+            try:
+                request.payload = schema.decode(request.body)
+            except PayloadError as e:
+                return jsonify({"errors": e.errors}, 422)
+            return await handler(request, **kwargs)
+        return wrapper
+    return decorator
+
+
+def throttle_login(handler):
+    """Async counterpart of middlewares.user_validation.throttle_login."""
+    @wraps(handler)
+    async def wrapper(request, **kwargs):
+        retry_after = login_throttle.attempt(request.payload.email, request.remote_addr)
+        if retry_after is not None:
+            return jsonify({
+                "status": "Too many requests",
+                "message": "Too many login attempts, try again later",
+                "statusCode": 429
+            }, 429, {"Retry-After": str(retry_after)})
+        return await handler(request, **kwargs)
+    return wrapper
+
+
+def admin_route(handler):
+    """Async counterpart of middlewares.user_validation.admin_route."""
+    @wraps(handler)
+    async def wrapper(request, **kwargs):
+        expected = request.config.get('ADMIN_API_KEY')
+        provided = request.headers.get('x-admin-key', '')
+        if not expected or not hmac.compare_digest(provided.encode('utf-8'), expected.encode('utf-8')):
+            return jsonify({
+                "status": "Forbidden",
+                "message": "Admin access required",
+                "statusCode": 403
+            }, 403)
+        return await handler(request, **kwargs)
+    return wrapper
+
+
+def server_busy():
+    return jsonify({
+        "status": "Service unavailable",
+        "message": "Server is busy, try again later",
+        "statusCode": 503
+    }, 503, {"Retry-After": "1"})
+
+
+@aio_views.route("/", methods=["GET"])
+async def helloworld(request):
+    return Response(b"Hello, World!", content_type='text/html; charset=utf-8')
+
+
+@aio_views.route("/.well-known/jwks.json", methods=["GET"])
+async def jwks(request):
+    """Async counterpart of views.jwks.jwks"""
+    headers = {"Cache-Control": "public, max-age=300", "ETag": key_ring.jwks_etag}
+    if request.headers.get('if-none-match') == key_ring.jwks_etag:
+        return Response(b'', 304, headers)
+    return Response(key_ring.jwks_body, 200, headers)
+
+
+async def user_profile_row(session, user_id):
+    """Async counterpart of User.columns_by_id for the profile columns"""
+    columns = (getattr(User, name) for name in User.PROFILE_COLUMNS)
+    return (await session.execute(select(*columns).where(User.userId == user_id))).first()
+
+
+@aio_views.route("/api/users/<id>", methods=["GET"])
+@protected_route
+async def user(request, id=None):
+    """Async counterpart of views.user.user"""
+    if id is not None and id != request.user_id:
+        return jsonify({
+            "status": "Bad request",
+            "message": "Unauthorized",
+            "statusCode": 401
+        }, 401)
+    profile = await profile_cache.get_async(
+        request.user_id, lambda: user_profile_row(request.session, request.user_id))
+    if profile is None:
+        return jsonify({
+            "status": "Bad request",
+            "message": "User not found",
+            "statusCode": 404
+        }, 404)
+    return jsonify({
+        "status": "success",
+        "message": "User found",
+        "data": profile_data(profile)
+    }, 200)
+
+
+@aio_views.route("/auth/login", methods=["POST"])
+@validate_payload(LoginPayload)
+@throttle_login
+async def login(request):
+    """Async counterpart of views.user.login"""
+    email = request.payload.email
+    password = request.payload.password
+    user = await request.session.scalar(select(User).where(func.lower(User.email) == func.lower(email)))
+    if user is None:
+        return jsonify({
+            "status": "Bad request",
+            "message": "Authentication failed",
+            "statusCode": 401
+        }, 401)
+    try:
+        password_matches = await password_hasher.check_password_async(password, user.password)
+    except HashingUnavailable:
+        return server_busy()
+    if not password_matches:
+        return jsonify({
+            "status": "Bad request",
+            "message": "Authentication failed",
+            "statusCode": 401
+        }, 401)
+    if password_hasher.needs_rehash(user.password):
+        rehash_password(request.app, user.userId, password, user.password)
+    return jsonify({
+        "status": "success",
+        "message": "Login successful",
+        "data": AuthData(encode_access_token(user.userId, request.config['SECRET_KEY']), UserData.from_model(user))
+    }, 200)
+
+
+def rehash_password(app, user_id, password, old_hash):
+    """Async counterpart of views.user.rehash_password"""
+    loop = asyncio.get_running_loop()
+
+    async def save(new_hash):
+        async with app.sessionmaker() as session:
+            await session.execute(User.password_rehash(user_id, old_hash, new_hash))
+            await session.commit()
+
+    def store(new_hash):
+        asyncio.run_coroutine_threadsafe(save(new_hash), loop)
+    password_hasher.rehash_in_background(password, store)
+
+
+@aio_views.route("/auth/register", methods=["POST"])
+@validate_payload(RegisterPayload)
+async def register(request):
+    """Async counterpart of views.user.register"""
+    register_data = request.payload
+    password = register_data.password
+    firstName = register_data.firstName
+    userId = str(uuid.uuid4())
+    try:
+        hashed_password = await password_hasher.hash_password_async(password)
+    except HashingUnavailable:
+        return server_busy()
+    accessToken = encode_access_token(userId, request.config['SECRET_KEY'])
+    session = request.session
+    user = User(userId=userId, firstName=firstName, lastName=register_data.lastName,
+                email=register_data.email, password=hashed_password, phone=register_data.phone)
+    organization = Organization(orgId=str(uuid.uuid4()), name=f"{firstName}'s Organisation")
+    session.add_all([user, organization])
+    try:
+        await session.flush()
+        await session.execute(user_organization.insert().values(
+            user_id=userId, organization_id=organization.orgId))
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        if User.is_email_conflict(e):
+            return jsonify({"errors": [{"field": "email", "message": "Email already exists"}]}, 422)
+        log.exception("Registration failed")
+        return jsonify({
+            "status": "Bad request",
+            "message": "Registration unsuccessful",
+            "statusCode": 400
+        }, 400)
+    return jsonify({
+        "status": "success",
+        "message": "Registration successful",
+        "data": AuthData(accessToken, UserData.from_model(user))
+    }, 201)
+
+
+@aio_views.route("/auth/logout", methods=["POST"])
+@protected_route
+async def logout(request):
+    """Async counterpart of views.user.logout"""
+    claims = request.token_claims
+    if claims.get('jti') is None:
+        revocation_list.revoke_user(claims['userId'])
+    else:
+        revocation_list.revoke_token(claims['jti'], claims['exp'])
+    return jsonify({
+        "status": "success",
+        "message": "Logout successful"
+    }, 200)
+
+
+@aio_views.route("/auth/revoke", methods=["POST"])
+@protected_route
+async def revoke(request):
+    """Async counterpart of views.user.revoke"""
+    revocation_list.revoke_user(request.token_claims['userId'])
+    return jsonify({
+        "status": "success",
+        "message": "Every access token was revoked"
+    }, 200)
+
+
+@aio_views.route("/api/organisations/<orgId>/users", methods=["POST"])
+@protected_route
+@validate_payload(AddUserPayload)
+async def add_existing_user_to_organization(request, orgId=None):
+    """Async counterpart of views.organization.add_existing_user_to_organization"""
+    session = request.session
+    try:
+        owner = await session.scalar(select(User.userId).where(User.userId == request.user_id))
+        if owner is None:
+            return jsonify({
+                "status": "Bad request",
+                "message": "User not found",
+                "statusCode": 404
+            }, 404)
+        userId = request.payload.userId
+        user = await session.scalar(select(User.userId).where(User.userId == userId))
+        if user is None:
+            return jsonify({
+                "status": "Bad request",
+                "message": "The User was not found",
+                "statusCode": 404
+            }, 404)
+        org_check = await session.scalar(select(Organization.orgId).where(Organization.orgId == orgId))
+        if org_check is None:
+            return jsonify({
+                "status": "Bad request",
+                "message": "Organization not found",
+                "statusCode": 404
+            }, 404)
+        if not await session.scalar(select(membership_exists(owner, orgId))):
+            return jsonify({
+                "status": "Bad request",
+                "message": "You are not in this organization",
+                "statusCode": 401
+            }, 401)
+        await session.execute(user_organization.insert().values(user_id=userId, organization_id=orgId))
+        await session.commit()
+        return jsonify({
+            "status": "success",
+            "message": "User added to organization successfully"
+        }, 200)
+    except Exception:
+        log.exception("Adding a user to organization %s failed", orgId)
+        await session.rollback()
+        return jsonify({
+            "status": "Bad request",
+            "message": "Server error",
+            "statusCode": 400
+        }, 400)
+
+
+@aio_views.route("/api/organisations/<orgId>/users/batch", methods=["POST"])
+@protected_route
+@validate_payload(AddUsersPayload)
+async def add_existing_users_to_organization(request, orgId=None):
+    """Async counterpart of views.organization.add_existing_users_to_organization"""
+    session = request.session
+    owner_is_member = await session.scalar(select(membership_exists(request.user_id, orgId)))
+    if not owner_is_member:
+        owner = await session.scalar(select(User.userId).where(User.userId == request.user_id))
+        if owner is None:
+            return jsonify({
+                "status": "Bad request",
+                "message": "User not found",
+                "statusCode": 404
+            }, 404)
+    userIds = request.payload.userIds
+    max_users = request.config['ORGANISATIONS_BATCH_MAX_USERS']
+    if len(userIds) > max_users:
+        return jsonify({
+            "errors": [
+                {
+                    "field": "userIds",
+                    "message": f"This field must hold at most {max_users} userIds"
+                }
+            ]
+        }, 422)
+    if not owner_is_member:
+        if await session.scalar(select(Organization.orgId).where(Organization.orgId == orgId)) is None:
+            return jsonify({
+                "status": "Bad request",
+                "message": "Organization not found",
+                "statusCode": 404
+            }, 404)
+        return jsonify({
+            "status": "Bad request",
+            "message": "You are not in this organization",
+            "statusCode": 401
+        }, 401)
+
+    userIds = list(dict.fromkeys(userIds))
+    try:
+        found = set(await session.scalars(select(User.userId).where(User.userId.in_(userIds))))
+        rows = [{"user_id": userId, "organization_id": orgId} for userId in userIds if userId in found]
+        added = set()
+        if rows:
+            statement = Organization.add_members_insert(session.bind.dialect.name)
+            if statement is not None:
+                added = set(await session.scalars(statement, rows))
+            else:
+                existing = set(await session.scalars(
+                    select(user_organization.c.user_id).where(
+                        user_organization.c.organization_id == orgId,
+                        user_organization.c.user_id.in_(found),
+                    )
+                ))
+                rows = [row for row in rows if row["user_id"] not in existing]
+                if rows:
+                    await session.execute(user_organization.insert(), rows)
+                added = {row["user_id"] for row in rows}
+        await session.commit()
+    except Exception:
+        log.exception("Adding users to organization %s failed", orgId)
+        await session.rollback()
+        return jsonify({
+            "status": "Bad request",
+            "message": "Server error",
+            "statusCode": 400
+        }, 400)
+    results = []
+    for userId in userIds:
+        if userId not in found:
+            status = "notFound"
+        elif userId in added:
+            status = "added"
+        else:
+            status = "alreadyMember"
+        results.append({"userId": userId, "status": status})
+    return jsonify({
+        "status": "success",
+        "message": "Users processed",
+        "data": {
+            "added": len(added),
+            "alreadyMember": len(found) - len(added),
+            "notFound": len(userIds) - len(found),
+            "results": results
+        }
+    }, 200)
+
+
+@aio_views.route("/api/organisations/<orgId>/users", methods=["GET"])
+@protected_route
+async def organization_members(request, orgId=None):
+    """Async counterpart of views.organization.organization_members"""
+    session = request.session
+    member = await session.scalar(select(membership_exists(request.user_id, orgId)))
+    if not member:
+        user_id = await session.scalar(select(User.userId).where(User.userId == request.user_id))
+        if user_id is None:
+            return jsonify({
+                "status": "Bad request",
+                "message": "User not found",
+                "statusCode": 404
+            }, 404)
+        return jsonify({
+            "status": "Bad request",
+            "message": "You are not in this organization or you did not create it",
+            "statusCode": 404
+        }, 404)
+    batch_size = request.config['ORGANISATIONS_EXPORT_BATCH_SIZE']
+    return ndjson_response(member_lines(session, orgId, batch_size),
+                           gzip='gzip' in request.headers.get('accept-encoding', ''))
+
+
+async def member_lines(session, org_id, batch_size):
+    """Async counterpart of views.organization.member_lines"""
+    result = await session.stream(
+        Organization.member_users_query(org_id).execution_options(yield_per=batch_size))
+    async for rows in result.partitions():
+        yield encode_lines(UserData.from_model(row) for row in rows)
+
+
+@aio_views.route("/api/organisations", methods=["POST"])
+@protected_route
+@validate_payload(OrganizationPayload)
+async def create_organization(request):
+    """Async counterpart of views.organization.create_organization"""
+    session = request.session
+    user_id = await session.scalar(select(User.userId).where(User.userId == request.user_id))
+    if user_id is None:
+        return jsonify({
+            "status": "Bad request",
+            "message": "User not found",
+            "statusCode": 404
+        }, 404)
+    name = request.payload.name
+    description = request.payload.description
+    try:
+        if await session.scalar(select(membership_name_exists(user_id, name))):
+            return jsonify({
+                "status": "Bad Request",
+                "message": "Client error",
+                "statusCode": 400
+            }, 400)
+        organization = Organization(orgId=str(uuid.uuid4()), name=name, description=description)
+        session.add(organization)
+        await session.flush()
+        await session.execute(user_organization.insert().values(
+            user_id=user_id, organization_id=organization.orgId))
+        await session.commit()
+        return jsonify({
+            "status": "success",
+            "message": "Organisation created successfully",
+            "data": OrganizationData.from_model(organization)
+        }, 201)
+    except Exception as e:
+        await session.rollback()
+        return jsonify({
+            "status": "Bad Request",
+            "message": "Client error",
+            "statusCode": 400
+        }, 400)
+
+
+# Registered before /api/organisations/<orgId>, whose pattern would match it first
+@aio_views.route("/api/organisations/search", methods=["GET"])
+@protected_route
+async def search_organizations(request):
+    """Async counterpart of views.organization.search_organizations"""
+    session = request.session
+    text = request.arg('q', '').strip()
+    mode = request.arg('mode', 'prefix')
+    try:
+        limit, _ = parse_page_args(
+            request.arg('limit'),
+            None,
+            request.config['ORGANISATIONS_SEARCH_DEFAULT_LIMIT'],
+            request.config['ORGANISATIONS_SEARCH_MAX_LIMIT'],
+        )
+    except InvalidPageRequest as e:
+        return jsonify({
+            "status": "Bad Request",
+            "message": str(e),
+            "statusCode": 400
+        }, 400)
+    if not text or len(text) > 255:
+        message = "Invalid q"
+    elif mode not in ('prefix', 'fuzzy'):
+        message = "Invalid mode"
+    else:
+        message = None
+    if message is not None:
+        return jsonify({
+            "status": "Bad Request",
+            "message": message,
+            "statusCode": 400
+        }, 400)
+    user_id = await session.scalar(select(User.userId).where(User.userId == request.user_id))
+    if user_id is None:
+        return jsonify({
+            "status": "Bad request",
+            "message": "User not found",
+            "statusCode": 404
+        }, 404)
+    organizations = await organization_search.search_async(
+        session, user_id, text, fuzzy=mode == 'fuzzy', limit=limit)
+    return jsonify({
+        "status": "success",
+        "message": "Organizations found",
+        "data": [OrganizationData.from_model(organization) for organization in organizations]
+    }, 200)
+
+
+@aio_views.route("/api/organisations/<orgId>", methods=["GET"])
+@protected_route
+async def organization(request, orgId=None):
+    """Async counterpart of views.organization.organization"""
+    session = request.session
+    user_id = await session.scalar(select(User.userId).where(User.userId == request.user_id))
+    if user_id is None:
+        return jsonify({
+            "status": "Bad request",
+            "message": "User not found",
+            "statusCode": 404
+        }, 404)
+    organization = await session.scalar(
+        select(Organization)
+        .join(user_organization, user_organization.c.organization_id == Organization.orgId)
+        .where(user_organization.c.user_id == user_id, Organization.orgId == orgId)
+    )
+    if organization is None:
+        return jsonify({
+            "status": "Bad request",
+            "message": "You are not in this organization or you did not create it",
+            "statusCode": 404
+        }, 404)
+    return jsonify({
+        "status": "success",
+        "message": "Organization found",
+        "data": OrganizationData.from_model(organization)
+    }, 200)
+
+
+@aio_views.route("/api/organisations", methods=["GET"])
+@protected_route
+async def organizations(request):
+    """Async counterpart of views.organization.organizations"""
+    session = request.session
+    paginated = 'limit' in request.query or 'cursor' in request.query
+    if paginated:
+        try:
+            limit, after = parse_page_args(
+                request.arg('limit'),
+                request.arg('cursor'),
+                request.config['ORGANISATIONS_DEFAULT_PAGE_SIZE'],
+                request.config['ORGANISATIONS_MAX_PAGE_SIZE'],
+            )
+        except InvalidPageRequest as e:
+            return jsonify({
+                "status": "Bad Request",
+                "message": str(e),
+                "statusCode": 400
+            }, 400)
+    user_id = await session.scalar(select(User.userId).where(User.userId == request.user_id))
+    if user_id is None:
+        return jsonify({
+            "status": "Bad request",
+            "message": "User not found",
+            "statusCode": 404
+        }, 404)
+    if not paginated:
+        organizations = await session.scalars(Organization.member_query(user_id))
+        return jsonify({
+            "status": "success",
+            "message": "Organizations found",
+            "data": [OrganizationData.from_model(organization) for organization in organizations]
+        }, 200)
+    organizations = (await session.scalars(Organization.member_page_query(user_id, after, limit))).all()
+    next_cursor = None
+    if len(organizations) > limit:
+        organizations = organizations[:limit]
+        next_cursor = encode_cursor(organizations[-1].orgId)
+    return jsonify({
+        "status": "success",
+        "message": "Organizations found",
+        "data": [OrganizationData.from_model(organization) for organization in organizations],
+        "pagination": Pagination(limit, next_cursor)
+    }, 200)
+
+
+@aio_views.route("/metrics", methods=["GET"])
+async def metrics_endpoint(request):
+    """Async counterpart of views.metrics.metrics_endpoint"""
+    if not metrics.enabled:
+        return jsonify({
+            "status": "Not found",
+            "message": "Metrics are disabled",
+            "statusCode": 404
+        }, 404)
+    return Response(metrics.render().encode('utf-8'), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@aio_views.route("/api/admin/users/import", methods=["POST"])
+@admin_route
+async def import_users(request):
+    """
+    The bulk import writes through the Flask-SQLAlchemy session, so it is
+    only served by the Flask app or the import-users command.
+    """
+    return jsonify({
+        "status": "Not implemented",
+        "message": "Bulk import is not served in async mode, use SERVER_MODE=wsgi or flask import-users",
+        "statusCode": 501
+    }, 501)
+
+
+@aio_views.route("/api/admin/cache-stats", methods=["GET"])
+@admin_route
+async def cache_stats(request):
+    """Async counterpart of views.admin.cache_stats"""
+    return jsonify({
+        "status": "success",
+        "message": "Cache statistics",
+        "data": {
+            "tokens": token_cache.stats(),
+            "profiles": profile_cache.stats(),
+            "memberships": membership_cache.stats(),
+            "revocations": revocation_list.stats(),
+        }
+    }, 200)
@@ -1,8 +1,9 @@
-from asgiref.wsgi import WsgiToAsgi
 from flask import Flask
 from dotenv import load_dotenv
 import os
 from database import db
+from services import (key_ring, login_throttle, membership_cache, metrics, organization_search, password_hasher,
+                      profile_cache, replica_router, revocation_list, token_cache)
 # from flask_migrate import Migrate
 
 load_dotenv()
@@ -25,39 +26,227 @@ class Config:
         f'postgresql://{POSTGRESQL_USER}:{POSTGRESQL_PWD}@{POSTGRESQL_HOST}:{POSTGRESQL_PORT}/{POSTGRESQL_DB}'
     ) if POSTGRESQL_URL == 'None' else POSTGRESQL_URL
 
+    # Read replicas for the read-only views, comma separated, with their engine options
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri]
+    SQLALCHEMY_REPLICA_ENGINE_OPTIONS = {
+        "pool_size": int(os.environ.get('REPLICA_POOL_SIZE', 5)),
+        "pool_recycle": int(os.environ.get('REPLICA_POOL_RECYCLE', 1800)),
+        "pool_pre_ping": True,
+    }
+    # Seconds a client reads from the primary after it wrote
+    REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+    # Password hashing pool
+    BCRYPT_POOL_SIZE = int(os.environ.get('BCRYPT_POOL_SIZE', os.cpu_count() or 1))
+    BCRYPT_POOL_QUEUE_DEPTH = int(os.environ.get('BCRYPT_POOL_QUEUE_DEPTH', 64))
+    BCRYPT_POOL_TIMEOUT = float(os.environ.get('BCRYPT_POOL_TIMEOUT', 5.0))
+    # bcrypt cost of new hashes; older hashes are rehashed on login.
+    # `flask --app app calibrate-bcrypt` picks it for BCRYPT_TARGET_MS.
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    BCRYPT_TARGET_MS = float(os.environ.get('BCRYPT_TARGET_MS', 250))
+
+    # 'wsgi' serves Flask through WsgiToAsgi, 'async' serves the native ASGI app
+    SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+    # Worker processes started by `python app.py`, one per core by default
+    SERVER_WORKERS = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+    # Requests after which a worker is replaced (0 never), plus up to the jitter more
+    SERVER_MAX_REQUESTS = int(os.environ.get('SERVER_MAX_REQUESTS', 0))
+    SERVER_MAX_REQUESTS_JITTER = int(os.environ.get('SERVER_MAX_REQUESTS_JITTER', 0))
+    # Seconds stopping workers get to finish their requests on reload or shutdown
+    SERVER_GRACEFUL_TIMEOUT = float(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 30))
+    # Give each worker its own SO_REUSEPORT socket, balanced by the kernel (Linux)
+    SERVER_REUSE_PORT = os.environ.get('SERVER_REUSE_PORT', 'false').lower() in ('1', 'true', 'yes')
+
+    # GET /api/organisations page sizes when limit or cursor is given
+    ORGANISATIONS_DEFAULT_PAGE_SIZE = int(os.environ.get('ORGANISATIONS_DEFAULT_PAGE_SIZE', 50))
+    ORGANISATIONS_MAX_PAGE_SIZE = int(os.environ.get('ORGANISATIONS_MAX_PAGE_SIZE', 500))
+
+    # Most userIds accepted by POST /api/organisations/<orgId>/users/batch
+    ORGANISATIONS_BATCH_MAX_USERS = int(os.environ.get('ORGANISATIONS_BATCH_MAX_USERS', 10000))
+    # Members fetched per round trip by GET /api/organisations/<orgId>/users
+    ORGANISATIONS_EXPORT_BATCH_SIZE = int(os.environ.get('ORGANISATIONS_EXPORT_BATCH_SIZE', 1000))
+    # GET /api/organisations/search result counts, and users whose name indexes
+    # are kept in process on databases other than PostgreSQL
+    ORGANISATIONS_SEARCH_DEFAULT_LIMIT = int(os.environ.get('ORGANISATIONS_SEARCH_DEFAULT_LIMIT', 20))
+    ORGANISATIONS_SEARCH_MAX_LIMIT = int(os.environ.get('ORGANISATIONS_SEARCH_MAX_LIMIT', 100))
+    ORGANISATIONS_SEARCH_INDEX_SIZE = int(os.environ.get('ORGANISATIONS_SEARCH_INDEX_SIZE', 100))
+
+    # Shared secret for the admin routes, which are disabled while unset
+    ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY')
+
+    # Rows per transaction for bulk user imports
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 5000))
+    # Hashing processes for bulk imports, every core when unset
+    IMPORT_WORKERS = int(os.environ['IMPORT_WORKERS']) if os.environ.get('IMPORT_WORKERS') else None
+    # Rejected rows whose errors the admin import endpoint returns, the rest are counted
+    IMPORT_MAX_REPORTED_ERRORS = int(os.environ.get('IMPORT_MAX_REPORTED_ERRORS', 1000))
+
+    # Ed25519 or P-256 PEM private keys to sign access tokens with instead of HS256 and
+    # SECRET_KEY; their public keys are served at /.well-known/jwks.json. New tokens are
+    # signed by JWT_SIGNING_KEY_ID (default the first key), every listed key verifies.
+    JWT_KEY_FILES = [path for path in os.environ.get('JWT_KEY_FILES', '').split(',') if path]
+    JWT_SIGNING_KEY_ID = os.environ.get('JWT_SIGNING_KEY_ID') or None
+    # Keep accepting HS256 tokens without kid, turn off a token lifetime after adding keys
+    JWT_ACCEPT_HS256 = os.environ.get('JWT_ACCEPT_HS256', 'true').lower() in ('1', 'true', 'yes')
+
+    # Redis cache shared by every worker process (redis://host:6379/0): the
+    # revocations, login throttle counters, profiles and replica stickiness
+    # whose stores are not set in code. Required with more than one worker.
+    SHARED_CACHE_URL = os.environ.get('SHARED_CACHE_URL') or None
+
+    # Verified access tokens kept in memory, 0 disables the cache
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+
+    # Serialized user profiles kept in memory and for how long, 0 disables the cache.
+    # PROFILE_CACHE_SHARED may be set to a cachelib cache shared by every process.
+    PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 10000))
+    PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', 60))
+    PROFILE_CACHE_SHARED = None
+
+    # Per-user sets of orgIds used by the organisation authorization checks
+    MEMBERSHIP_CACHE_SIZE = int(os.environ.get('MEMBERSHIP_CACHE_SIZE', 10000))
+    MEMBERSHIP_CACHE_TTL = float(os.environ.get('MEMBERSHIP_CACHE_TTL', 60))
+
+    # Login attempts allowed per email and per client IP within the sliding window,
+    # 0 disables a limit. LOGIN_THROTTLE_STORE may be set to a cachelib cache
+    # to share the counters between processes.
+    LOGIN_THROTTLE_WINDOW = float(os.environ.get('LOGIN_THROTTLE_WINDOW', 60))
+    LOGIN_THROTTLE_EMAIL_LIMIT = int(os.environ.get('LOGIN_THROTTLE_EMAIL_LIMIT', 10))
+    LOGIN_THROTTLE_IP_LIMIT = int(os.environ.get('LOGIN_THROTTLE_IP_LIMIT', 30))
+    LOGIN_THROTTLE_STORE = None
+
+    # Revoked access tokens. REVOCATION_STORE may be set to a cachelib cache shared
+    # by every process, which then learn of revocations within the sync interval.
+    REVOCATION_STORE = None
+    REVOCATION_SYNC_INTERVAL = float(os.environ.get('REVOCATION_SYNC_INTERVAL', 1.0))
+    REVOCATION_BLOOM_CAPACITY = int(os.environ.get('REVOCATION_BLOOM_CAPACITY', 100000))
+
+    # Serve request, SQL, bcrypt and JWT histograms from GET /metrics
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
     # Setup MySQL server URI
     # SQLALCHEMY_DATABASE_URI = "postgresql+psycopg2://SG-same-weaver-228-5724-pgsql-master.servers.mongodirector.com:5432/authdatabase"
 
-class TestConfig():
+class TestConfig(Config):
     TESTING = True
     # Set up the secret key for signing sessions
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Hash inline so tests do not spawn worker processes
+    BCRYPT_POOL_SIZE = 0
+    BCRYPT_LOG_ROUNDS = 4
+    IMPORT_WORKERS = 0
+
 
+def create_app(test=False, config=None, mode=None):
+    """
+    Builds the application.
 
-def create_app(test=False):
+    mode is 'wsgi' for the Flask app (default) or 'async' for the native
+    ASGI app with async SQLAlchemy sessions. It defaults to SERVER_MODE.
+    """
     app = Flask(__name__)
     if test:
         app.config.from_object(TestConfig)
     else:
         app.config.from_object(Config)
+    if config is not None:
+        app.config.update(config)
+    configure_shared_stores(app)
+    password_hasher.init_app(app)
+    key_ring.init_app(app)
+    token_cache.init_app(app)
+    profile_cache.init_app(app)
+    membership_cache.init_app(app)
+    organization_search.init_app(app)
+    login_throttle.init_app(app)
+    revocation_list.init_app(app)
+    metrics.init_app(app)
+    if (mode or app.config.get('SERVER_MODE', 'wsgi')) == 'async':
+        from aio import AsyncApp, aio_views
+        return AsyncApp(app.config, aio_views)
+
+    replica_router.init_app(app)
     db.init_app(app)
-    from models import User
+    from commands import register_commands
+    from middlewares.metrics import install_metrics
+    from views import app_views
+    register_commands(app)
+    install_metrics(app)
+    app.register_blueprint(app_views)
 
     with app.app_context():
-        db.create_all()
+        check_schema(app)
 
     return app
 
 
+# The stores that take a cachelib cache shared between processes
+SHARED_STORES = ('REVOCATION_STORE', 'LOGIN_THROTTLE_STORE', 'PROFILE_CACHE_SHARED', 'REPLICA_STICKY_STORE')
+
+
+def configure_shared_stores(app):
+    """Sets the SHARED_STORES left unset to the cache of SHARED_CACHE_URL, if any."""
+    url = app.config.get('SHARED_CACHE_URL')
+    if not url:
+        return
+    from services.caching import cache_from_url
+    cache = cache_from_url(url)
+    for name in SHARED_STORES:
+        if app.config.get(name) is None:
+            app.config[name] = cache
+
+
+def check_schema(app):
+    """
+    Checks the schema version of the database, creating the schema of an
+    empty one. An outdated schema is logged and every request answered
+    with a 503, so that CLI commands such as migrate-uuid-keys still run.
+    """
+    from migrations.version import SchemaVersionError, ensure_schema
+    try:
+        with db.engine.begin() as connection:
+            ensure_schema(connection)
+    except SchemaVersionError as e:
+        app.logger.error("%s", e)
+        message = str(e)
+
+        @app.before_request
+        def schema_unavailable():
+            from schemas import json_response
+            return json_response({
+                "status": "Service unavailable",
+                "message": message,
+                "statusCode": 503
+            }), 503
+
+
 if __name__ == "__main__":
-    app = create_app()
-    from views import app_views
-    app.register_blueprint(app_views)
-    # Wrap the Flask app with the ASGI middleware for ASGI compatibility
-    app = WsgiToAsgi(app)
+    import logging
+    from functools import partial
+    from server import Master
 
-    # Run the Flask app using Uvicorn
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=int(PORT))
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    workers = Config.SERVER_WORKERS
+    if workers > 1 and not Config.SHARED_CACHE_URL:
+        # Each worker would keep its own revocations, login limits, profiles and stickiness
+        logging.getLogger(__name__).warning(
+            "starting 1 worker instead of %d: several workers need SHARED_CACHE_URL "
+            "(e.g. redis://localhost:6379/0)", workers)
+        workers = 1
+    worker_config = {}
+    if 'BCRYPT_POOL_SIZE' not in os.environ:
+        # Share the cores between the hashing pools of the workers
+        worker_config['BCRYPT_POOL_SIZE'] = max(1, (os.cpu_count() or 1) // workers)
+    # Each worker builds its own app after the fork; the master only imports the code
+    Master(
+        partial(create_app, config=worker_config),
+        host="0.0.0.0",
+        port=int(PORT),
+        workers=workers,
+        max_requests=Config.SERVER_MAX_REQUESTS,
+        max_requests_jitter=Config.SERVER_MAX_REQUESTS_JITTER,
+        graceful_timeout=Config.SERVER_GRACEFUL_TIMEOUT,
+        reuse_port=Config.SERVER_REUSE_PORT,
+    ).run()
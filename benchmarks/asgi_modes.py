@@ -0,0 +1,78 @@
+"""
+Side-by-side comparison of the Flask app behind WsgiToAsgi and the native
+async app (create_app(mode='async')) on the same file-backed SQLite schema.
+
+Requests are sent in-process with a fixed number in flight, so the numbers
+cover the framework, thread hops and database driver but not the network.
+
+    python benchmarks/asgi_modes.py --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+
+from common import asgi_request, make_app, print_table, register, sqlite_file_uri, summarize
+
+
+async def drive(app, method, path, body, expected, headers, total, concurrency):
+    """Sends total requests, concurrency at a time; body is called for each request's payload."""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            payload = body()
+            start = time.perf_counter()
+            status = await asgi_request(app, method, path, payload, headers)
+            latencies.append(time.perf_counter() - start)
+            assert status == expected, f'{method} {path} returned {status}, expected {expected}'
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args()
+
+    uri = sqlite_file_uri()
+    flask_app = make_app(SQLALCHEMY_DATABASE_URI=uri)
+    user_id, token = register(flask_app.test_client(), 'bench@example.com')
+    headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+    # Organization names are unique, so every POST needs a fresh one
+    org_numbers = itertools.count()
+
+    def org_body():
+        return json.dumps({'name': f'Bench Org {next(org_numbers)}'}).encode()
+
+    def no_body():
+        return b''
+
+    from app import create_app
+    apps = {
+        'wsgi (WsgiToAsgi)': WsgiToAsgi(flask_app),
+        'async (native)': create_app(test=True, config={'SQLALCHEMY_DATABASE_URI': uri}, mode='async'),
+    }
+    scenarios = [
+        ('GET /api/users/<id>', 'GET', f'/api/users/{user_id}', no_body, 200),
+        ('GET /api/organisations', 'GET', '/api/organisations', no_body, 200),
+        ('POST /api/organisations', 'POST', '/api/organisations', org_body, 201),
+    ]
+    rows = []
+    for label, app in apps.items():
+        for name, method, path, body, expected in scenarios:
+            summary = asyncio.run(drive(app, method, path, body, expected, headers,
+                                        args.requests, args.concurrency))
+            rows.append({"mode": label, "endpoint": name, **summary})
+    print_table(f"{args.requests} requests, {args.concurrency} in flight", rows)
+
+
+if __name__ == '__main__':
+    main()
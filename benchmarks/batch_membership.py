@@ -0,0 +1,61 @@
+"""
+Adding N existing users to an organisation: N calls to
+POST /api/organisations/<orgId>/users against one call to .../users/batch.
+
+    python benchmarks/batch_membership.py --users 10000
+"""
+import argparse
+import time
+import uuid
+
+from common import make_app, print_table, register
+
+
+def seed_users(app, count):
+    from models import User, db
+    user_ids = [str(uuid.uuid4()) for _ in range(count)]
+    with app.app_context():
+        db.session.execute(User.__table__.insert(), [
+            {"userId": user_id, "firstName": "Bench", "lastName": "User",
+             "email": f"{user_id}@example.com", "password": "x"} for user_id in user_ids
+        ])
+        db.session.commit()
+    return user_ids
+
+
+def create_org(client, headers, name):
+    return client.post('/api/organisations', json={'name': name}, headers=headers).get_json()['data']['orgId']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=10000)
+    args = parser.parse_args()
+
+    app = make_app(ORGANISATIONS_BATCH_MAX_USERS=max(args.users, 10000))
+    client = app.test_client()
+    _, token = register(client, 'owner@example.com')
+    headers = {'Authorization': f'Bearer {token}'}
+    user_ids = seed_users(app, args.users)
+
+    looped_org = create_org(client, headers, 'Looped')
+    start = time.perf_counter()
+    for user_id in user_ids:
+        response = client.post(f'/api/organisations/{looped_org}/users', json={'userId': user_id}, headers=headers)
+        assert response.status_code == 200, response.status_code
+    looped = time.perf_counter() - start
+
+    batch_org = create_org(client, headers, 'Batched')
+    start = time.perf_counter()
+    response = client.post(f'/api/organisations/{batch_org}/users/batch', json={'userIds': user_ids}, headers=headers)
+    batched = time.perf_counter() - start
+    assert response.get_json()['data']['added'] == args.users
+
+    print_table(f"adding {args.users} users to an organisation", [
+        {"path": "looped single-user POST", "requests": args.users, "seconds": looped},
+        {"path": "one batch POST", "requests": 1, "seconds": batched},
+    ])
+
+
+if __name__ == '__main__':
+    main()
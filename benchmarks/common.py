@@ -0,0 +1,121 @@
+"""Helpers shared by the benchmark scripts."""
+import os
+import sys
+import tempfile
+import time
+
+# Allow running the scripts as `python benchmarks/<name>.py` from the repo root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentile(samples, pct):
+    """Returns the pct-th percentile of samples (nearest rank)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(samples, elapsed=None):
+    """Returns count, throughput and latency percentiles (ms) for samples in seconds."""
+    summary = {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+    if elapsed:
+        summary["throughput_rps"] = len(samples) / elapsed
+    return summary
+
+
+def sqlite_file_uri():
+    """Returns a URI for a fresh file-backed SQLite database in a temp dir."""
+    handle, path = tempfile.mkstemp(suffix='.sqlite3', prefix='auth-bench-')
+    os.close(handle)
+    return f'sqlite:///{path}'
+
+
+def make_app(**config):
+    """Builds a test app on a file-backed SQLite database, hashing at the production bcrypt cost."""
+    from app import Config, create_app
+
+    config.setdefault('SQLALCHEMY_DATABASE_URI', sqlite_file_uri())
+    config.setdefault('BCRYPT_LOG_ROUNDS', Config.BCRYPT_LOG_ROUNDS)
+    return create_app(test=True, config=config)
+
+
+def register(client, email, password='password123', first_name='Bench'):
+    """Registers a user and returns (userId, accessToken)."""
+    response = client.post('/auth/register', json={
+        'firstName': first_name,
+        'lastName': 'User',
+        'email': email,
+        'password': password,
+    })
+    data = response.get_json()['data']
+    return data['user']['userId'], data['accessToken']
+
+
+def timed(fn, *args, **kwargs):
+    """Calls fn and returns (elapsed seconds, result)."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def print_table(title, rows):
+    """Prints rows of dicts as an aligned table."""
+    print(title)
+    if not rows:
+        return
+    keys = list(rows[0].keys())
+    widths = {k: max(len(k), *(len(_fmt(r[k])) for r in rows)) for k in keys}
+    print("  ".join(k.ljust(widths[k]) for k in keys))
+    for row in rows:
+        print("  ".join(_fmt(row[k]).ljust(widths[k]) for k in keys))
+    print()
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+async def asgi_request(app, method, path, body=b'', headers=None):
+    """Sends one request to an ASGI app in-process and returns the status code."""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'server': ('bench', 80),
+        'client': ('127.0.0.1', 1234),
+        'root_path': '',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'headers': [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    }
+    if body:
+        # Werkzeug reads no body from a WSGI request without a Content-Length
+        scope['headers'].append((b'content-length', str(len(body)).encode()))
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await app(scope, receive, send)
+    return status[0]
@@ -0,0 +1,91 @@
+"""
+Login throughput and GET /api/users/<id> latency while logins run concurrently,
+with bcrypt inline on the request thread versus in the hashing process pool.
+
+    python benchmarks/hashing_pool.py --login-threads 8 --duration 5
+"""
+import argparse
+import os
+import threading
+import time
+
+from common import make_app, print_table, register, summarize
+
+
+def run(pool_size, login_threads, duration):
+    # Without the login throttle every login after the first few would be a 429
+    app = make_app(BCRYPT_POOL_SIZE=pool_size, BCRYPT_POOL_QUEUE_DEPTH=login_threads * 2,
+                   LOGIN_THROTTLE_EMAIL_LIMIT=0, LOGIN_THROTTLE_IP_LIMIT=0)
+    client = app.test_client()
+    user_id, token = register(client, 'bench@example.com')
+
+    stop = threading.Event()
+    logins = []
+    lookups = []
+    failed = []
+    lock = threading.Lock()
+
+    def login_worker():
+        worker_client = app.test_client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = worker_client.post('/auth/login', json={
+                'email': 'bench@example.com', 'password': 'password123'
+            })
+            elapsed = time.perf_counter() - start
+            with lock:
+                # Only successful logins count, e.g. not a 503 from a saturated pool
+                (logins if response.status_code == 200 else failed).append(elapsed)
+
+    def lookup_worker():
+        worker_client = app.test_client()
+        headers = {'Authorization': f'Bearer {token}'}
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = worker_client.get(f'/api/users/{user_id}', headers=headers)
+            elapsed = time.perf_counter() - start
+            (lookups if response.status_code == 200 else failed).append(elapsed)
+
+    threads = [threading.Thread(target=login_worker) for _ in range(login_threads)]
+    threads.append(threading.Thread(target=lookup_worker))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    from services import password_hasher
+    password_hasher.shutdown()
+
+    login_summary = summarize(logins, elapsed)
+    lookup_summary = summarize(lookups, elapsed)
+    return {
+        "pool_size": pool_size,
+        "logins_per_s": login_summary["throughput_rps"],
+        "login_p99_ms": login_summary["p99_ms"],
+        "failed": len(failed),
+        "lookups": lookup_summary["count"],
+        "lookup_p50_ms": lookup_summary["p50_ms"],
+        "lookup_p99_ms": lookup_summary["p99_ms"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--login-threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--pool-size', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    rows = [
+        run(0, args.login_threads, args.duration),
+        run(args.pool_size, args.login_threads, args.duration),
+    ]
+    print_table("bcrypt inline (pool_size=0) vs process pool", rows)
+
+
+if __name__ == '__main__':
+    main()
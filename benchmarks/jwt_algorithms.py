@@ -0,0 +1,47 @@
+"""
+Signing and verification throughput of access tokens with HS256, ES256
+and EdDSA, as issued by encode_access_token and checked by KeyRing.decode.
+
+    python benchmarks/jwt_algorithms.py --tokens 2000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from common import print_table
+
+
+def time_algorithm(algorithm, tokens):
+    from services.signing import KeyRing, SigningKey, generate_signing_key
+
+    ring = KeyRing()
+    if algorithm != 'HS256':
+        ring.load([SigningKey.from_pem(generate_signing_key(algorithm))])
+    payload = {"userId": "u", "exp": datetime.now() + timedelta(hours=1), "iat": time.time(), "jti": "j"}
+    start = time.perf_counter()
+    signed = [ring.encode(payload, 'secret') for _ in range(tokens)]
+    sign_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for token in signed:
+        ring.decode(token, 'secret')
+    verify_seconds = time.perf_counter() - start
+    return {
+        "algorithm": algorithm,
+        "sign_per_s": tokens / sign_seconds,
+        "verify_per_s": tokens / verify_seconds,
+        "verify_us": verify_seconds / tokens * 1e6,
+        "token_bytes": len(signed[0]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=2000)
+    args = parser.parse_args()
+
+    print_table("Access token signing and verification",
+                [time_algorithm(algorithm, args.tokens) for algorithm in ('HS256', 'ES256', 'EdDSA')])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Legitimate login latency while a credential-stuffing wave hits /auth/login,
+with and without login throttling.
+
+The app is served by a threaded WSGI server in its own process, so the
+load generator does not compete with it for the GIL. Legitimate users log
+in with their own email from their own address, each well under the
+limits. Attackers cycle through real accounts with wrong passwords from a
+few addresses at a fixed total rate, so every attempt that is let through
+costs a bcrypt comparison.
+
+    python benchmarks/login_throttle.py --duration 30 --attack-rate 50
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+from common import make_app, print_table, summarize
+
+LEGIT_USERS = 30
+VICTIMS = 40
+
+
+class BenchClientAddress:
+    """Takes REMOTE_ADDR from an X-Bench-Client header so one host can play many clients."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        environ['REMOTE_ADDR'] = environ.get('HTTP_X_BENCH_CLIENT', environ.get('REMOTE_ADDR'))
+        return self.wsgi_app(environ, start_response)
+
+
+def serve(port, config, ready, stop):
+    import logging
+    from werkzeug.serving import make_server
+    from services import password_hasher
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    app = make_app(**config)
+    app.wsgi_app = BenchClientAddress(app.wsgi_app)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    ready.set()
+    stop.wait()
+    server.shutdown()
+    thread.join()
+    password_hasher.shutdown()
+
+
+def post(port, path, body, client):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request('POST', path, json.dumps(body),
+                           {'Content-Type': 'application/json', 'X-Bench-Client': client})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def legit_traffic(port, stop, samples, statuses):
+    i = 0
+    while not stop.is_set():
+        user = i % LEGIT_USERS
+        start = time.perf_counter()
+        status = post(port, '/auth/login', {'email': f'user{user}@example.com', 'password': 'password123'},
+                      f'192.168.0.{user}')
+        samples.append(time.perf_counter() - start)
+        statuses.append(status)
+        i += 1
+        time.sleep(0.1)
+
+
+def attack_traffic(port, stop, number, interval, statuses):
+    i = number
+    next_at = time.perf_counter()
+    while not stop.is_set():
+        statuses.append(post(port, '/auth/login', {'email': f'victim{i % VICTIMS}@example.com', 'password': 'guess'},
+                             f'10.0.0.{number % 4}'))
+        i += 1
+        next_at += interval
+        time.sleep(max(0.0, next_at - time.perf_counter()))
+
+
+def scenario(name, duration, attackers, attack_rate, config):
+    context = multiprocessing.get_context('spawn')
+    port = free_port()
+    ready, stop_server = context.Event(), context.Event()
+    server = context.Process(target=serve, args=(port, config, ready, stop_server))
+    server.start()
+    try:
+        ready.wait()
+        for email in [f'user{n}@example.com' for n in range(LEGIT_USERS)] + \
+                     [f'victim{n}@example.com' for n in range(VICTIMS)]:
+            post(port, '/auth/register', {'firstName': 'Bench', 'lastName': 'User',
+                                          'email': email, 'password': 'password123'}, '127.0.0.1')
+        stop = threading.Event()
+        samples, legit_statuses, attack_statuses = [], [], []
+        threads = [threading.Thread(target=legit_traffic, args=(port, stop, samples, legit_statuses))]
+        interval = attackers / attack_rate if attackers else 0
+        threads += [threading.Thread(target=attack_traffic, args=(port, stop, n, interval, attack_statuses))
+                    for n in range(attackers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        stop_server.set()
+        server.join()
+    return {
+        "scenario": name,
+        **summarize(samples),
+        "legit_ok": legit_statuses.count(200),
+        "legit_failed": len(legit_statuses) - legit_statuses.count(200),
+        "attack_attempts": len(attack_statuses),
+        "attack_throttled": attack_statuses.count(429),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--attackers', type=int, default=16, help='concurrent attacking connections')
+    parser.add_argument('--attack-rate', type=float, default=50, help='attempts per second, all attackers together')
+    parser.add_argument('--pool-size', type=int, default=os.cpu_count() or 1, help='bcrypt processes')
+    parser.add_argument('--window', type=float, default=10, help='throttle window, shortened to fit the run')
+    parser.add_argument('--email-limit', type=int, default=2)
+    parser.add_argument('--ip-limit', type=int, default=2)
+    args = parser.parse_args()
+
+    throttled = {
+        'BCRYPT_POOL_SIZE': args.pool_size,
+        'LOGIN_THROTTLE_WINDOW': args.window,
+        'LOGIN_THROTTLE_EMAIL_LIMIT': args.email_limit,
+        'LOGIN_THROTTLE_IP_LIMIT': args.ip_limit,
+    }
+    unthrottled = {**throttled, 'LOGIN_THROTTLE_EMAIL_LIMIT': 0, 'LOGIN_THROTTLE_IP_LIMIT': 0}
+    rows = [
+        scenario("no attack", args.duration, 0, args.attack_rate, throttled),
+        scenario("attack, unthrottled", args.duration, args.attackers, args.attack_rate, unthrottled),
+        scenario("attack, throttled", args.duration, args.attackers, args.attack_rate, throttled),
+    ]
+    print_table("Legitimate login latency", rows)
+
+
+if __name__ == '__main__':
+    main()
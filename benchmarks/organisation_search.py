@@ -0,0 +1,102 @@
+"""
+GET /api/organisations/search for a user with many memberships, against
+fetching the whole list and filtering it on the client.
+
+    python benchmarks/organisation_search.py --memberships 100000 --queries 200
+
+SQLite (the default) searches the in-process name index, whose first
+prefix and fuzzy searches build it. Pass --database-uri with a migrated
+PostgreSQL database to time the pg_trgm and btree indexes instead.
+"""
+import argparse
+import random
+import time
+import uuid
+from urllib.parse import quote
+
+from common import make_app, print_table, register, summarize
+
+WORDS = ('acme', 'global', 'north', 'blue', 'river', 'labs', 'systems', 'capital', 'studio', 'partners',
+         'digital', 'health', 'summit', 'green', 'atlas', 'union', 'pioneer', 'harbor', 'quantum', 'orbit')
+
+
+def organization_name(rng, i):
+    return f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {i}"
+
+
+def seed_memberships(app, user_id, count, rng, batch=10000):
+    from models import Organization, user_organization, db
+    names = []
+    with app.app_context():
+        for start in range(0, count, batch):
+            orgs = [
+                {"orgId": str(uuid.uuid4()), "name": organization_name(rng, i), "description": None}
+                for i in range(start, min(start + batch, count))
+            ]
+            names.extend(org["name"] for org in orgs)
+            db.session.execute(Organization.__table__.insert(), orgs)
+            db.session.execute(user_organization.insert(), [
+                {"user_id": user_id, "organization_id": org["orgId"]} for org in orgs
+            ])
+        db.session.commit()
+    return names
+
+
+def misspell(rng, name):
+    # Swap two neighbouring letters of the first word
+    position = rng.randrange(len(name.split()[0]) - 1)
+    return name[:position] + name[position + 1] + name[position] + name[position + 2:]
+
+
+def timed(client, url, headers):
+    start = time.perf_counter()
+    response = client.get(url, headers=headers)
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.status_code
+    return elapsed, response.get_json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--memberships', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--database-uri', default=None)
+    args = parser.parse_args()
+
+    config = {'SQLALCHEMY_DATABASE_URI': args.database_uri} if args.database_uri else {}
+    app = make_app(**config)
+    client = app.test_client()
+    rng = random.Random(42)
+    user_id, token = register(client, f'bench-{uuid.uuid4().hex[:8]}@example.com')
+    names = seed_memberships(app, user_id, args.memberships, rng)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    rows = []
+    elapsed, data = timed(client, '/api/organisations', headers)
+    needle = names[0][:8].lower()
+    start = time.perf_counter()
+    matches = [org for org in data['data'] if org['name'].lower().startswith(needle)][:args.limit]
+    elapsed += time.perf_counter() - start
+    rows.append({"request": "full list + client filter", "count": 1, "p50_ms": elapsed * 1000,
+                 "p95_ms": elapsed * 1000, "p99_ms": elapsed * 1000, "matched_pct": 100.0 * bool(matches)})
+
+    prefixes = [rng.choice(names)[:rng.randint(2, 10)] for _ in range(args.queries)]
+    typos = [misspell(rng, rng.choice(names)) for _ in range(args.queries)]
+    for mode, queries in (('prefix', prefixes), ('fuzzy', typos)):
+        url = f'/api/organisations/search?mode={mode}&limit={args.limit}&q='
+        elapsed, data = timed(client, url + quote(queries[0]), headers)
+        rows.append({"request": f"{mode} first search", "count": 1, "p50_ms": elapsed * 1000,
+                     "p95_ms": elapsed * 1000, "p99_ms": elapsed * 1000, "matched_pct": 100.0 * bool(data['data'])})
+        samples = []
+        found = 0
+        for query in queries:
+            elapsed, data = timed(client, url + quote(query), headers)
+            samples.append(elapsed)
+            found += bool(data['data'])
+        rows.append({"request": f"{mode} search", **summarize(samples), "matched_pct": found * 100 / len(queries)})
+    print_table(f"{args.memberships} memberships, limit {args.limit}", rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+GET /api/organisations for a user with many memberships: the unpaginated
+response against keyset pages.
+
+    python benchmarks/organisations_pagination.py --memberships 100000 --limit 100
+"""
+import argparse
+import time
+import tracemalloc
+import uuid
+
+from common import make_app, print_table, register
+
+
+def seed_memberships(app, user_id, count, batch=10000):
+    from models import Organization, user_organization, db
+    with app.app_context():
+        for start in range(0, count, batch):
+            orgs = [
+                {"orgId": str(uuid.uuid4()), "name": f"Org {i}", "description": None}
+                for i in range(start, min(start + batch, count))
+            ]
+            db.session.execute(Organization.__table__.insert(), orgs)
+            db.session.execute(user_organization.insert(), [
+                {"user_id": user_id, "organization_id": org["orgId"]} for org in orgs
+            ])
+        db.session.commit()
+
+
+def measure(client, url, headers):
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(url, headers=headers)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert response.status_code == 200, response.status_code
+    return elapsed, peak, len(response.data), response.get_json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--memberships', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    app = make_app(ORGANISATIONS_MAX_PAGE_SIZE=max(args.limit, 500))
+    client = app.test_client()
+    user_id, token = register(client, 'bench@example.com')
+    seed_memberships(app, user_id, args.memberships)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    rows = []
+    elapsed, peak, size, _ = measure(client, '/api/organisations', headers)
+    rows.append({"request": "unpaginated", "ms": elapsed * 1000, "peak_mib": peak / 2**20, "bytes": size})
+
+    elapsed, peak, size, data = measure(client, f'/api/organisations?limit={args.limit}', headers)
+    rows.append({"request": f"first page (limit={args.limit})", "ms": elapsed * 1000,
+                 "peak_mib": peak / 2**20, "bytes": size})
+
+    # Walk every page, then time the last one to show deep pages cost the same
+    cursor = data['pagination']['nextCursor']
+    pages = 1
+    walk_start = time.perf_counter()
+    last_cursor = None
+    while cursor:
+        last_cursor = cursor
+        data = client.get(f'/api/organisations?limit={args.limit}&cursor={cursor}', headers=headers).get_json()
+        cursor = data['pagination']['nextCursor']
+        pages += 1
+    walk = time.perf_counter() - walk_start
+    if last_cursor:
+        elapsed, peak, size, _ = measure(client, f'/api/organisations?limit={args.limit}&cursor={last_cursor}', headers)
+        rows.append({"request": "last page", "ms": elapsed * 1000, "peak_mib": peak / 2**20, "bytes": size})
+    rows.append({"request": f"full walk ({pages} pages)", "ms": walk * 1000, "peak_mib": 0.0, "bytes": 0})
+    print_table(f"{args.memberships} memberships", rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Cost of the revocation check on protected requests: RevocationList.is_revoked
+for tokens that were not revoked, with more and more revoked ids, against a
+plain set lookup, plus the latency of GET /api/users/<id>.
+
+    python benchmarks/revocation.py --revoked 0,10000,100000
+"""
+import argparse
+import time
+import uuid
+
+from common import make_app, print_table, register, summarize
+
+
+def time_checks(revoked, lookups):
+    from services.revocation import RevocationList
+
+    revocations = RevocationList()
+    exact = set()
+    expires_at = time.time() + 3600
+    for _ in range(revoked):
+        jti = uuid.uuid4().hex
+        revocations.revoke_token(jti, expires_at)
+        exact.add(jti)
+    claims = [{"userId": "u", "jti": uuid.uuid4().hex, "iat": 0} for _ in range(lookups)]
+    start = time.perf_counter()
+    for claim in claims:
+        revocations.is_revoked(claim)
+    check_ns = (time.perf_counter() - start) / lookups * 1e9
+    start = time.perf_counter()
+    for claim in claims:
+        claim["jti"] in exact
+    set_ns = (time.perf_counter() - start) / lookups * 1e9
+    return {
+        "revoked": revoked,
+        "is_revoked_ns": check_ns,
+        "set_lookup_ns": set_ns,
+        "false_positives": revocations.false_positives,
+        "bloom_kib": sum(len(bloom.bits) for bloom in revocations.filters) / 1024,
+    }
+
+
+def time_requests(requests):
+    app = make_app()
+    client = app.test_client()
+    user_id, token = register(client, 'bench@example.com')
+    headers = {'Authorization': f'Bearer {token}'}
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get(f'/api/users/{user_id}', headers=headers)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--revoked', default='0,10000,100000', help='revoked ids per run, comma separated')
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    print_table("Revocation check of a valid token",
+                [time_checks(int(n), args.lookups) for n in args.revoked.split(',')])
+    print_table("GET /api/users/<id>", [time_requests(args.requests)])
+
+
+if __name__ == '__main__':
+    main()
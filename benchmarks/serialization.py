@@ -0,0 +1,76 @@
+"""
+Microbenchmarks of the request decode and response encode hot paths:
+request.get_json() plus field-by-field checks and flask.jsonify, against
+msgspec Structs.
+
+    python benchmarks/serialization.py --number 20000
+"""
+import argparse
+import json
+import timeit
+
+from common import print_table
+
+REGISTER_BODY = json.dumps({
+    'firstName': 'John', 'lastName': 'Doe', 'email': 'john.doe@example.com',
+    'password': 'password123', 'phone': '5550100'
+}).encode()
+
+
+def legacy_validate(register_args):
+    """The field checks validate_user performed before the msgspec payloads."""
+    errors = []
+    for key in ('firstName', 'lastName', 'email', 'password'):
+        value = register_args.get(key)
+        if value is None or value == "" or not isinstance(value, str):
+            errors.append({"field": key, "message": "This field is required and must be a string"})
+    phone = register_args.get('phone')
+    if phone is not None and not isinstance(phone, str):
+        errors.append({"field": "phone", "message": "This field must be a string"})
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000)
+    parser.add_argument('--organizations', type=int, default=100)
+    args = parser.parse_args()
+
+    from flask import Flask, jsonify, request
+    from schemas import OrganizationData, RegisterPayload, UserData, json_response
+
+    app = Flask(__name__)
+    user = UserData('3f1c2a9e-0b7d-4c51-9a55-1d2e3f4a5b6c', 'John', 'Doe', 'john.doe@example.com', None)
+    orgs = [OrganizationData(f'org-{i}', f'Organisation {i}', 'description') for i in range(args.organizations)]
+    user_dict = {f: getattr(user, f) for f in user.__struct_fields__}
+    org_dicts = [{f: getattr(o, f) for f in o.__struct_fields__} for o in orgs]
+
+    def per_call(fn):
+        return timeit.timeit(fn, number=args.number) / args.number * 1e6
+
+    rows = []
+    with app.test_request_context('/auth/register', method='POST', data=REGISTER_BODY,
+                                  content_type='application/json'):
+        def legacy_decode():
+            request._cached_json = (Ellipsis, Ellipsis)
+            return legacy_validate(request.get_json())
+        rows.append({"path": "decode register", "impl": "get_json + checks", "us_per_call": per_call(legacy_decode)})
+        rows.append({"path": "decode register", "impl": "msgspec Struct",
+                     "us_per_call": per_call(lambda: RegisterPayload.decode(request.get_data()))})
+
+        user_body = {"status": "success", "message": "User found"}
+        rows.append({"path": "encode user", "impl": "flask.jsonify",
+                     "us_per_call": per_call(lambda: jsonify({**user_body, "data": user_dict}))})
+        rows.append({"path": "encode user", "impl": "msgspec Struct",
+                     "us_per_call": per_call(lambda: json_response({**user_body, "data": user}))})
+
+        orgs_body = {"status": "success", "message": "Organizations found"}
+        rows.append({"path": f"encode {args.organizations} orgs", "impl": "flask.jsonify",
+                     "us_per_call": per_call(lambda: jsonify({**orgs_body, "data": org_dicts}))})
+        rows.append({"path": f"encode {args.organizations} orgs", "impl": "msgspec Struct",
+                     "us_per_call": per_call(lambda: json_response({**orgs_body, "data": orgs}))})
+    print_table(f"{args.number} calls each", rows)
+
+
+if __name__ == '__main__':
+    main()
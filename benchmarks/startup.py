@@ -0,0 +1,95 @@
+"""
+Cold start of a worker: the time to import the app, to build it with
+create_app and to serve the first request, each run in a fresh
+interpreter.
+
+'restart' boots against an already initialized database, the usual case
+for an autoscaled worker, and 'first boot' against an empty one, where
+the schema is created. create_all is timed on the initialized database
+too, as the cost create_app used to pay on every start.
+
+    python benchmarks/startup.py --runs 20
+    python benchmarks/startup.py --database postgresql://localhost/bench
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from common import ROOT, print_table, sqlite_file_uri
+
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app(test=True, config={'SQLALCHEMY_DATABASE_URI': sys.argv[1], 'SECRET_KEY': 'bench'})
+created = time.perf_counter()
+response = flask_app.test_client().post('/auth/login', json={'email': 'nobody@example.com', 'password': 'x'})
+served = time.perf_counter()
+assert response.status_code == 401, response.status_code
+with flask_app.app_context():
+    from models import db
+    create_all_start = time.perf_counter()
+    db.create_all()
+    create_all = time.perf_counter() - create_all_start
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "create_all_ms": create_all * 1000,
+    "modules": len(sys.modules),
+}))
+'''
+
+
+def boot(uri):
+    """Runs the probe in a fresh interpreter and returns its timings plus the process wall time."""
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', PROBE, uri], cwd=ROOT, check=True,
+                            capture_output=True, text=True, env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'})
+    timings = json.loads(output.stdout.strip().splitlines()[-1])
+    timings["process_ms"] = (time.perf_counter() - start) * 1000
+    return timings
+
+
+def median_row(name, runs):
+    row = {"case": name}
+    for key in runs[0]:
+        values = sorted(run[key] for run in runs)
+        row[key] = values[len(values) // 2]
+    return row
+
+
+def reset(uri):
+    from sqlalchemy import MetaData, create_engine
+    engine = create_engine(uri)
+    metadata = MetaData()
+    metadata.reflect(engine)
+    metadata.drop_all(engine)
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='file', help="'file' or a SQLAlchemy URL, whose tables are dropped")
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    first_boot, restart = [], []
+    for _ in range(args.runs):
+        uri = sqlite_file_uri() if args.database == 'file' else args.database
+        if args.database != 'file':
+            reset(uri)
+        first_boot.append(boot(uri))
+        restart.append(boot(uri))
+        if args.database == 'file':
+            os.remove(uri[len('sqlite:///'):])
+    print_table(f"Startup, median of {args.runs} runs",
+                [median_row("first boot", first_boot), median_row("restart", restart)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""
+Load benchmark of every endpoint on seeded data, with JSON results that
+can be compared against a baseline.
+
+The app is built with create_app(test=True) on a fresh SQLite file by
+default, or on any SQLAlchemy URL such as a local Postgres. The tables of
+a URL are dropped and recreated first, so it is only accepted together
+with --reset. --database memory uses the in-memory SQLite of the tests,
+whose single shared connection only suits --concurrency 1.
+
+    python benchmarks/suite.py --users 2000 --concurrency 8 --output results.json
+    python benchmarks/suite.py --database postgresql://localhost/auth_bench --reset
+    python benchmarks/suite.py --output new.json --baseline results.json --tolerance 0.2
+
+With --baseline the run exits with status 1 when a scenario's p95 latency
+rose, or its throughput fell, by more than the tolerance.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from common import print_table, sqlite_file_uri, summarize
+
+PASSWORD = 'password123'
+
+
+class Seed:
+    """The seeded rows the scenarios pick their users and organisations from."""
+
+    def __init__(self):
+        self.users = []          # (userId, email, token)
+        self.owned = {}          # userId -> orgIds the user belongs to
+        self.members = {}        # orgId -> userIds of its members
+        self.org_ids = []
+
+
+def seed(app, users, orgs_per_user, members_per_org, batch=5000):
+    """Inserts users with one shared bcrypt hash, their organisations and extra members."""
+    from models import Organization, User, user_organization, db
+    from services import encode_access_token
+    from services.hashing import bcrypt_hash
+
+    hashed = bcrypt_hash(PASSWORD.encode('utf-8'), app.config['BCRYPT_LOG_ROUNDS']).decode('utf-8')
+    data = Seed()
+    user_rows, org_rows, memberships = [], [], set()
+    with app.app_context():
+        for n in range(users):
+            user_id = str(uuid.uuid4())
+            email = f'seed{n}@example.com'
+            user_rows.append({"userId": user_id, "firstName": "Seed", "lastName": "User",
+                              "email": email, "password": hashed, "phone": None})
+            data.users.append((user_id, email, encode_access_token(user_id)))
+            data.owned[user_id] = []
+            for i in range(orgs_per_user):
+                org_id = str(uuid.uuid4())
+                org_rows.append({"orgId": org_id, "name": f"Seed {n}.{i}", "description": None})
+                memberships.add((user_id, org_id))
+                data.owned[user_id].append(org_id)
+                data.org_ids.append(org_id)
+        user_ids = [user[0] for user in data.users]
+        for org_id in data.org_ids:
+            for user_id in random.sample(user_ids, min(members_per_org, len(user_ids))):
+                if (user_id, org_id) not in memberships:
+                    memberships.add((user_id, org_id))
+                    data.owned[user_id].append(org_id)
+        for user_id, org_id in memberships:
+            data.members.setdefault(org_id, set()).add(user_id)
+        membership_rows = [{"user_id": u, "organization_id": o} for u, o in memberships]
+        for table, rows in ((User.__table__, user_rows), (Organization.__table__, org_rows),
+                            (user_organization, membership_rows)):
+            for start in range(0, len(rows), batch):
+                db.session.execute(table.insert(), rows[start:start + batch])
+        db.session.commit()
+    return data
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+class Scenarios:
+    """One method per scenario, each sending request number i and returning (response, expected status)."""
+
+    def __init__(self, data, run_id):
+        self.data = data
+        self.run_id = run_id
+        self._counter = iter(range(sys.maxsize))
+        self._lock = threading.Lock()
+
+    def _user(self, i):
+        return self.data.users[i % len(self.data.users)]
+
+    def _unique(self):
+        with self._lock:
+            return next(self._counter)
+
+    def register(self, client, i):
+        response = client.post('/auth/register', json={
+            'firstName': 'Bench', 'lastName': 'User', 'password': PASSWORD,
+            'email': f'bench-{self.run_id}-{self._unique()}@example.com',
+        })
+        return response, 201
+
+    def login(self, client, i):
+        _, email, _ = self._user(i)
+        return client.post('/auth/login', json={'email': email, 'password': PASSWORD}), 200
+
+    def user(self, client, i):
+        user_id, _, token = self._user(i)
+        return client.get(f'/api/users/{user_id}', headers=auth(token)), 200
+
+    def organisations(self, client, i):
+        _, _, token = self._user(i)
+        return client.get('/api/organisations', headers=auth(token)), 200
+
+    def organisations_page(self, client, i):
+        _, _, token = self._user(i)
+        return client.get('/api/organisations?limit=20', headers=auth(token)), 200
+
+    def organisation(self, client, i):
+        user_id, _, token = self._user(i)
+        org_id = self.data.owned[user_id][i % len(self.data.owned[user_id])]
+        return client.get(f'/api/organisations/{org_id}', headers=auth(token)), 200
+
+    def create_organisation(self, client, i):
+        _, _, token = self._user(i)
+        return client.post('/api/organisations', json={'name': f'Bench {self.run_id} {self._unique()}'},
+                           headers=auth(token)), 201
+
+    def add_user(self, client, i):
+        user_id, _, token = self._user(i)
+        org_id = self.data.owned[user_id][0]
+        with self._lock:
+            # The single-user route fails for existing members, so pick someone else
+            members = self.data.members[org_id]
+            other_id = next((u for u, _, _ in self.data.users if u not in members), None)
+            members.add(other_id)
+        if other_id is None:
+            raise RuntimeError("every seeded user joined the organisation, seed more users")
+        return client.post(f'/api/organisations/{org_id}/users', json={'userId': other_id},
+                           headers=auth(token)), 200
+
+    def add_users(self, client, i):
+        user_id, _, token = self._user(i)
+        others = [self._user(i + k)[0] for k in range(1, 51)]
+        org_id = self.data.owned[user_id][0]
+        return client.post(f'/api/organisations/{org_id}/users/batch', json={'userIds': others},
+                           headers=auth(token)), 200
+
+
+SCENARIOS = ('register', 'login', 'user', 'organisations', 'organisations_page', 'organisation',
+             'create_organisation', 'add_user', 'add_users')
+
+
+def run_scenario(app, scenario, requests, concurrency):
+    """Sends requests calls of scenario from concurrency threads, each with its own client."""
+    local = threading.local()
+    errors = []
+
+    def call(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        start = time.perf_counter()
+        response, expected = scenario(client, i)
+        elapsed = time.perf_counter() - start
+        if response.status_code != expected:
+            errors.append(response.status_code)
+        return elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(call, range(requests)))
+    summary = summarize(samples, time.perf_counter() - start)
+    summary["errors"] = len(errors)
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """Returns comparison rows and whether any scenario regressed beyond tolerance."""
+    rows, regressed = [], False
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        p95_change = current["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0.0
+        rps_change = current["throughput_rps"] / previous["throughput_rps"] - 1 if previous["throughput_rps"] else 0.0
+        failed = p95_change > tolerance or rps_change < -tolerance
+        regressed = regressed or failed
+        rows.append({
+            "scenario": name,
+            "p95_ms": current["p95_ms"],
+            "base_p95_ms": previous["p95_ms"],
+            "p95_change_%": p95_change * 100,
+            "rps": current["throughput_rps"],
+            "base_rps": previous["throughput_rps"],
+            "rps_change_%": rps_change * 100,
+            "verdict": "REGRESSION" if failed else "ok",
+        })
+    return rows, regressed
+
+
+def build_app(database, bcrypt_pool, reset=False):
+    """Builds the app on database, dropping the tables of a URL database only when reset is set."""
+    from app import Config, create_app
+
+    if database not in ('memory', 'file') and not reset:
+        raise SystemExit(f"--database {database} would have all its tables dropped; "
+                         "pass --reset to confirm it is a throwaway database")
+
+    config = {
+        'BCRYPT_POOL_SIZE': bcrypt_pool,
+        'BCRYPT_LOG_ROUNDS': Config.BCRYPT_LOG_ROUNDS,
+        # The benchmark logs in far more often than the throttle allows
+        'LOGIN_THROTTLE_EMAIL_LIMIT': 0,
+        'LOGIN_THROTTLE_IP_LIMIT': 0,
+        'ORGANISATIONS_BATCH_MAX_USERS': 10000,
+    }
+    if database == 'file':
+        config['SQLALCHEMY_DATABASE_URI'] = sqlite_file_uri()
+    elif database != 'memory':
+        config['SQLALCHEMY_DATABASE_URI'] = database
+    app = create_app(test=True, config=config)
+    if database not in ('memory', 'file'):
+        from migrations.version import ensure_schema
+        from models import db
+        with app.app_context():
+            db.drop_all()
+            with db.engine.begin() as connection:
+                ensure_schema(connection)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='file', help="'file', 'memory' or a SQLAlchemy URL")
+    parser.add_argument('--reset', action='store_true',
+                        help='drop and recreate the tables of a --database URL')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--orgs-per-user', type=int, default=3)
+    parser.add_argument('--members-per-org', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--bcrypt-requests', type=int, default=50, help='requests for register and login')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--bcrypt-pool', type=int, default=0, help='hashing processes, 0 hashes inline')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the membership layout')
+    parser.add_argument('--output', help='write the results as JSON here')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    app = build_app(args.database, args.bcrypt_pool, args.reset)
+    start = time.perf_counter()
+    data = seed(app, args.users, args.orgs_per_user, args.members_per_org)
+    print(f"seeded {args.users} users in {time.perf_counter() - start:.1f}s")
+
+    scenarios = Scenarios(data, uuid.uuid4().hex[:8])
+    results = {}
+    for name in args.scenarios.split(','):
+        requests = args.bcrypt_requests if name in ('register', 'login') else args.requests
+        results[name] = run_scenario(app, getattr(scenarios, name), requests, args.concurrency)
+    from services import password_hasher
+    password_hasher.shutdown()
+
+    print_table("Endpoints", [{"scenario": name, **summary} for name, summary in results.items()])
+    if args.output:
+        import sqlalchemy
+        with open(args.output, 'w') as handle:
+            json.dump({
+                "meta": {
+                    "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    "python": platform.python_version(),
+                    "sqlalchemy": sqlalchemy.__version__,
+                    "args": vars(args),
+                },
+                "results": results,
+            }, handle, indent=2)
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)["results"]
+        rows, regressed = compare(results, baseline, args.tolerance)
+        print_table(f"Against {args.baseline} (tolerance {args.tolerance:.0%})", rows)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Text against binary uuid keys on SQLite: on-disk size of the key indexes
+and the time of a membership join, before and after migrate-uuid-keys.
+
+    python benchmarks/uuid_keys.py --users 50000 --orgs-per-user 3
+"""
+import argparse
+import random
+import time
+import uuid
+
+from common import print_table, sqlite_file_uri, summarize
+
+
+def seed(engine, users, orgs_per_user):
+    from sqlalchemy import text
+    from migrations.uuid_keys import TEXT_KEY_SCHEMA
+
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    org_ids = [str(uuid.uuid4()) for _ in range(users)]
+    with engine.begin() as conn:
+        for statement in TEXT_KEY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text('INSERT INTO user VALUES (:userId, \'Bench\', \'User\', :email, \'x\', NULL)'),
+                     [{"userId": user_id, "email": f"{user_id}@example.com"} for user_id in user_ids])
+        conn.execute(text('INSERT INTO organization VALUES (:orgId, :name, NULL)'),
+                     [{"orgId": org_id, "name": f"Org {i}"} for i, org_id in enumerate(org_ids)])
+        conn.execute(text('INSERT OR IGNORE INTO user_organization VALUES (:user_id, :organization_id)'), [
+            {"user_id": user_id, "organization_id": org_id}
+            for user_id in user_ids for org_id in random.sample(org_ids, orgs_per_user)
+        ])
+    return user_ids
+
+
+def index_sizes(engine):
+    """Returns the bytes used by each table and index, from the dbstat virtual table."""
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT name, SUM(pgsize) FROM dbstat WHERE name IN "
+            "(SELECT name FROM sqlite_master WHERE tbl_name IN ('user', 'organization', 'user_organization')) "
+            "GROUP BY name"
+        ))
+        return dict(rows.all())
+
+
+JOIN = (
+    'SELECT organization."orgId", organization.name FROM organization '
+    'JOIN user_organization ON user_organization.organization_id = organization."orgId" '
+    'WHERE user_organization.user_id = :user_id'
+)
+
+
+def time_joins(engine, user_ids, samples, key):
+    """Times the organisations-of-a-user join, binding each user id as key(user_id)."""
+    from sqlalchemy import text
+    query = text(JOIN)
+    timings = []
+    with engine.connect() as conn:
+        for user_id in random.sample(user_ids, min(samples, len(user_ids))):
+            start = time.perf_counter()
+            conn.execute(query, {"user_id": key(user_id)}).all()
+            timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--orgs-per-user', type=int, default=3)
+    parser.add_argument('--samples', type=int, default=2000)
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+    from migrations.uuid_keys import upgrade
+
+    engine = create_engine(sqlite_file_uri())
+    user_ids = seed(engine, args.users, args.orgs_per_user)
+    text_sizes = index_sizes(engine)
+
+    text_join = time_joins(engine, user_ids, args.samples, key=str)
+
+    start = time.perf_counter()
+    upgrade(engine, log=lambda message: None)
+    migration = time.perf_counter() - start
+    binary_sizes = index_sizes(engine)
+    binary_join = time_joins(engine, user_ids, args.samples, key=lambda user_id: uuid.UUID(user_id).bytes)
+
+    print_table(f"Table and index sizes (KiB), {args.users} users", [
+        {"name": name, "text": text_sizes.get(name, 0) / 1024, "binary": binary_sizes.get(name, 0) / 1024}
+        for name in sorted(set(text_sizes) | set(binary_sizes))
+    ])
+    print_table("Membership join per user", [
+        {"keys": "text", **text_join},
+        {"keys": "binary", **binary_join},
+    ])
+    print(f"migration: {migration:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
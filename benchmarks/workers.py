@@ -0,0 +1,117 @@
+"""
+Throughput of the pre-fork launcher (server.Master) with 1 to N worker
+processes, over real HTTP connections on a file-backed SQLite database.
+
+POST /auth/login is bound by bcrypt and should scale with the workers up
+to the number of cores; GET /api/users/<id> shows the per-request
+overhead. The load comes from client threads in this process, which can
+become the limit for the cheap endpoint.
+
+    python benchmarks/workers.py --workers 1,2,4 --duration 10 --clients 32
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from common import ROOT, make_app, print_table, register, sqlite_file_uri, summarize
+
+MASTER = r'''
+import sys
+from functools import partial
+from app import Config, create_app
+from server import Master
+
+config = {'SQLALCHEMY_DATABASE_URI': sys.argv[1], 'BCRYPT_LOG_ROUNDS': Config.BCRYPT_LOG_ROUNDS,
+          'BCRYPT_POOL_SIZE': 0, 'LOGIN_THROTTLE_EMAIL_LIMIT': 0, 'LOGIN_THROTTLE_IP_LIMIT': 0,
+          'SECRET_KEY': 'bench'}
+Master(partial(create_app, test=True, config=config), host='127.0.0.1', port=int(sys.argv[2]),
+       workers=int(sys.argv[3]), log_level='warning').run()
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_serving(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("the launcher did not start")
+
+
+def drive(port, method, path, body, headers, clients, duration):
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + duration
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            if response.status >= 400:
+                errors.append(response.status)
+        connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = summarize(latencies, time.perf_counter() - started)
+    summary["errors"] = len(errors)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    cores = os.cpu_count() or 1
+    parser.add_argument('--workers', default=','.join(str(n) for n in sorted({1, 2, cores // 2 or 1, cores})),
+                        help='worker counts, comma separated')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per scenario')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent connections')
+    args = parser.parse_args()
+
+    uri = sqlite_file_uri()
+    user_id, token = register(make_app(SQLALCHEMY_DATABASE_URI=uri, SECRET_KEY='bench').test_client(), 'bench@example.com')
+    login = json.dumps({'email': 'bench@example.com', 'password': 'password123'})
+    scenarios = [
+        ('POST /auth/login', 'POST', '/auth/login', login, {'Content-Type': 'application/json'}),
+        ('GET /api/users/<id>', 'GET', f'/api/users/{user_id}', None, {'Authorization': f'Bearer {token}'}),
+    ]
+    rows = []
+    for workers in (int(n) for n in args.workers.split(',')):
+        port = free_port()
+        master = subprocess.Popen([sys.executable, '-c', MASTER, uri, str(port), str(workers)], cwd=ROOT)
+        try:
+            wait_until_serving(port)
+            for name, method, path, body, headers in scenarios:
+                summary = drive(port, method, path, body, headers, args.clients, args.duration)
+                rows.append({"workers": workers, "endpoint": name, **summary})
+        finally:
+            master.terminate()
+            master.wait()
+    print_table(f"{args.clients} connections, {args.duration:.0f}s per scenario, {cores} cores", rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Flask CLI commands, registered on the app by create_app."""
+import json
+import sys
+
+import click
+from flask.cli import with_appcontext
+
+
+@click.command('import-users')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='Input format, guessed from the file extension by default.')
+@click.option('--batch-size', type=int, default=None, help='Rows per transaction, IMPORT_BATCH_SIZE by default.')
+@click.option('--workers', type=int, default=None,
+              help='Hashing processes, IMPORT_WORKERS by default (every core when unset).')
+@click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+              help='Checkpoint file used to resume an interrupted import.')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False), default=None,
+              help='Write rejected rows as NDJSON here instead of stderr.')
+@with_appcontext
+def import_users_command(source, fmt, batch_size, workers, checkpoint, errors_path):
+    """Bulk-import users from a CSV or NDJSON file ('-' reads stdin)."""
+    from flask import current_app
+    from services.bulk_import import UserImporter, read_rows
+
+    if batch_size is None:
+        batch_size = current_app.config['IMPORT_BATCH_SIZE']
+    if workers is None:
+        workers = current_app.config.get('IMPORT_WORKERS')
+    if fmt is None:
+        fmt = 'csv' if source.name.endswith('.csv') else 'ndjson'
+    report = open(errors_path, 'a', encoding='utf-8') if errors_path else sys.stderr
+
+    def write_error(error):
+        report.write(json.dumps(error) + '\n')
+
+    try:
+        # Every error goes to the report, none need to be kept in memory
+        importer = UserImporter(batch_size=batch_size, workers=workers,
+                                checkpoint=checkpoint, on_error=write_error, max_errors=0)
+        result = importer.run(read_rows(source, fmt))
+    finally:
+        if errors_path:
+            report.close()
+    click.echo(f"imported={result.imported} failed={result.failed} lastRow={result.last_row}")
+
+
+@click.command('migrate-uuid-keys')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows backfilled per transaction.')
+@with_appcontext
+def migrate_uuid_keys_command(batch_size):
+    """Convert the user and organization keys to binary UUIDs."""
+    from database import db
+    from migrations.uuid_keys import upgrade
+
+    upgrade(db.engine, batch_size=batch_size, log=click.echo)
+
+
+@click.command('migrate-org-name-search')
+@with_appcontext
+def migrate_org_name_search_command():
+    """Build the organization name search indexes."""
+    from database import db
+    from migrations.org_name_search import upgrade
+
+    upgrade(db.engine, log=click.echo)
+
+
+@click.command('migrate-lookup-indexes')
+@with_appcontext
+def migrate_lookup_indexes_command():
+    """Create the lower(email) and organization name indexes of older databases."""
+    from database import db
+    from migrations.lookup_indexes import upgrade
+
+    upgrade(db.engine, log=click.echo)
+
+
+@click.command('calibrate-bcrypt')
+@click.option('--target-ms', type=float, default=None, help='Hashing time to aim for, BCRYPT_TARGET_MS by default.')
+@click.option('--save', 'env_file', type=click.Path(dir_okay=False), default=None,
+              help='Store the cost as BCRYPT_LOG_ROUNDS in this dotenv file.')
+@with_appcontext
+def calibrate_bcrypt_command(target_ms, env_file):
+    """Pick the bcrypt cost whose hashes take about the target time here."""
+    import time
+    from flask import current_app
+    from services.hashing import bcrypt_hash, calibrate_rounds
+
+    if target_ms is None:
+        target_ms = current_app.config['BCRYPT_TARGET_MS']
+    rounds = calibrate_rounds(target_ms / 1000)
+    start = time.perf_counter()
+    bcrypt_hash(b'calibration', rounds)
+    click.echo(f"BCRYPT_LOG_ROUNDS={rounds} hashMs={(time.perf_counter() - start) * 1000:.0f}")
+    if env_file:
+        from dotenv import set_key
+        set_key(env_file, 'BCRYPT_LOG_ROUNDS', str(rounds), quote_mode='never')
+
+
+@click.command('generate-signing-key')
+@click.option('--algorithm', type=click.Choice(['EdDSA', 'ES256']), default='EdDSA', show_default=True)
+@click.option('--out', 'path', type=click.Path(dir_okay=False), required=True,
+              help='File to write the PEM private key to.')
+def generate_signing_key_command(algorithm, path):
+    """Write a new private key for signing access tokens, to list in JWT_KEY_FILES."""
+    import os
+    from services.signing import SigningKey, generate_signing_key
+
+    pem = generate_signing_key(algorithm)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, 'wb') as handle:
+        handle.write(pem)
+    click.echo(f"kid={SigningKey.from_pem(pem).kid} algorithm={algorithm}")
+
+
+def register_commands(app):
+    """Adds the CLI commands to app."""
+    app.cli.add_command(import_users_command)
+    app.cli.add_command(migrate_uuid_keys_command)
+    app.cli.add_command(migrate_org_name_search_command)
+    app.cli.add_command(migrate_lookup_indexes_command)
+    app.cli.add_command(calibrate_bcrypt_command)
+    app.cli.add_command(generate_signing_key_command)
@@ -0,0 +1,53 @@
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from services import metrics
+
+_listening = False
+
+
+def install_metrics(app):
+    """
+    Records the latency, SQL statement count and SQL time of every request
+    of app. Nothing is installed while METRICS_ENABLED is off.
+    """
+    global _listening
+    if not metrics.enabled:
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listening = True
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_queries = 0
+    g.metrics_query_seconds = 0.0
+
+
+def _finish_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.request_duration.observe(time.perf_counter() - start, endpoint, request.method, response.status_code)
+    metrics.request_queries.observe(g.pop('metrics_queries', 0), endpoint, request.method)
+    metrics.request_query_duration.observe(g.pop('metrics_query_seconds', 0.0), endpoint, request.method)
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if metrics.enabled and has_request_context():
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts or not has_request_context() or 'metrics_queries' not in g:
+        return
+    g.metrics_queries += 1
+    g.metrics_query_seconds += time.perf_counter() - starts.pop()
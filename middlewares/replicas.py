@@ -0,0 +1,14 @@
+from functools import wraps
+from flask import g
+
+
+def read_only(func: callable) -> callable:
+    """
+    Marks a view that only reads, so its queries may go to a read replica
+    (see services.replicas.ReplicaRouter). Writes still go to the primary.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return func(*args, **kwargs)
+    return wrapper
@@ -1,17 +1,50 @@
+import hmac
 from functools import wraps
-from flask import jsonify, request, session
-import jwt
-import os
+from flask import current_app, g, request
 from models import User, Organization
 from app import db
+from schemas import PayloadError, RegisterPayload, json_response
+from services import decode_access_token, login_throttle
+
+class AuthContext:
+    """
+    The verified access token of a request and its user, kept on g.auth.
+
+    The user is only read when a view asks for it, and then only the
+    columns it names, once per request for each set of columns.
+    """
+
+    def __init__(self, claims: dict):
+        self.claims = claims
+        self.user_id = claims['userId']
+        self._rows = {}
+
+    def user(self, *columns):
+        """Returns a Row of the named User columns (default userId), or None if the user is gone."""
+        columns = columns or ('userId',)
+        if columns not in self._rows:
+            self._rows[columns] = User.columns_by_id(self.user_id, columns)
+        return self._rows[columns]
+
+    def exists(self) -> bool:
+        """Returns True if the user still exists, answered by any row loaded already."""
+        for row in self._rows.values():
+            return row is not None
+        return self.user() is not None
+
 
 def protected_route(func: callable) -> callable:
-    """This will protect every route that this decorator is applied to."""
+    """
+    This will protect every route that this decorator is applied to.
+
+    The verified token and its user are available to the view as g.auth,
+    an AuthContext. Nothing is written to the cookie session.
+    """
     @wraps(func)
     def wrapper(*args, **kwargs):
         authorization = request.headers.get('Authorization')
         if authorization is None:
-            return jsonify(
+            return json_response(
                 {
                     "errors": [
                         {
@@ -21,7 +54,7 @@ def protected_route(func: callable) -> callable:
                 }
             ), 401
         if not authorization.startswith('Bearer '):
-            return jsonify(
+            return json_response(
                 {
                     "errors": [
                         {
@@ -32,7 +65,7 @@ def protected_route(func: callable) -> callable:
             ), 401
         token = authorization.split(' ')[1]
         if token == "":
-            return jsonify(
+            return json_response(
                 {
                     "errors": [
                         {
@@ -41,11 +74,11 @@ def protected_route(func: callable) -> callable:
                     ]
                 }
             ), 401
+        import jwt
         try:
-            payload = jwt.decode(token, os.environ.get('SECRET_KEY'), algorithms=['HS256'])
-            session['user_id'] = payload['userId']
+            g.auth = AuthContext(decode_access_token(token))
         except jwt.ExpiredSignatureError:
-            return jsonify(
+            return json_response(
                 {
                     "errors": [
                         {
@@ -55,7 +88,7 @@ def protected_route(func: callable) -> callable:
                 }
             ), 401
         except jwt.InvalidTokenError:
-            return jsonify(
+            return json_response(
                 {
                     "errors": [
                         {
@@ -68,46 +101,69 @@ def protected_route(func: callable) -> callable:
     return wrapper
 
 
-def validate_user(func: callable) -> callable:
+def admin_route(func: callable) -> callable:
     """
-    This is a decorator function that validates the userId in the request.
+    Allows the request only if its X-Admin-Key header matches ADMIN_API_KEY.
+
+    Admin routes are disabled while ADMIN_API_KEY is unset.
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        register_args = request.get_json()
-        errors = { "errors": [] }
-        obj = {
-            "firstName": register_args.get('firstName'),
-            "lastName": register_args.get('lastName'),
-            "email": register_args.get('email'),
-            "password": register_args.get('password'),
-        }
-        user = User.query.filter_by(email=obj['email']).first()
-        if user is not None:
-            errors["errors"].append(
-                {
-                    "field": "email",
-                    "message": "Email already exists"
-                }
-            )
-        phone = register_args.get('phone')
-        for key, value in obj.items():
-            if value is None or value == "" or not isinstance(value, str):
-                errors["errors"].append(
-                    {
-                        "field": key,
-                        "message": "This field is required and must be a string"
-                    }
-                )
- 
-        if phone is not None and not isinstance(phone, str):
-            errors["errors"].append(
-                {
-                    "field": "phone",
-                    "message": "This field must be a string"
-                }
-            )
-        if errors["errors"]:
-            return jsonify(errors), 422
+        expected = current_app.config.get('ADMIN_API_KEY')
+        provided = request.headers.get('X-Admin-Key', '')
+        if not expected or not hmac.compare_digest(provided.encode('utf-8'), expected.encode('utf-8')):
+            return json_response({
+                "status": "Forbidden",
+                "message": "Admin access required",
+                "statusCode": 403
+            }), 403
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def validate_payload(schema) -> callable:
+    """
+    Decodes the JSON body into the msgspec Struct schema and stores it on
+    g.payload. Invalid bodies are answered with a 422 listing the field errors.
+    """
+    def decorator(func: callable) -> callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                g.payload = schema.decode(request.get_data())
+            except PayloadError as e:
+                return json_response({"errors": e.errors}), 422
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def throttle_login(func: callable) -> callable:
+    """
+    Rejects the login with a 429 once its email or client IP ran out of
+    attempts, before the user is looked up or the password checked.
+
+    It reads the email from g.payload, so it goes below validate_payload.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retry_after = login_throttle.attempt(g.payload.email, request.remote_addr)
+        if retry_after is not None:
+            return json_response({
+                "status": "Too many requests",
+                "message": "Too many login attempts, try again later",
+                "statusCode": 429
+            }), 429, {"Retry-After": str(retry_after)}
         return func(*args, **kwargs)
     return wrapper
+
+
+def validate_user(func: callable) -> callable:
+    """
+    This is a decorator function that validates the registration payload
+    and stores it on g.payload.
+
+    It does not query for duplicate emails. register() relies on the
+    unique email index and maps its violation to the same 422 error.
+    """
+    return validate_payload(RegisterPayload)(func)
@@ -0,0 +1,58 @@
+"""
+Creates the lookup indexes of databases made before they were declared
+(schema version 4):
+
+    ix_user_email_lower: unique lower(email), behind User.by_email and the
+        case-insensitive email uniqueness registration relies on.
+    ix_organization_name: organization.name, behind the name clash check.
+
+Databases created from the models already have them, and then only get
+the new version stamped. PostgreSQL builds them CONCURRENTLY.
+
+Emails that differ only in case must be merged by hand first: the
+migration lists them and stops.
+
+Run it with `flask --app app migrate-lookup-indexes` after
+migrate-org-name-search. It is a no-op at version 4.
+"""
+from sqlalchemy import text
+
+# (index, definition, unique)
+INDEXES = (
+    ('ix_user_email_lower', 'ON "user" (lower(email))', True),
+    ('ix_organization_name', 'ON organization (name)', False),
+)
+
+
+def upgrade(engine, log=print):
+    """Creates the lookup indexes of engine's database and stamps version 4."""
+    from migrations.org_name_search import create_index_concurrently
+    from migrations.version import SchemaVersionError, current_version, stamp
+
+    with engine.connect() as conn:
+        version = current_version(conn)
+        if version is not None and version >= 4:
+            log("lookup indexes: already migrated")
+            return
+        if version != 3:
+            raise SchemaVersionError(
+                f"the database schema is at version {version}, run `flask --app app migrate-org-name-search` first")
+        duplicates = conn.execute(text(
+            'SELECT lower(email) FROM "user" GROUP BY lower(email) HAVING count(*) > 1 LIMIT 20'
+        )).scalars().all()
+    if duplicates:
+        raise SchemaVersionError(
+            "emails registered more than once in different case, merge them first: " + ", ".join(duplicates))
+    if engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as autocommit:
+            for name, definition, unique in INDEXES:
+                create_index_concurrently(autocommit, name, definition, unique)
+    else:
+        with engine.begin() as conn:
+            for name, definition, unique in INDEXES:
+                kind = 'UNIQUE INDEX' if unique else 'INDEX'
+                conn.execute(text(f'CREATE {kind} IF NOT EXISTS {name} {definition}'))
+    log("lookup indexes: built")
+    with engine.begin() as conn:
+        stamp(conn, 4)
+    log("lookup indexes: done")
@@ -0,0 +1,59 @@
+"""
+Adds the indexes behind GET /api/organisations/search (schema version 3).
+
+PostgreSQL gets the pg_trgm extension, a text_pattern_ops btree on
+lower(organization.name) for prefix matches and a trigram GIN index on
+it for fuzzy matches. Both are built CONCURRENTLY, so the application
+keeps serving while they build.
+
+Other databases search an in-process index (services.search) and only
+get the new version stamped.
+
+Run it with `flask --app app migrate-org-name-search` once the keys are
+migrated. It is a no-op at version 3.
+"""
+from sqlalchemy import text
+
+# (index, definition)
+INDEXES = (
+    ('ix_organization_name_lower_pattern', 'ON organization (lower(name) text_pattern_ops)'),
+    ('ix_organization_name_trgm', 'ON organization USING gin (lower(name) gin_trgm_ops)'),
+)
+
+
+def upgrade(engine, log=print):
+    """Builds the name search indexes of engine's database and stamps version 3."""
+    from migrations.version import SchemaVersionError, current_version, stamp
+
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version is not None and version >= 3:
+        log("org name search: already migrated")
+        return
+    if version != 2:
+        raise SchemaVersionError(
+            f"the database schema is at version {version}, run `flask --app app migrate-uuid-keys` first")
+    if engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as autocommit:
+            autocommit.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            for name, definition in INDEXES:
+                create_index_concurrently(autocommit, name, definition)
+        log("org name search: indexes built")
+    with engine.begin() as conn:
+        stamp(conn, 3)
+    log("org name search: done")
+
+
+def create_index_concurrently(autocommit, name, definition, unique=False):
+    """
+    Builds the PostgreSQL index name, e.g. with definition 'ON t (c)',
+    without blocking writes. autocommit is a connection in AUTOCOMMIT mode.
+    """
+    # A build that failed halfway leaves an invalid index behind
+    invalid = autocommit.execute(text(
+        'SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)'
+    ), {"name": name}).scalar()
+    if invalid:
+        autocommit.execute(text(f'DROP INDEX CONCURRENTLY {name}'))
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    autocommit.execute(text(f'CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} {definition}'))
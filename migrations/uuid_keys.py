@@ -0,0 +1,205 @@
+"""
+Converts user.userId, organization.orgId and both user_organization
+columns from uuid text to UUIDKey storage.
+
+PostgreSQL is migrated online. Shadow uuid columns are added, kept in
+sync by triggers and backfilled in small batches while the application
+keeps serving. Their indexes are built CONCURRENTLY. Only the final swap
+takes a short ACCESS EXCLUSIVE lock, and the foreign keys are validated
+after it.
+
+SQLite cannot alter column types, so its tables are rebuilt and copied in
+batches inside one transaction. Other databases are not supported.
+
+Run it with `flask --app app migrate-uuid-keys`. It is a no-op once the
+columns are converted, and a PostgreSQL run that stopped before the swap
+resumes when started again.
+"""
+import uuid
+
+from sqlalchemy import inspect, text
+
+# (table, text column, shadow column)
+COLUMNS = (
+    ('user', 'userId', 'userId_uuid'),
+    ('organization', 'orgId', 'orgId_uuid'),
+    ('user_organization', 'user_id', 'user_id_uuid'),
+    ('user_organization', 'organization_id', 'organization_id_uuid'),
+)
+
+# The SQLite schema this migration starts from
+TEXT_KEY_SCHEMA = (
+    'CREATE TABLE user ("userId" VARCHAR NOT NULL, "firstName" VARCHAR NOT NULL, "lastName" VARCHAR NOT NULL, '
+    'email VARCHAR NOT NULL, password VARCHAR NOT NULL, phone VARCHAR, PRIMARY KEY ("userId"), UNIQUE ("userId"), '
+    'UNIQUE (email))',
+    'CREATE UNIQUE INDEX ix_user_email_lower ON user (lower(email))',
+    'CREATE TABLE organization ("orgId" VARCHAR NOT NULL, name VARCHAR NOT NULL, description VARCHAR, '
+    'PRIMARY KEY ("orgId"), UNIQUE ("orgId"))',
+    'CREATE INDEX ix_organization_name ON organization (name)',
+    'CREATE TABLE user_organization (user_id VARCHAR NOT NULL, organization_id VARCHAR NOT NULL, '
+    'PRIMARY KEY (user_id, organization_id), FOREIGN KEY(user_id) REFERENCES user ("userId"), '
+    'FOREIGN KEY(organization_id) REFERENCES organization ("orgId"))',
+    'CREATE INDEX ix_user_organization_organization_id_user_id ON user_organization (organization_id, user_id)',
+)
+
+
+def needs_upgrade(engine) -> bool:
+    """Returns True while user.userId still holds text."""
+    inspector = inspect(engine)
+    if not inspector.has_table('user'):
+        return False
+    column = next(c for c in inspector.get_columns('user') if c['name'] == 'userId')
+    type_name = str(column['type']).upper()
+    if engine.dialect.name == 'postgresql':
+        return type_name != 'UUID'
+    return 'BLOB' not in type_name and 'BINARY' not in type_name
+
+
+def upgrade(engine, batch_size=10000, log=print):
+    """Migrates the key columns of engine's database, batch_size rows at a time."""
+    if not needs_upgrade(engine):
+        log("uuid keys: already migrated")
+        return
+    if engine.dialect.name == 'postgresql':
+        _upgrade_postgresql(engine, batch_size, log)
+    else:
+        _upgrade_rebuild(engine, batch_size, log)
+    from migrations.version import stamp
+    with engine.begin() as conn:
+        stamp(conn, 2)
+    log("uuid keys: done")
+
+
+def _has_constraint(conn, table, name) -> bool:
+    """Returns True if the PostgreSQL table has a constraint called name."""
+    return conn.execute(text(
+        'SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(:table) AND conname = :name)'
+    ), {"table": f'"{table}"', "name": name}).scalar()
+
+
+def _upgrade_postgresql(engine, batch_size, log):
+    autocommit = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+    try:
+        # 1. Shadow columns, filled by triggers for rows written meanwhile
+        for table, column, shadow in COLUMNS:
+            autocommit.execute(text(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS "{shadow}" uuid'))
+        for table in ('user', 'organization', 'user_organization'):
+            assignments = '; '.join(
+                f'NEW."{shadow}" := NEW."{column}"::uuid'
+                for t, column, shadow in COLUMNS if t == table
+            )
+            autocommit.execute(text(f'''
+                CREATE OR REPLACE FUNCTION "{table}_uuid_sync"() RETURNS trigger AS $$
+                BEGIN {assignments}; RETURN NEW; END $$ LANGUAGE plpgsql
+            '''))
+            autocommit.execute(text(f'DROP TRIGGER IF EXISTS "{table}_uuid_sync" ON "{table}"'))
+            autocommit.execute(text(f'''
+                CREATE TRIGGER "{table}_uuid_sync" BEFORE INSERT OR UPDATE ON "{table}"
+                FOR EACH ROW EXECUTE FUNCTION "{table}_uuid_sync"()
+            '''))
+
+        # 2. Batched backfill, one short transaction per batch
+        for table, column, shadow in COLUMNS:
+            total = 0
+            while True:
+                updated = autocommit.execute(text(f'''
+                    UPDATE "{table}" SET "{shadow}" = "{column}"::uuid
+                    WHERE ctid IN (SELECT ctid FROM "{table}" WHERE "{shadow}" IS NULL LIMIT :n)
+                '''), {"n": batch_size}).rowcount
+                total += updated
+                if updated < batch_size:
+                    break
+            log(f"uuid keys: backfilled {total} rows of {table}.{column}")
+
+        # 3. NOT NULL proofs and indexes, built without blocking writes
+        for table, column, shadow in COLUMNS:
+            # Left behind by a run that stopped before the swap
+            if not _has_constraint(autocommit, table, f'{shadow}_not_null'):
+                autocommit.execute(text(
+                    f'ALTER TABLE "{table}" ADD CONSTRAINT "{shadow}_not_null" '
+                    f'CHECK ("{shadow}" IS NOT NULL) NOT VALID'))
+            autocommit.execute(text(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "{shadow}_not_null"'))
+        autocommit.execute(text(
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "user_pkey_uuid" ON "user" ("userId_uuid")'))
+        autocommit.execute(text(
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "organization_pkey_uuid" ON organization ("orgId_uuid")'))
+        autocommit.execute(text(
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "user_organization_pkey_uuid" '
+            'ON user_organization (user_id_uuid, organization_id_uuid)'))
+        autocommit.execute(text(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_user_organization_organization_id_user_id_uuid" '
+            'ON user_organization (organization_id_uuid, user_id_uuid)'))
+        log("uuid keys: indexes built")
+    finally:
+        autocommit.close()
+
+    # 4. The swap, the only step that blocks traffic
+    with engine.begin() as conn:
+        conn.execute(text('LOCK TABLE "user", organization, user_organization IN ACCESS EXCLUSIVE MODE'))
+        for table in ('user', 'organization', 'user_organization'):
+            conn.execute(text(f'DROP TRIGGER "{table}_uuid_sync" ON "{table}"'))
+            conn.execute(text(f'DROP FUNCTION "{table}_uuid_sync"()'))
+        for table, column, shadow in COLUMNS:
+            conn.execute(text(f'ALTER TABLE "{table}" ALTER COLUMN "{shadow}" SET NOT NULL'))
+            conn.execute(text(f'ALTER TABLE "{table}" DROP CONSTRAINT "{shadow}_not_null"'))
+        # CASCADE drops the old primary keys, unique constraints, foreign keys and indexes
+        for table, column, shadow in reversed(COLUMNS):
+            conn.execute(text(f'ALTER TABLE "{table}" DROP COLUMN "{column}" CASCADE'))
+            conn.execute(text(f'ALTER TABLE "{table}" RENAME COLUMN "{shadow}" TO "{column}"'))
+        conn.execute(text('ALTER TABLE "user" ADD CONSTRAINT user_pkey PRIMARY KEY USING INDEX "user_pkey_uuid"'))
+        conn.execute(text(
+            'ALTER TABLE organization ADD CONSTRAINT organization_pkey PRIMARY KEY USING INDEX "organization_pkey_uuid"'))
+        conn.execute(text(
+            'ALTER TABLE user_organization ADD CONSTRAINT user_organization_pkey '
+            'PRIMARY KEY USING INDEX "user_organization_pkey_uuid"'))
+        conn.execute(text(
+            'ALTER INDEX "ix_user_organization_organization_id_user_id_uuid" '
+            'RENAME TO ix_user_organization_organization_id_user_id'))
+        conn.execute(text(
+            'ALTER TABLE user_organization ADD CONSTRAINT user_organization_user_id_fkey '
+            'FOREIGN KEY (user_id) REFERENCES "user" ("userId") NOT VALID'))
+        conn.execute(text(
+            'ALTER TABLE user_organization ADD CONSTRAINT user_organization_organization_id_fkey '
+            'FOREIGN KEY (organization_id) REFERENCES organization ("orgId") NOT VALID'))
+    log("uuid keys: columns swapped")
+
+    # 5. Validate the foreign keys without blocking writes
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE user_organization VALIDATE CONSTRAINT user_organization_user_id_fkey'))
+        conn.execute(text('ALTER TABLE user_organization VALIDATE CONSTRAINT user_organization_organization_id_fkey'))
+
+
+def _upgrade_rebuild(engine, batch_size, log):
+    from models import User, Organization, user_organization
+
+    tables = (User.__table__, Organization.__table__, user_organization)
+    key_columns = {(table, column) for table, column, _ in COLUMNS}
+    with engine.begin() as conn:
+        for table in tables:
+            # Index names are global in SQLite; sql is NULL for the automatic ones
+            indexes = conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table AND sql IS NOT NULL"
+            ), {"table": table.name}).scalars().all()
+            for name in indexes:
+                conn.execute(text(f'DROP INDEX "{name}"'))
+            conn.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{table.name}_text_keys"'))
+        for table in tables:
+            table.create(conn)
+        for table in tables:
+            names = [c.name for c in table.columns]
+            column_list = ', '.join(f'"{name}"' for name in names)
+            result = conn.execute(text(f'SELECT {column_list} FROM "{table.name}_text_keys"'))
+            copied = 0
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                conn.execute(table.insert(), [
+                    {name: (str(uuid.UUID(value)) if (table.name, name) in key_columns else value)
+                     for name, value in zip(names, row)}
+                    for row in rows
+                ])
+                copied += len(rows)
+            log(f"uuid keys: copied {copied} rows of {table.name}")
+        for table in reversed(tables):
+            conn.execute(text(f'DROP TABLE "{table.name}_text_keys"'))
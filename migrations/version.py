@@ -0,0 +1,66 @@
+"""
+Schema versioning, checked by create_app instead of running create_all
+on every start.
+
+The schema_version table holds one row with the version of the schema
+in the database. An up-to-date database costs two cheap queries at
+startup; an empty one gets the full schema and is stamped.
+"""
+from sqlalchemy import Column, Integer, delete, inspect, select
+
+from database import db
+
+# 1: text keys, 2: binary uuid keys (migrate-uuid-keys),
+# 3: organization name search indexes (migrate-org-name-search),
+# 4: email and organization name lookup indexes (migrate-lookup-indexes)
+SCHEMA_VERSION = 4
+
+# The command that upgrades a database from each older version
+UPGRADE_COMMANDS = {1: 'migrate-uuid-keys', 2: 'migrate-org-name-search', 3: 'migrate-lookup-indexes'}
+
+schema_version = db.Table('schema_version', Column('version', Integer, nullable=False))
+
+
+class SchemaVersionError(RuntimeError):
+    """Raised when the database schema does not match SCHEMA_VERSION."""
+
+
+def current_version(connection):
+    """Returns the version stamped in the database, or None if there is none."""
+    if not inspect(connection).has_table('schema_version'):
+        return None
+    return connection.execute(select(schema_version.c.version)).scalar()
+
+
+def stamp(connection, version=SCHEMA_VERSION):
+    """Records version as the schema version of the database."""
+    schema_version.create(connection, checkfirst=True)
+    connection.execute(delete(schema_version))
+    connection.execute(schema_version.insert().values(version=version))
+
+
+def ensure_schema(connection):
+    """
+    Checks that the database is at SCHEMA_VERSION, creating and stamping
+    the schema when it has no version yet.
+
+    Raises SchemaVersionError when the database needs a migration or was
+    migrated by newer code.
+    """
+    import models  # noqa: F401, registers every table on db.metadata
+    from migrations.uuid_keys import needs_upgrade
+
+    version = current_version(connection)
+    if version == SCHEMA_VERSION:
+        return
+    if version is None:
+        # Empty, or created before versions were recorded
+        if needs_upgrade(connection):
+            raise SchemaVersionError("the database has text keys, run `flask --app app migrate-uuid-keys`")
+        db.metadata.create_all(connection)
+        stamp(connection)
+        return
+    if version < SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"the database schema is at version {version}, run `flask --app app {UPGRADE_COMMANDS[version]}`")
+    raise SchemaVersionError(f"the database schema is at version {version}, newer than {SCHEMA_VERSION}")
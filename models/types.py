@@ -0,0 +1,42 @@
+import uuid
+from sqlalchemy import LargeBinary
+from sqlalchemy.types import TypeDecorator
+
+
+class UUIDKey(TypeDecorator):
+    """
+    A uuid column that the application sees as its canonical 36-character
+    string.
+
+    It is stored as the native uuid type on PostgreSQL and as 16 raw bytes
+    elsewhere, so keys, indexes and joins are a third of the size of the
+    text form. Strings that are not uuids bind as NULL, which never matches
+    a row, so looking up a malformed id behaves like looking up an unknown one.
+    """
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            from sqlalchemy.dialects import postgresql
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=True))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            try:
+                value = uuid.UUID(str(value))
+            except ValueError:
+                return None
+        return value if dialect.name == 'postgresql' else value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == 'postgresql':
+            return str(value)
+        # Same text as str(uuid.UUID(bytes=value)), a few times faster on large reads
+        digits = value.hex()
+        return f'{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}'
@@ -1,21 +1,46 @@
+from sqlalchemy import DDL, and_, event, exists, func, select, update
 from database import db
+from models.types import UUIDKey
 
 # Association table for the many-to-many relationship
 user_organization = db.Table('user_organization',
-    db.Column('user_id', db.String, db.ForeignKey('user.userId'), primary_key=True),
-    db.Column('organization_id', db.String, db.ForeignKey('organization.orgId'), primary_key=True)
+    db.Column('user_id', UUIDKey, db.ForeignKey('user.userId'), primary_key=True),
+    db.Column('organization_id', UUIDKey, db.ForeignKey('organization.orgId'), primary_key=True),
+    # The primary key serves lookups by user, this serves lookups by organization
+    db.Index('ix_user_organization_organization_id_user_id', 'organization_id', 'user_id'),
 )
 
+
+def membership_exists(user_id, org_id):
+    """Returns an EXISTS clause that is true when user_id belongs to org_id."""
+    return exists().where(and_(
+        user_organization.c.user_id == user_id,
+        user_organization.c.organization_id == org_id,
+    ))
+
+
+def membership_name_exists(user_id, name):
+    """Returns an EXISTS clause that is true when user_id belongs to an organization called name."""
+    return exists().where(and_(
+        Organization.name == name,
+        user_organization.c.organization_id == Organization.orgId,
+        user_organization.c.user_id == user_id,
+    ))
+
+
 class User(db.Model):
     """
     This is the user class. It represents a user in the database.
 
     Attributes:
-        userId (str): The primary key of the user.
+        userId (str): The primary key of the user, a uuid stored in binary form.
         email (str): The email of user. It is unique and cannot be null.
     """
     __tablename__ = 'user'
-    userId = db.Column(db.String, primary_key=True, unique=True)
+    # The columns of a profile, all but the password hash
+    PROFILE_COLUMNS = ('userId', 'firstName', 'lastName', 'email', 'phone')
+
+    userId = db.Column(UUIDKey, primary_key=True, unique=True)
     firstName = db.Column(db.String, nullable=False)
     lastName = db.Column(db.String, nullable=False)
     email = db.Column(db.String, unique=True, nullable=False)
@@ -23,10 +48,238 @@ class User(db.Model):
     phone = db.Column(db.String)
     organizations = db.relationship('Organization', secondary=user_organization, backref=db.backref('users', lazy='dynamic'))
 
+    __table_args__ = (
+        # Case-insensitive uniqueness, also the index behind by_email()
+        db.Index('ix_user_email_lower', func.lower(email), unique=True),
+    )
+
+    @classmethod
+    def by_email(cls, email):
+        """Returns the user whose email matches case-insensitively, or None."""
+        return cls.query.filter(func.lower(cls.email) == func.lower(email)).first()
+
+    # The unique constraints on email: PostgreSQL's name for UNIQUE (email) and the lower(email) index
+    EMAIL_CONSTRAINTS = ('user_email_key', 'ix_user_email_lower')
+    # How SQLite names the same two in "UNIQUE constraint failed: ..." messages
+    SQLITE_EMAIL_TARGETS = ('user.email', "index 'ix_user_email_lower'")
+
+    @classmethod
+    def is_email_conflict(cls, error) -> bool:
+        """
+        Returns True if the IntegrityError error comes from a unique email
+        constraint. PostgreSQL drivers report the constraint name; for
+        SQLite the targets of its UNIQUE message are matched.
+        """
+        orig = getattr(error, 'orig', error)
+        # psycopg2 keeps it in diag, asyncpg on the error under SQLAlchemy's adapter
+        constraint = getattr(getattr(orig, 'diag', None), 'constraint_name', None)
+        if constraint is None:
+            cause = getattr(orig, '__cause__', None)
+            constraint = getattr(cause, 'constraint_name', None) or getattr(orig, 'constraint_name', None)
+        if constraint is not None:
+            return constraint in cls.EMAIL_CONSTRAINTS
+        message = str(orig)
+        prefix = 'UNIQUE constraint failed: '
+        if not message.startswith(prefix):
+            return False
+        targets = {target.strip() for target in message[len(prefix):].split(',')}
+        return not targets.isdisjoint(cls.SQLITE_EMAIL_TARGETS)
+
+    @classmethod
+    def exists(cls, user_id) -> bool:
+        """Returns True if a user with user_id exists, without loading the row."""
+        return db.session.query(exists().where(cls.userId == user_id)).scalar()
+
+    @classmethod
+    def columns_by_id(cls, user_id, columns):
+        """Returns a Row of the named columns of user_id, or None, without loading the whole User."""
+        return db.session.execute(select(*(getattr(cls, name) for name in columns)).where(cls.userId == user_id)).first()
+
+    @classmethod
+    def existing_ids(cls, user_ids) -> set:
+        """Returns the subset of user_ids that exist, with one IN query."""
+        if not user_ids:
+            return set()
+        return set(db.session.scalars(select(cls.userId).where(cls.userId.in_(user_ids))))
+
+    @classmethod
+    def password_rehash(cls, user_id, old_hash, new_hash):
+        """Returns an UPDATE that swaps old_hash for new_hash, unless the password changed meanwhile."""
+        table = cls.__table__
+        return update(table).where(table.c.userId == user_id, table.c.password == old_hash).values(password=new_hash)
+
 
 class Organization(db.Model):
     """This class is the organization class where users can belong"""
     __tablename__ = 'organization'
-    orgId = db.Column(db.String, primary_key=True, unique=True)
-    name = db.Column(db.String, nullable=False)
+    orgId = db.Column(UUIDKey, primary_key=True, unique=True)
+    name = db.Column(db.String, nullable=False, index=True)
     description = db.Column(db.String, nullable=True)
+
+    __table_args__ = (
+        # PostgreSQL only, behind search_query(): prefix matches walk the btree,
+        # fuzzy matches the trigram index. Other databases search in process.
+        db.Index('ix_organization_name_lower_pattern', func.lower(name).label('name_lower'),
+                 postgresql_ops={'name_lower': 'text_pattern_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_organization_name_trgm', func.lower(name).label('name_lower'),
+                 postgresql_using='gin', postgresql_ops={'name_lower': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
+    @staticmethod
+    def is_member(user_id, org_id) -> bool:
+        """Returns True if user_id belongs to org_id. One indexed lookup on user_organization."""
+        return db.session.query(membership_exists(user_id, org_id)).scalar()
+
+    @staticmethod
+    def name_taken(user_id, name) -> bool:
+        """Returns True if user_id already belongs to an organization called name."""
+        return db.session.query(membership_name_exists(user_id, name)).scalar()
+
+    @staticmethod
+    def ids_for_member_query(user_id):
+        """Returns a select of the orgIds user_id belongs to, from the primary key alone."""
+        return select(user_organization.c.organization_id).where(user_organization.c.user_id == user_id)
+
+    @staticmethod
+    def ids_for_member(user_id) -> set:
+        """Returns the orgIds of every organization user_id belongs to, from the primary key alone."""
+        return set(db.session.scalars(Organization.ids_for_member_query(user_id)))
+
+    @classmethod
+    def for_member(cls, user_id, org_id):
+        """Returns the organization org_id if user_id belongs to it, otherwise None."""
+        return (
+            cls.query
+            .join(user_organization, user_organization.c.organization_id == cls.orgId)
+            .filter(user_organization.c.user_id == user_id, cls.orgId == org_id)
+            .first()
+        )
+
+    @classmethod
+    def member_query(cls, user_id):
+        """Returns a select of the organizations user_id belongs to."""
+        return (
+            select(cls)
+            .join(user_organization, user_organization.c.organization_id == cls.orgId)
+            .where(user_organization.c.user_id == user_id)
+        )
+
+    @staticmethod
+    def member_users_query(org_id):
+        """Returns a select of the profile columns of the members of org_id, in userId order."""
+        return (
+            select(*(getattr(User, name) for name in User.PROFILE_COLUMNS))
+            .join(user_organization, user_organization.c.user_id == User.userId)
+            .where(user_organization.c.organization_id == org_id)
+            .order_by(user_organization.c.user_id)
+        )
+
+    @classmethod
+    def names_for_member_query(cls, user_id):
+        """Returns a select of (orgId, name) of the organizations user_id belongs to."""
+        return (
+            select(cls.orgId, cls.name)
+            .join(user_organization, user_organization.c.organization_id == cls.orgId)
+            .where(user_organization.c.user_id == user_id)
+        )
+
+    @classmethod
+    def names_for_member(cls, user_id):
+        """Returns (orgId, name) rows of the organizations user_id belongs to."""
+        return db.session.execute(cls.names_for_member_query(user_id)).all()
+
+    @staticmethod
+    def in_order(org_ids, organizations) -> list:
+        """Returns organizations sorted like org_ids, skipping orgIds that were not found."""
+        found = {organization.orgId: organization for organization in organizations}
+        return [found[org_id] for org_id in org_ids if org_id in found]
+
+    @classmethod
+    def by_ids(cls, org_ids) -> list:
+        """Returns the organizations org_ids, in that order, with one IN query."""
+        if not org_ids:
+            return []
+        return cls.in_order(org_ids, db.session.scalars(select(cls).where(cls.orgId.in_(org_ids))))
+
+    @classmethod
+    def search_query(cls, user_id, text, fuzzy=False, limit=20):
+        """
+        Returns a select of the organizations of user_id whose name starts
+        with text, or with fuzzy, whose name is trigram-similar to it. Both
+        ignore case.
+
+        PostgreSQL only: prefixes use ix_organization_name_lower_pattern,
+        fuzzy matches the pg_trgm % operator over ix_organization_name_trgm,
+        best match first.
+        """
+        name = func.lower(cls.name)
+        text = text.lower()
+        query = cls.member_query(user_id)
+        if fuzzy:
+            query = query.where(name.op('%')(text)).order_by(func.similarity(name, text).desc())
+        else:
+            escaped = text.replace('/', '//').replace('%', '/%').replace('_', '/_')
+            query = query.where(name.like(escaped + '%', escape='/'))
+        return query.order_by(name, cls.orgId).limit(limit)
+
+    @classmethod
+    def member_page_query(cls, user_id, after=None, limit=50):
+        """
+        Returns a keyset-paginated select of the organizations user_id belongs
+        to, ordered by orgId and starting after the orgId after.
+
+        It fetches limit + 1 rows so callers can tell whether another page
+        follows. The scan runs over the (user_id, organization_id) primary
+        key, so each page costs the same wherever it starts.
+        """
+        query = cls.member_query(user_id)
+        if after is not None:
+            query = query.where(user_organization.c.organization_id > after)
+        return query.order_by(user_organization.c.organization_id).limit(limit + 1)
+
+    @staticmethod
+    def add_member(user_id, org_id):
+        """Inserts the membership row without loading either side's collection."""
+        db.session.execute(user_organization.insert().values(user_id=user_id, organization_id=org_id))
+
+    @staticmethod
+    def add_members_insert(dialect):
+        """
+        Returns the INSERT of membership rows that skips existing ones and
+        returns the inserted user_ids, or None when dialect has no ON CONFLICT.
+        """
+        if dialect not in ('postgresql', 'sqlite'):
+            return None
+        from sqlalchemy.dialects import postgresql, sqlite
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        return insert(user_organization).on_conflict_do_nothing().returning(user_organization.c.user_id)
+
+    @staticmethod
+    def add_members(org_id, user_ids) -> set:
+        """
+        Adds every user in user_ids to org_id with one multi-row INSERT that
+        skips rows which already exist.
+
+        Returns the set of user ids that were actually inserted.
+        """
+        if not user_ids:
+            return set()
+        rows = [{"user_id": user_id, "organization_id": org_id} for user_id in user_ids]
+        statement = Organization.add_members_insert(db.session.get_bind().dialect.name)
+        if statement is not None:
+            return set(db.session.scalars(statement, rows))
+        existing = set(db.session.scalars(
+            select(user_organization.c.user_id).where(
+                user_organization.c.organization_id == org_id,
+                user_organization.c.user_id.in_(user_ids),
+            )
+        ))
+        rows = [row for row in rows if row["user_id"] not in existing]
+        if rows:
+            db.session.execute(user_organization.insert(), rows)
+        return {row["user_id"] for row in rows}
+
+
+# The trigram operator class of ix_organization_name_trgm
+event.listen(Organization.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
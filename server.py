@@ -0,0 +1,253 @@
+"""
+Pre-fork launcher: a master process that binds the listening socket and
+keeps WORKERS uvicorn processes serving it.
+
+Each worker is forked from the master, which has imported the code, and
+builds its own app with the app factory, so database engines, hashing
+pools and caches are never shared across a fork.
+
+Signals handled by the master:
+    SIGHUP: graceful reload. New workers are started, then the old ones
+        stop accepting and finish their requests in flight.
+    SIGTERM, SIGINT: graceful stop, workers still running after
+        graceful_timeout seconds are killed.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import signal
+import socket
+import time
+
+log = logging.getLogger('server')
+
+# A worker exiting sooner than this after its start is restarted with a delay
+MIN_WORKER_LIFETIME = 1.0
+
+
+def bind_socket(host, port, reuse_port=False, listen=True, backlog=2048):
+    """Returns a TCP socket bound to host and port, with SO_REUSEPORT set when reuse_port is true."""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    if listen:
+        sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class WsgiBridge:
+    """
+    Serves a WSGI app through asgiref's WsgiToAsgi, each request in a new
+    context.
+
+    uvicorn starts the next request of a keep-alive connection from the
+    task of the previous one, so it inherits asgiref's marker that the
+    single sync thread is taken and WsgiToAsgi fails it with "Single
+    thread executor already being used".
+    """
+
+    def __init__(self, wsgi_app):
+        from asgiref.wsgi import WsgiToAsgi
+        self.app = WsgiToAsgi(wsgi_app)
+
+    async def __call__(self, scope, receive, send):
+        # Tasks copy the current context when created, here an empty one
+        await contextvars.Context().run(asyncio.ensure_future, self.app(scope, receive, send))
+
+
+class RequestLimit:
+    """
+    ASGI middleware that makes the uvicorn server of a worker exit
+    gracefully after limit HTTP requests.
+
+    uvicorn's own limit_max_requests never counts the responses of the
+    Flask app behind WsgiToAsgi.
+    """
+
+    def __init__(self, app, limit):
+        self.app = app
+        self.limit = limit
+        self.served = 0
+        self.server = None
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if scope['type'] == 'http':
+            self.served += 1
+            if self.served >= self.limit and self.server is not None:
+                self.server.should_exit = True
+
+
+class Worker:
+    def __init__(self, pid, generation):
+        self.pid = pid
+        self.generation = generation
+        self.started_at = time.monotonic()
+        self.stop_deadline = None
+
+
+class Master:
+    """
+    Forks and supervises the workers.
+
+    Args:
+        app_factory: callable returning the app of a worker, a Flask app or
+            an ASGI app. Called once in each worker after the fork.
+        host, port: address to listen on.
+        workers (int): worker processes.
+        max_requests (int): requests after which a worker is replaced,
+            0 for never. Each worker draws its own limit up to
+            max_requests_jitter higher so they do not restart together.
+        graceful_timeout (float): seconds a stopping worker gets to finish
+            its requests in flight.
+        reuse_port (bool): each worker binds its own socket with
+            SO_REUSEPORT and the kernel spreads connections across them,
+            instead of every worker accepting from the master's socket.
+    """
+
+    def __init__(self, app_factory, host='0.0.0.0', port=5000, workers=1, max_requests=0,
+                 max_requests_jitter=0, graceful_timeout=30.0, reuse_port=False, log_level='info'):
+        if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            raise ValueError("SO_REUSEPORT is not supported on this platform")
+        self.app_factory = app_factory
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.reuse_port = reuse_port
+        self.log_level = log_level
+        self.socket = None
+        self.children = {}
+        self.generation = 0
+        self._signals = []
+        self._stopping = False
+
+    def run(self):
+        """Serves until SIGTERM or SIGINT, then returns once every worker exited."""
+        # With reuse_port the master only binds, to claim the port: the kernel
+        # would also hand connections to a listening socket nobody accepts on
+        self.socket = bind_socket(self.host, self.port, self.reuse_port, listen=not self.reuse_port)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+        log.info("master %s listening on %s:%s with %s workers", os.getpid(), self.host, self.port, self.workers)
+        self._spawn_generation()
+        while self.children or not self._stopping:
+            while self._signals:
+                self._handle(self._signals.pop(0))
+            self._reap()
+            self._kill_overdue()
+            if not self._stopping:
+                self._replace_missing()
+            time.sleep(0.1)
+        self.socket.close()
+        log.info("master %s stopped", os.getpid())
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _handle(self, signum):
+        if signum == signal.SIGHUP and not self._stopping:
+            log.info("reloading workers")
+            old = [worker for worker in self.children.values() if worker.generation == self.generation]
+            self.generation += 1
+            self._spawn_generation()
+            for worker in old:
+                self._stop(worker)
+        elif signum in (signal.SIGTERM, signal.SIGINT) and not self._stopping:
+            log.info("stopping workers")
+            self._stopping = True
+            for worker in self.children.values():
+                self._stop(worker)
+
+    def _spawn_generation(self):
+        for _ in range(self.workers):
+            self._spawn()
+
+    def _replace_missing(self):
+        current = [worker for worker in self.children.values() if worker.generation == self.generation]
+        for _ in range(self.workers - len(current)):
+            self._spawn()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = Worker(pid, self.generation)
+            return
+        status = 0
+        try:
+            self._serve()
+        except BaseException:
+            log.exception("worker %s failed", os.getpid())
+            status = 1
+        finally:
+            # Skip the master's atexit handlers and buffers
+            os._exit(status)
+
+    def _serve(self):
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        # Only the master reacts to a reload, e.g. one sent to the whole process group
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        random.seed()
+        sock = self.socket
+        if self.reuse_port:
+            sock.close()
+            sock = bind_socket(self.host, self.port, reuse_port=True)
+        app = self.app_factory()
+        from flask import Flask
+        if isinstance(app, Flask):
+            app = WsgiBridge(app)
+        import uvicorn
+        if self.max_requests:
+            app = RequestLimit(app, self.max_requests + random.randint(0, self.max_requests_jitter))
+        config = uvicorn.Config(app, log_level=self.log_level, timeout_graceful_shutdown=self.graceful_timeout)
+        server = uvicorn.Server(config)
+        if self.max_requests:
+            app.server = server
+        server.run(sockets=[sock])
+
+    def _stop(self, worker):
+        if worker.stop_deadline is None:
+            worker.stop_deadline = time.monotonic() + self.graceful_timeout
+            _signal(worker.pid, signal.SIGTERM)
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for worker in self.children.values():
+            if worker.stop_deadline is not None and now > worker.stop_deadline:
+                log.warning("killing worker %s after %ss", worker.pid, self.graceful_timeout)
+                _signal(worker.pid, signal.SIGKILL)
+                worker.stop_deadline = float('inf')
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            worker = self.children.pop(pid, None)
+            if worker is None or worker.stop_deadline is not None or self._stopping:
+                continue
+            # Recycled after max_requests, or crashed
+            code = os.waitstatus_to_exitcode(status)
+            log.info("worker %s exited with %s, replacing it", pid, code)
+            if time.monotonic() - worker.started_at < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+
+
+def _signal(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
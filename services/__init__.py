@@ -0,0 +1,11 @@
+from services.metrics import metrics
+from services.hashing import password_hasher, HashingUnavailable
+from services.memberships import membership_cache
+from services.profiles import profile_cache, profile_data
+from services.throttling import login_throttle
+from services.replicas import replica_router
+from services.revocation import revocation_list
+from services.search import organization_search
+from services.signing import key_ring
+from services.tokens import token_cache, encode_access_token, decode_access_token
+from services.pagination import InvalidPageRequest, encode_cursor, decode_cursor, parse_page_args
@@ -0,0 +1,307 @@
+"""
+Bulk user import: streams CSV or NDJSON rows, hashes passwords across all
+cores and inserts users, their default organization and the membership
+rows in large batches.
+"""
+import csv
+import functools
+import io
+import json
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from services.hashing import bcrypt_hash, password_hasher
+
+REQUIRED_FIELDS = ('firstName', 'lastName', 'email', 'password')
+
+
+class ImportResult:
+    """
+    Running totals of an import.
+
+    Attributes:
+        imported (int): rows committed as new users.
+        failed (int): rows rejected, see errors.
+        last_row (int): the last input row whose batch has been committed.
+        errors (list): one dict per rejected row with row, email and errors,
+            for the first max_errors rejected rows only.
+    """
+
+    def __init__(self, last_row=0, max_errors=1000):
+        self.imported = 0
+        self.failed = 0
+        self.last_row = last_row
+        self.max_errors = max_errors
+        self.errors = []
+
+    def add_error(self, error):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(error)
+
+    def to_dict(self):
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "lastRow": self.last_row,
+            "errors": self.errors,
+            "errorsTruncated": self.failed > len(self.errors),
+        }
+
+
+def read_rows(stream, fmt):
+    """
+    Yields (row_number, record, error) for each record of a text stream.
+
+    fmt is 'csv' (with a header line) or 'ndjson'. Rows are numbered from 1
+    and blank NDJSON lines are skipped, so numbering is stable across runs.
+    """
+    if fmt == 'csv':
+        for number, record in enumerate(csv.DictReader(stream), start=1):
+            yield number, record, None
+    elif fmt == 'ndjson':
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield number, None, "Invalid JSON"
+                continue
+            if not isinstance(record, dict):
+                yield number, None, "Expected a JSON object"
+                continue
+            yield number, record, None
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def validate_record(record):
+    """Returns the 422-style field errors of record, using the rules of validate_user."""
+    errors = []
+    for key in REQUIRED_FIELDS:
+        value = record.get(key)
+        if value is None or value == "" or not isinstance(value, str):
+            errors.append({"field": key, "message": "This field is required and must be a string"})
+    phone = record.get('phone')
+    if phone is not None and not isinstance(phone, str):
+        errors.append({"field": "phone", "message": "This field must be a string"})
+    return errors
+
+
+class Checkpoint:
+    """A JSON file holding the last committed row, so an interrupted import can resume."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Returns the last committed row, or 0 when there is no checkpoint."""
+        if self.path is None or not os.path.exists(self.path):
+            return 0
+        with open(self.path) as handle:
+            return json.load(handle).get('lastRow', 0)
+
+    def save(self, result):
+        """Atomically records the totals of result."""
+        if self.path is None:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as handle:
+            json.dump({"lastRow": result.last_row, "imported": result.imported, "failed": result.failed}, handle)
+        os.replace(tmp, self.path)
+
+
+class UserImporter:
+    """
+    Imports users in batches.
+
+    Each batch is validated, hashed in a process pool, checked for
+    duplicate emails with one IN query, then written with COPY on
+    PostgreSQL or executemany elsewhere and committed.
+
+    Args:
+        batch_size (int): rows per transaction.
+        workers (int): hashing processes, defaults to every core. 0 hashes inline.
+        checkpoint (str): path of the checkpoint file, or None.
+        on_error (callable): called with each error dict as it is produced.
+        rounds (int): bcrypt cost, defaults to the one of password_hasher.
+        max_errors (int): rejected rows whose errors the result keeps,
+            on_error still sees every one.
+    """
+
+    def __init__(self, batch_size=5000, workers=None, checkpoint=None, on_error=None, rounds=None,
+                 max_errors=1000):
+        self.batch_size = batch_size
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.rounds = password_hasher.rounds if rounds is None else rounds
+        self.checkpoint = Checkpoint(checkpoint)
+        self.on_error = on_error
+        self.max_errors = max_errors
+
+    def run(self, rows, start_after=None):
+        """
+        Imports rows as produced by read_rows and returns an ImportResult.
+
+        Rows numbered at or below start_after (default: the checkpoint) are skipped.
+        """
+        if start_after is None:
+            start_after = self.checkpoint.load()
+        result = ImportResult(last_row=start_after, max_errors=self.max_errors)
+        executor = None
+        if self.workers > 0:
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        try:
+            batch = []
+            for number, record, error in rows:
+                if number <= start_after:
+                    continue
+                if error is not None:
+                    self._reject(result, number, None, [{"field": None, "message": error}])
+                    continue
+                batch.append((number, record))
+                if len(batch) >= self.batch_size:
+                    self._import_batch(batch, result, executor)
+                    batch = []
+            if batch:
+                self._import_batch(batch, result, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return result
+
+    def _reject(self, result, number, email, errors):
+        error = {"row": number, "email": email, "errors": errors}
+        result.add_error(error)
+        if self.on_error is not None:
+            self.on_error(error)
+
+    def _import_batch(self, batch, result, executor):
+        from database import db
+        from models import User
+
+        valid = []
+        seen = set()
+        for number, record in batch:
+            errors = validate_record(record)
+            email = record.get('email')
+            if not errors and email.lower() in seen:
+                errors.append({"field": "email", "message": "Email already exists"})
+            if errors:
+                self._reject(result, number, email, errors)
+                continue
+            seen.add(email.lower())
+            valid.append((number, record))
+
+        existing = set()
+        if seen:
+            # Same case-insensitive comparison as the ix_user_email_lower unique index
+            lowered = func.lower(User.email)
+            existing = set(db.session.scalars(db.select(lowered).where(lowered.in_(seen))))
+        accepted = []
+        for number, record in valid:
+            if record['email'].lower() in existing:
+                self._reject(result, number, record['email'],
+                             [{"field": "email", "message": "Email already exists"}])
+            else:
+                accepted.append((number, record))
+
+        passwords = [record['password'].encode('utf-8') for _, record in accepted]
+        hash_password = functools.partial(bcrypt_hash, rounds=self.rounds)
+        if executor is None:
+            hashes = [hash_password(password) for password in passwords]
+        else:
+            chunksize = max(1, len(passwords) // (self.workers * 4))
+            hashes = list(executor.map(hash_password, passwords, chunksize=chunksize))
+
+        rows = []
+        for (number, record), hashed in zip(accepted, hashes):
+            userId = str(uuid.uuid4())
+            orgId = str(uuid.uuid4())
+            user = {
+                "userId": userId,
+                "firstName": record['firstName'],
+                "lastName": record['lastName'],
+                "email": record['email'],
+                "password": hashed.decode('utf-8'),
+                "phone": record.get('phone') or None,
+            }
+            organization = {"orgId": orgId, "name": f"{record['firstName']}'s Organisation", "description": None}
+            rows.append((number, user, organization, {"user_id": userId, "organization_id": orgId}))
+
+        try:
+            if rows:
+                _, users, organizations, memberships = (list(column) for column in zip(*rows))
+                insert_rows(db.session, users, organizations, memberships)
+            db.session.commit()
+            result.imported += len(rows)
+        except IntegrityError:
+            # E.g. a user registered with one of the emails since the IN query
+            db.session.rollback()
+            self._import_one_by_one(rows, result)
+        except Exception:
+            db.session.rollback()
+            raise
+        result.last_row = batch[-1][0]
+        self.checkpoint.save(result)
+
+    def _import_one_by_one(self, rows, result):
+        from database import db
+        from models import User
+
+        for number, user, organization, membership in rows:
+            try:
+                insert_rows(db.session, [user], [organization], [membership])
+                db.session.commit()
+            except IntegrityError as e:
+                db.session.rollback()
+                if User.is_email_conflict(e):
+                    errors = [{"field": "email", "message": "Email already exists"}]
+                else:
+                    errors = [{"field": None, "message": "Conflicts with an existing row"}]
+                self._reject(result, number, user['email'], errors)
+                continue
+            result.imported += 1
+
+
+def insert_rows(session, users, organizations, memberships):
+    """Writes the three row sets in the current transaction, with COPY on PostgreSQL."""
+    from models import User, Organization, user_organization
+
+    tables = (
+        (User.__table__, users),
+        (Organization.__table__, organizations),
+        (user_organization, memberships),
+    )
+    connection = session.connection()
+    if connection.dialect.name == 'postgresql':
+        cursor = connection.connection.cursor()
+        try:
+            for table, rows in tables:
+                columns = list(rows[0].keys())
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in rows:
+                    writer.writerow(['\\N' if row[c] is None else row[c] for c in columns])
+                buffer.seek(0)
+                column_list = ', '.join(f'"{c}"' for c in columns)
+                cursor.copy_expert(
+                    f'COPY "{table.name}" ({column_list}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')',
+                    buffer,
+                )
+        except connection.dialect.dbapi.IntegrityError as e:
+            # Raw cursor errors are not wrapped by SQLAlchemy
+            raise IntegrityError('COPY', None, e) from e
+        finally:
+            cursor.close()
+    else:
+        for table, rows in tables:
+            session.execute(table.insert(), rows)
@@ -0,0 +1,114 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+
+class ExpiringLRUCache:
+    """
+    A bounded, thread-safe LRU mapping whose entries each carry their own
+    expiry time.
+
+    Expired entries are never returned. They are dropped when looked up,
+    and on every insert the entries whose expiry has passed are swept from
+    a min-heap, so they don't take up room until LRU pressure removes them.
+
+    Attributes:
+        maxsize (int): the maximum number of live entries.
+        hits (int): lookups that returned a value.
+        misses (int): lookups that found nothing or an expired entry.
+    """
+
+    def __init__(self, maxsize=1024, clock=time.time):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._data = OrderedDict()
+        self._expiries = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count=True):
+        """Returns the live value stored under key, or default."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > self._clock():
+                    self._data.move_to_end(key)
+                    if count:
+                        self.hits += 1
+                    return value
+                del self._data[key]
+            if count:
+                self.misses += 1
+            return default
+
+    def set(self, key, value, expires_at=None):
+        """Stores value under key until the absolute time expires_at (None keeps it until evicted)."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._sweep()
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            if expires_at is not None:
+                heapq.heappush(self._expiries, (expires_at, key))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            if len(self._expiries) > 2 * self.maxsize:
+                # Stale heap items pile up when keys are overwritten or LRU-evicted
+                self._expiries = [(exp, k) for k, (_, exp) in self._data.items() if exp is not None]
+                heapq.heapify(self._expiries)
+
+    def delete(self, key):
+        """Removes key if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Removes every entry. The hit and miss counters are kept."""
+        with self._lock:
+            self._data.clear()
+            self._expiries = []
+
+    def stats(self):
+        """Returns the counters as a dict."""
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+    def _sweep(self):
+        now = self._clock()
+        expiries = self._expiries
+        while expiries and expiries[0][0] <= now:
+            expires_at, key = heapq.heappop(expiries)
+            entry = self._data.get(key)
+            if entry is not None and entry[1] == expires_at:
+                del self._data[key]
+
+
+def cache_from_url(url: str):
+    """
+    Returns a cachelib RedisCache for url, redis://[:password@]host[:port][/db]
+    or rediss:// for TLS.
+    """
+    from urllib.parse import unquote, urlsplit
+
+    parts = urlsplit(url)
+    if parts.scheme not in ('redis', 'rediss'):
+        raise ValueError(f"unsupported shared cache URL {url}, expected redis:// or rediss://")
+    from cachelib import RedisCache
+
+    options = {'ssl': True} if parts.scheme == 'rediss' else {}
+    return RedisCache(
+        host=parts.hostname or 'localhost',
+        port=parts.port or 6379,
+        password=unquote(parts.password) if parts.password else None,
+        db=int(parts.path.lstrip('/') or 0),
+        **options,
+    )
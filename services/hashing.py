@@ -0,0 +1,228 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from services.metrics import metrics
+
+
+class HashingUnavailable(Exception):
+    """Raised when the hashing pool is saturated or a job does not finish in time."""
+
+
+# The cost bcrypt.gensalt() picks by default
+DEFAULT_ROUNDS = 12
+
+
+def bcrypt_hash(password: bytes, rounds: int = DEFAULT_ROUNDS) -> bytes:
+    """Hashes password with a fresh salt at cost rounds. Runs inside a pool worker."""
+    import bcrypt
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def bcrypt_check(password: bytes, hashed: bytes) -> bool:
+    """Compares password against hashed. Runs inside a pool worker."""
+    import bcrypt
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed: str):
+    """Returns the cost of a bcrypt hash such as $2b$12$..., or None if it is not one."""
+    parts = hashed.split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def calibrate_rounds(target_seconds: float, min_rounds=10, max_rounds=20, probe_rounds=8, samples=3) -> int:
+    """
+    Returns the highest cost whose hash takes at most target_seconds on
+    this machine, but no less than min_rounds.
+
+    Each extra round doubles the work, so the time of one cheap probe
+    hash (the fastest of samples) is scaled up rather than trying every cost.
+    """
+    fastest = min(_time_hash(probe_rounds) for _ in range(samples))
+    rounds = min_rounds
+    for candidate in range(min_rounds, max_rounds + 1):
+        if fastest * 2 ** (candidate - probe_rounds) <= target_seconds:
+            rounds = candidate
+    return rounds
+
+
+def _time_hash(rounds):
+    start = time.perf_counter()
+    bcrypt_hash(b'calibration', rounds)
+    return time.perf_counter() - start
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt work in a bounded process pool so that it does not hold
+    the thread serving the request.
+
+    New hashes use the configured cost. Hashes of another cost still
+    verify, and are replaced with rehash_in_background after a
+    successful login, so that a new cost reaches every active user.
+
+    Configuration (read in init_app):
+        BCRYPT_POOL_SIZE (int): number of worker processes. 0 hashes inline.
+        BCRYPT_POOL_QUEUE_DEPTH (int): jobs allowed to wait for a worker.
+        BCRYPT_POOL_TIMEOUT (float): seconds to wait for a result.
+        BCRYPT_LOG_ROUNDS (int): bcrypt cost, see the calibrate-bcrypt command.
+    """
+
+    def __init__(self, app=None):
+        self.pool_size = os.cpu_count() or 1
+        self.queue_depth = 64
+        self.timeout = 5.0
+        self.rounds = DEFAULT_ROUNDS
+        self._pool = None
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Reads the pool settings from the app config."""
+        app.config.setdefault('BCRYPT_POOL_SIZE', os.cpu_count() or 1)
+        app.config.setdefault('BCRYPT_POOL_QUEUE_DEPTH', 64)
+        app.config.setdefault('BCRYPT_POOL_TIMEOUT', 5.0)
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)
+        self.configure(
+            pool_size=app.config['BCRYPT_POOL_SIZE'],
+            queue_depth=app.config['BCRYPT_POOL_QUEUE_DEPTH'],
+            timeout=app.config['BCRYPT_POOL_TIMEOUT'],
+            rounds=app.config['BCRYPT_LOG_ROUNDS'],
+        )
+        app.extensions['password_hasher'] = self
+
+    def configure(self, pool_size, queue_depth, timeout, rounds=None):
+        """Applies new pool settings, replacing a running pool if the size changed."""
+        with self._lock:
+            if rounds is not None:
+                self.rounds = int(rounds)
+            if self._pool is not None and pool_size != self.pool_size:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            self.pool_size = int(pool_size)
+            self.queue_depth = int(queue_depth)
+            self.timeout = float(timeout)
+            self._slots = threading.BoundedSemaphore(self.pool_size + self.queue_depth)
+
+    def shutdown(self):
+        """Stops the worker processes."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    # spawn keeps database connections and locks of the
+                    # serving process out of the workers
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.pool_size,
+                        mp_context=multiprocessing.get_context('spawn'),
+                    )
+        return self._pool
+
+    def _submit(self, fn, *args) -> Future:
+        if self.pool_size <= 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HashingUnavailable("Password hashing queue is full")
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def submit_hash(self, password: str) -> Future:
+        """Schedules hashing of password. The future resolves to the hash as bytes."""
+        return self._submit(bcrypt_hash, password.encode('utf-8'), self.rounds)
+
+    def submit_check(self, password: str, hashed: str) -> Future:
+        """Schedules a comparison of password against hashed. The future resolves to a bool."""
+        return self._submit(bcrypt_check, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def wait(self, future: Future):
+        """Blocks until future resolves or the configured timeout passes."""
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HashingUnavailable("Password hashing timed out")
+
+    async def wait_async(self, future: Future):
+        """Awaits future without blocking the event loop."""
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise HashingUnavailable("Password hashing timed out")
+
+    def hash_password(self, password: str) -> str:
+        """Returns the bcrypt hash of password."""
+        with metrics.timer(metrics.bcrypt_duration, 'hash'):
+            return self.wait(self.submit_hash(password)).decode('utf-8')
+
+    def check_password(self, password: str, hashed: str) -> bool:
+        """Returns True if password matches hashed."""
+        with metrics.timer(metrics.bcrypt_duration, 'check'):
+            return self.wait(self.submit_check(password, hashed))
+
+    async def hash_password_async(self, password: str) -> str:
+        """Async variant of hash_password."""
+        with metrics.timer(metrics.bcrypt_duration, 'hash'):
+            return (await self.wait_async(self.submit_hash(password))).decode('utf-8')
+
+    async def check_password_async(self, password: str, hashed: str) -> bool:
+        """Async variant of check_password."""
+        with metrics.timer(metrics.bcrypt_duration, 'check'):
+            return await self.wait_async(self.submit_check(password, hashed))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """Returns True if hashed was made at another cost than the configured one."""
+        return hash_rounds(hashed) != self.rounds
+
+    def rehash_in_background(self, password: str, store):
+        """
+        Hashes password at the configured cost off the calling thread, then
+        calls store(new_hash) from a background thread.
+
+        Returns False without doing anything when the pool is saturated; the
+        next login will try again.
+        """
+        if self.pool_size <= 0:
+            def rehash():
+                store(bcrypt_hash(password.encode('utf-8'), self.rounds).decode('utf-8'))
+            threading.Thread(target=rehash, daemon=True).start()
+            return True
+        try:
+            future = self.submit_hash(password)
+        except HashingUnavailable:
+            return False
+
+        def done(future):
+            # This runs on the pool's result thread, which must not wait on the
+            # database: every other hash result of the process goes through it
+            if not future.cancelled() and future.exception() is None:
+                threading.Thread(target=store, args=(future.result().decode('utf-8'),), daemon=True).start()
+        future.add_done_callback(done)
+        return True
+
+
+password_hasher = PasswordHasher()
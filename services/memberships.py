@@ -0,0 +1,166 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, attributes
+
+from services.caching import ExpiringLRUCache
+
+
+class MembershipSet:
+    """
+    The organizations a user belongs to, as cached by MembershipCache.
+
+    Attributes:
+        org_ids (frozenset): the orgIds of the user.
+        version (int): the cache version the set was loaded at.
+    """
+
+    __slots__ = ('org_ids', 'version')
+
+    def __init__(self, org_ids, version):
+        self.org_ids = frozenset(org_ids)
+        self.version = version
+
+    def __contains__(self, org_id):
+        return org_id in self.org_ids
+
+
+class MembershipCache:
+    """
+    Caches the set of orgIds of each user, so that authorization checks on
+    a hit are a set lookup instead of a query.
+
+    Every invalidation bumps a version counter. A set loaded while an
+    invalidation happened is returned but not stored, so a load racing
+    with a membership change can never cache the old set.
+
+    Entries are invalidated when user_organization rows are written through
+    the session: relationship changes on flush, and INSERT/DELETE
+    statements run with session.execute(). Other processes see a change
+    once their entry's TTL passes.
+
+    Configuration (read in init_app):
+        MEMBERSHIP_CACHE_SIZE (int): users whose sets are kept. 0 disables the cache.
+        MEMBERSHIP_CACHE_TTL (float): seconds a set is trusted.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60.0):
+        self.sets = ExpiringLRUCache(maxsize)
+        self.ttl = ttl
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Reads the cache settings from the app config."""
+        app.config.setdefault('MEMBERSHIP_CACHE_SIZE', 10000)
+        app.config.setdefault('MEMBERSHIP_CACHE_TTL', 60.0)
+        self.sets.maxsize = app.config['MEMBERSHIP_CACHE_SIZE']
+        self.ttl = float(app.config['MEMBERSHIP_CACHE_TTL'])
+        self.clear()
+        app.extensions['membership_cache'] = self
+
+    def get(self, user_id: str, load) -> MembershipSet:
+        """Returns the MembershipSet of user_id. On a miss, load() returns its orgIds."""
+        memberships = self.sets.get(user_id)
+        if memberships is not None:
+            return memberships
+        version = self.version
+        memberships = MembershipSet(load(), version)
+        with self._lock:
+            if self.version == version:
+                self.sets.set(user_id, memberships, time.time() + self.ttl)
+        return memberships
+
+    async def get_async(self, user_id: str, load) -> MembershipSet:
+        """Async variant of get, load being a coroutine function."""
+        memberships = self.sets.get(user_id)
+        if memberships is not None:
+            return memberships
+        version = self.version
+        memberships = MembershipSet(await load(), version)
+        with self._lock:
+            if self.version == version:
+                self.sets.set(user_id, memberships, time.time() + self.ttl)
+        return memberships
+
+    def invalidate(self, user_id: str):
+        """Drops the set of user_id."""
+        with self._lock:
+            self.version += 1
+            self.sets.delete(user_id)
+
+    def clear(self):
+        """Drops every set."""
+        with self._lock:
+            self.version += 1
+            self.sets.clear()
+
+    def stats(self):
+        """Returns size, hits, misses and the current version."""
+        return {**self.sets.stats(), "version": self.version}
+
+
+membership_cache = MembershipCache()
+
+
+def _track(session, user_ids):
+    for user_id in user_ids:
+        membership_cache.invalidate(user_id)
+    session.info.setdefault('membership_invalidations', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_flushed_memberships(session, flush_context):
+    from models import User, Organization
+
+    user_ids = set()
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, User):
+            user_ids.add(instance.userId)
+        elif isinstance(instance, Organization):
+            if instance in session.deleted:
+                # Its membership rows go with it, for users we cannot list here
+                membership_cache.clear()
+                continue
+            added, _, deleted = attributes.get_history(instance, 'users')
+            user_ids.update(user.userId for user in (*added, *deleted))
+    user_ids.discard(None)
+    _track(session, user_ids)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _invalidate_executed_memberships(orm_execute_state):
+    from models import user_organization
+
+    statement = orm_execute_state.statement
+    if not (statement.is_insert or statement.is_delete) or statement.table is not user_organization:
+        return
+    if statement.is_delete:
+        membership_cache.clear()
+        return
+    parameters = orm_execute_state.parameters
+    rows = parameters if isinstance(parameters, list) else [parameters or {}]
+    user_ids = {row.get('user_id') for row in rows}
+    user_ids.discard(None)
+    if not user_ids:
+        # Values given with insert().values(...)
+        user_ids = {statement.compile().params.get('user_id')} - {None}
+    if not user_ids:
+        membership_cache.clear()
+        return
+    _track(orm_execute_state.session, user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_memberships(session):
+    # Again after commit: a concurrent load may have read the old rows in between
+    for user_id in session.info.pop('membership_invalidations', ()):
+        membership_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _invalidate_rolled_back_memberships(session, previous_transaction):
+    # A set loaded inside the transaction may hold rows that never got committed
+    for user_id in session.info.pop('membership_invalidations', ()):
+        membership_cache.invalidate(user_id)
@@ -0,0 +1,123 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+class Histogram:
+    """
+    A Prometheus histogram with fixed buckets and any number of label sets.
+
+    Observations only bump a counter per series, so the cost does not grow
+    with the number of samples.
+    """
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Records value for the series of label_values."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # One count per bucket plus +Inf, then the sum
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        """Returns the histogram in the Prometheus text exposition format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        for label_values, values in series:
+            labels = ''.join(f'{name}="{_escape(value)}",' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            labels = labels.rstrip(',')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {values[-1]}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """
+    The application's histograms, served by GET /metrics.
+
+    Every recording call returns at once while metrics are disabled, and
+    the request and SQL hooks are only installed when they are enabled.
+
+    Configuration (read in init_app):
+        METRICS_ENABLED (bool): collect and serve metrics.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Time spent serving requests.',
+            ('endpoint', 'method', 'status'))
+        self.request_queries = Histogram(
+            'http_request_queries', 'SQL statements executed per request.',
+            ('endpoint', 'method'), COUNT_BUCKETS)
+        self.request_query_duration = Histogram(
+            'http_request_query_duration_seconds', 'Time spent in SQL per request.',
+            ('endpoint', 'method'))
+        self.bcrypt_duration = Histogram(
+            'bcrypt_duration_seconds', 'Time spent hashing or checking passwords, queueing included.',
+            ('operation',))
+        self.jwt_verify_duration = Histogram(
+            'jwt_verify_duration_seconds', 'Time spent verifying access tokens.')
+        self.serialize_duration = Histogram(
+            'response_serialize_duration_seconds', 'Time spent encoding JSON responses.')
+
+    @property
+    def histograms(self):
+        return (self.request_duration, self.request_queries, self.request_query_duration,
+                self.bcrypt_duration, self.jwt_verify_duration, self.serialize_duration)
+
+    def init_app(self, app):
+        """Reads METRICS_ENABLED from the app config and clears the histograms."""
+        app.config.setdefault('METRICS_ENABLED', False)
+        self.enabled = bool(app.config['METRICS_ENABLED'])
+        for histogram in self.histograms:
+            histogram.clear()
+        app.extensions['metrics'] = self
+
+    @contextmanager
+    def timer(self, histogram, *label_values):
+        """Observes the time spent in the with block, if metrics are enabled."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        """Returns every histogram in the Prometheus text exposition format."""
+        return '\n'.join(histogram.render() for histogram in self.histograms) + '\n'
+
+
+metrics = Metrics()
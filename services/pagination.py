@@ -0,0 +1,45 @@
+import base64
+import binascii
+import json
+
+
+class InvalidPageRequest(ValueError):
+    """Raised for a malformed limit or cursor."""
+
+
+def encode_cursor(last_key: str) -> str:
+    """Returns an opaque cursor that resumes after last_key."""
+    raw = json.dumps({"after": last_key}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> str:
+    """Returns the key encoded in cursor."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        after = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))['after']
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        raise InvalidPageRequest("Invalid cursor")
+    if not isinstance(after, str):
+        raise InvalidPageRequest("Invalid cursor")
+    return after
+
+
+def parse_page_args(limit, cursor, default_limit: int, max_limit: int):
+    """
+    Validates the limit and cursor query parameters.
+
+    Returns (limit, after) where limit is clamped to max_limit and after is
+    the key to resume after, or None for the first page.
+    """
+    if limit is None or limit == '':
+        limit = default_limit
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise InvalidPageRequest("Invalid limit")
+        if limit < 1:
+            raise InvalidPageRequest("Invalid limit")
+    after = decode_cursor(cursor) if cursor else None
+    return min(limit, max_limit), after
@@ -0,0 +1,183 @@
+import threading
+import time
+
+import msgspec
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from services.caching import ExpiringLRUCache
+
+
+class ProfileCache:
+    """
+    Read-through cache of serialized user profiles, keyed by userId.
+
+    Lookups try an in-process ExpiringLRUCache first, then an optional
+    shared cachelib cache (Redis, Memcached, filesystem, ...) and finally
+    the loader, whose result is stored in both tiers as encoded JSON.
+
+    Flushing a changed or deleted User drops its entry from both tiers, as
+    do bulk ORM updates and deletes of users (those clear the local tier).
+    The local tiers of other processes only learn about a change through
+    their TTL, so keep PROFILE_CACHE_TTL short when running several.
+
+    Configuration (read in init_app):
+        PROFILE_CACHE_SIZE (int): profiles kept in process. 0 disables the local tier.
+        PROFILE_CACHE_TTL (float): seconds a profile is served from cache.
+        PROFILE_CACHE_SHARED (cachelib.BaseCache): the shared tier, or None.
+    """
+
+    prefix = 'profile:'
+
+    def __init__(self, maxsize=10000, ttl=60.0, shared=None):
+        self.local = ExpiringLRUCache(maxsize)
+        self.ttl = ttl
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def init_app(self, app):
+        """Reads the cache settings from the app config."""
+        app.config.setdefault('PROFILE_CACHE_SIZE', 10000)
+        app.config.setdefault('PROFILE_CACHE_TTL', 60.0)
+        app.config.setdefault('PROFILE_CACHE_SHARED', None)
+        self.local.maxsize = app.config['PROFILE_CACHE_SIZE']
+        self.ttl = float(app.config['PROFILE_CACHE_TTL'])
+        self.shared = app.config['PROFILE_CACHE_SHARED']
+        self.local.clear()
+        self._reset_counters()
+        app.extensions['profile_cache'] = self
+
+    def _reset_counters(self):
+        with self._lock:
+            self.local_hits = 0
+            self.shared_hits = 0
+            self.misses = 0
+            self.hit_seconds = 0.0
+            self.miss_seconds = 0.0
+
+    def get(self, user_id: str, load):
+        """
+        Returns the profile of user_id as JSON bytes, or None if load()
+        finds no user. load returns the User or None.
+        """
+        start = time.perf_counter()
+        data, tier = self._lookup(user_id)
+        if data is None:
+            data = self._fill(user_id, load())
+        self._record(tier, start)
+        return data
+
+    async def get_async(self, user_id: str, load):
+        """Async variant of get, load being a coroutine function."""
+        start = time.perf_counter()
+        data, tier = self._lookup(user_id)
+        if data is None:
+            data = self._fill(user_id, await load())
+        self._record(tier, start)
+        return data
+
+    def invalidate(self, user_id: str):
+        """Drops the profile of user_id from both tiers."""
+        self.local.delete(user_id)
+        if self.shared is not None:
+            self.shared.delete(self.prefix + user_id)
+
+    def clear(self):
+        """Drops the local tier. Shared entries expire through their TTL."""
+        self.local.clear()
+
+    def stats(self):
+        """Returns the hit ratio and average latencies (ms) of hits and misses."""
+        with self._lock:
+            hits = self.local_hits + self.shared_hits
+            lookups = hits + self.misses
+            return {
+                "size": len(self.local),
+                "localHits": self.local_hits,
+                "sharedHits": self.shared_hits,
+                "misses": self.misses,
+                "hitRatio": hits / lookups if lookups else 0.0,
+                "avgHitMs": self.hit_seconds / hits * 1000 if hits else 0.0,
+                "avgMissMs": self.miss_seconds / self.misses * 1000 if self.misses else 0.0,
+            }
+
+    def _lookup(self, user_id):
+        """Returns (data, tier), tier being 'local', 'shared' or None on a miss."""
+        data = self.local.get(user_id, count=False)
+        if data is not None:
+            return data, 'local'
+        if self.shared is not None:
+            data = self.shared.get(self.prefix + user_id)
+            if data is not None:
+                self.local.set(user_id, data, time.time() + self.ttl)
+                return data, 'shared'
+        return None, None
+
+    def _fill(self, user_id, user):
+        from schemas import UserData, encode
+
+        if user is None:
+            return None
+        data = encode(UserData.from_model(user))
+        self.local.set(user_id, data, time.time() + self.ttl)
+        if self.shared is not None:
+            self.shared.set(self.prefix + user_id, data, timeout=max(1, int(self.ttl)))
+        return data
+
+    def _record(self, tier, start):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            if tier is None:
+                self.misses += 1
+                self.miss_seconds += elapsed
+            else:
+                if tier == 'local':
+                    self.local_hits += 1
+                else:
+                    self.shared_hits += 1
+                self.hit_seconds += elapsed
+
+
+profile_cache = ProfileCache()
+
+
+def profile_data(data: bytes):
+    """Wraps cached profile bytes so they are embedded as-is in a response."""
+    return msgspec.Raw(data)
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_flushed_users(session, flush_context):
+    from models import User
+
+    flushed = {
+        instance.userId for instance in (*session.dirty, *session.deleted)
+        if isinstance(instance, User) and instance.userId is not None
+    }
+    for user_id in flushed:
+        profile_cache.invalidate(user_id)
+    session.info.setdefault('profile_invalidations', set()).update(flushed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_users(session):
+    # Again after commit: a concurrent read may have cached the old row in between
+    for user_id in session.info.pop('profile_invalidations', ()):
+        profile_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_rolled_back_users(session, previous_transaction):
+    session.info.pop('profile_invalidations', None)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _invalidate_bulk_user_writes(orm_execute_state):
+    from models import User
+
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ is User:
+        profile_cache.clear()
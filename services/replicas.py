@@ -0,0 +1,135 @@
+import itertools
+import math
+import time
+
+from flask import current_app, g
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.sql.dml import UpdateBase
+
+from services.caching import ExpiringLRUCache
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of read-only views to read replicas.
+
+    Each replica gets its own engine and pool, kept in the app's
+    extensions as replica_engines. A request marked with
+    middlewares.replicas.read_only reads from one replica, picked
+    round-robin. Everything else, and every write, uses the primary.
+
+    A commit makes its client sticky: for REPLICA_STICKY_SECONDS its
+    reads stay on the primary, so it sees its own writes while the
+    replicas catch up. The client is the authenticated user, plus the
+    users created by the commit (a registration). The sticky marks are
+    kept in process, or in REPLICA_STICKY_STORE so every worker sees them.
+
+    Configuration (read in init_app):
+        SQLALCHEMY_REPLICA_URIS (list): URIs of the replicas, none by default.
+        SQLALCHEMY_REPLICA_ENGINE_OPTIONS (dict): create_engine options of
+            every replica, e.g. pool_size.
+        REPLICA_STICKY_SECONDS (float): how long a writer reads from the primary.
+        REPLICA_STICKY_STORE (cachelib.BaseCache): shared sticky marks, in process when None.
+    """
+
+    prefix = 'sticky:'
+
+    def __init__(self, sticky_seconds=5.0, maxsize=100000):
+        self.sticky_seconds = sticky_seconds
+        self.local = ExpiringLRUCache(maxsize)
+        self.shared = None
+        self._turn = itertools.count()
+
+    def init_app(self, app):
+        """Creates the replica engines of app and reads the stickiness settings."""
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('SQLALCHEMY_REPLICA_ENGINE_OPTIONS', {})
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5.0)
+        app.config.setdefault('REPLICA_STICKY_STORE', None)
+        options = app.config['SQLALCHEMY_REPLICA_ENGINE_OPTIONS']
+        app.extensions['replica_engines'] = [
+            create_engine(uri, **options) for uri in app.config['SQLALCHEMY_REPLICA_URIS']
+        ]
+        self.sticky_seconds = float(app.config['REPLICA_STICKY_SECONDS'])
+        self.shared = app.config['REPLICA_STICKY_STORE']
+        self.local.clear()
+        app.extensions['replica_router'] = self
+
+    def mark_written(self, clients):
+        """Keeps clients on the primary for the next sticky_seconds."""
+        if self.sticky_seconds <= 0:
+            return
+        expires_at = time.time() + self.sticky_seconds
+        for client in clients:
+            self.local.set(client, True, expires_at)
+            if self.shared is not None:
+                self.shared.set(self.prefix + client, 1, timeout=max(1, math.ceil(self.sticky_seconds)))
+
+    def is_sticky(self, client) -> bool:
+        """Returns True if client committed a write within the last sticky_seconds."""
+        if self.local.get(client, count=False) is not None:
+            return True
+        return self.shared is not None and self.shared.get(self.prefix + client) is not None
+
+    def read_engine(self):
+        """Returns the replica engine for the reads of the current request, or None for the primary."""
+        if not g.get('read_only'):
+            return None
+        if 'replica' not in g:
+            engines = current_app.extensions.get('replica_engines')
+            auth = g.get('auth')
+            if not engines or (auth is not None and self.is_sticky(auth.user_id)):
+                g.replica = None
+            else:
+                # One replica per request, so its reads see a single snapshot
+                g.replica = engines[next(self._turn) % len(engines)]
+        return g.replica
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """
+    The session class of db.session: reads of read-only requests go to
+    the engine replica_router picks. Flushes, INSERT/UPDATE/DELETE
+    statements and every read after them in the transaction go to the
+    primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info['wrote'] = True
+            elif not self.info.get('wrote'):
+                engine = replica_router.read_engine()
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_new_users(session, flush_context):
+    from models import User
+
+    created = {instance.userId for instance in session.new if isinstance(instance, User)}
+    if created:
+        session.info.setdefault('sticky_users', set()).update(created)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _mark_writers(session):
+    created = session.info.pop('sticky_users', set())
+    if not session.info.pop('wrote', False):
+        return
+    auth = g.get('auth')
+    if auth is not None:
+        created.add(auth.user_id)
+    replica_router.mark_written(created)
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _forget_writes(session, previous_transaction):
+    session.info.pop('sticky_users', None)
+    session.info.pop('wrote', None)
@@ -0,0 +1,277 @@
+import heapq
+import math
+import threading
+import time
+
+# A log entry may be numbered before it is written: the sync retries the
+# newest PENDING_WINDOW missing entries for PENDING_GRACE seconds
+PENDING_WINDOW = 100
+PENDING_GRACE = 5.0
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter of strings: it never misses an added item
+    and wrongly matches about error_rate of other items once capacity
+    items were added.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @staticmethod
+    def _seeds(item):
+        # Double hashing, position i being first + i * step. str hashes are
+        # salted per process, which is fine as every process fills its own filter,
+        # and cached on the string.
+        digest = hash(item) & 0xFFFFFFFFFFFFFFFF
+        return digest & 0xFFFFFFFF, (digest >> 32) | 1
+
+    def add(self, item):
+        first, step = self._seeds(item)
+        for i in range(self.hashes):
+            position = (first + i * step) % self.size
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        first, step = self._seeds(item)
+        bits, size = self.bits, self.size
+        for i in range(self.hashes):
+            position = (first + i * step) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                # Most items not added stop at the first probes
+                return False
+        return True
+
+
+class MemoryRevocationStore:
+    """
+    Keeps the revoked token ids in process, each one until its token
+    expires. Only suits a single worker process.
+    """
+
+    def __init__(self, clock=time.time):
+        self.entries = {}
+        self._expiry = []
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def add(self, key, expires_at):
+        with self._lock:
+            self.entries[key] = expires_at
+            heapq.heappush(self._expiry, (expires_at, key))
+
+    def contains(self, key):
+        expires_at = self.entries.get(key)
+        return expires_at is not None and expires_at > self._clock()
+
+    def publish(self, entry, expires_at):
+        """Nothing to share with other processes."""
+
+    def changes(self, since, pending=()):
+        return since, {}
+
+    def prune(self):
+        """Drops the ids whose tokens expired."""
+        now = self._clock()
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, key = heapq.heappop(self._expiry)
+                if self.entries.get(key, now + 1) <= now:
+                    del self.entries[key]
+
+
+class CachelibRevocationStore:
+    """
+    Keeps the revoked token ids in a cachelib cache, e.g. RedisCache, shared
+    by every process. Each id expires from the cache with its token.
+
+    Revocations are also appended to a numbered log (a counter plus one
+    key per entry) that the other processes read to update their filters.
+    """
+
+    prefix = 'revoked:'
+    chunk_size = 1000
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def add(self, key, expires_at):
+        self.cache.set(self.prefix + key, 1, timeout=_timeout(expires_at))
+
+    def contains(self, key):
+        return self.cache.get(self.prefix + key) is not None
+
+    def publish(self, entry, expires_at):
+        self.cache.add(self.prefix + 'seq', 0, timeout=0)
+        number = self.cache.inc(self.prefix + 'seq')
+        self.cache.set(f"{self.prefix}log:{number}", entry, timeout=_timeout(expires_at))
+
+    def changes(self, since, pending=()):
+        """Returns the latest log number and the entries numbered after since or in pending, None when missing."""
+        latest = self.cache.get(self.prefix + 'seq') or 0
+        if latest < since:
+            # The counter was lost, read the log from the start again
+            since = 0
+        numbers = [*pending, *range(since + 1, latest + 1)]
+        entries = {}
+        for start in range(0, len(numbers), self.chunk_size):
+            chunk = numbers[start:start + self.chunk_size]
+            values = self.cache.get_many(*(f"{self.prefix}log:{number}" for number in chunk))
+            entries.update(zip(chunk, values))
+        return latest, entries
+
+    def prune(self):
+        """The cache expires ids by itself."""
+
+
+def _timeout(expires_at):
+    return max(1, math.ceil(expires_at - time.time()))
+
+
+class RevocationList:
+    """
+    Access tokens revoked before their expiry, by jti claim or for every
+    token a user was issued up to some time.
+
+    Checks are answered in process: a jti that is not in the Bloom filter
+    was never revoked, which is the case for nearly every request. Only a
+    filter match (a revoked token, or a false positive) consults the
+    exact set of the store.
+
+    The filter has two generations rotated every token lifetime, so an id
+    stays in it until its token expires and memory stays fixed. Other
+    processes pick up revocations from the shared store's log within
+    REVOCATION_SYNC_INTERVAL seconds; the revoking process sees them at once.
+
+    Configuration (read in init_app):
+        REVOCATION_STORE (cachelib.BaseCache): shared store, in process when None.
+        REVOCATION_SYNC_INTERVAL (float): seconds between reads of the shared log.
+        REVOCATION_BLOOM_CAPACITY (int): ids per generation at a 0.1% false positive rate.
+    """
+
+    def __init__(self, store=None, sync_interval=1.0, capacity=100000, lifetime=86400.0, clock=time.time):
+        self.sync_interval = sync_interval
+        self.capacity = capacity
+        self.lifetime = lifetime
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._reset(store or MemoryRevocationStore(clock=clock))
+
+    def init_app(self, app):
+        """Reads the store and filter settings from the app config."""
+        app.config.setdefault('REVOCATION_STORE', None)
+        app.config.setdefault('REVOCATION_SYNC_INTERVAL', 1.0)
+        app.config.setdefault('REVOCATION_BLOOM_CAPACITY', 100000)
+        self.sync_interval = float(app.config['REVOCATION_SYNC_INTERVAL'])
+        self.capacity = int(app.config['REVOCATION_BLOOM_CAPACITY'])
+        shared = app.config['REVOCATION_STORE']
+        self._reset(MemoryRevocationStore(clock=self._clock) if shared is None else CachelibRevocationStore(shared))
+        app.extensions['revocation_list'] = self
+
+    def _reset(self, store):
+        with self._lock:
+            self.store = store
+            self.filters = [BloomFilter(self.capacity), BloomFilter(self.capacity)]
+            self.users = {}
+            self._user_expiry = []
+            self._rotated_at = self._clock()
+            self._since = 0
+            self._pending = {}
+            self._next_sync = 0.0
+            self.false_positives = 0
+
+    def revoke_token(self, jti: str, expires_at: float):
+        """Revokes the token with jti until expires_at, its exp claim."""
+        if expires_at <= self._clock():
+            return
+        self.store.add(jti, expires_at)
+        with self._lock:
+            self.filters[0].add(jti)
+        self.store.publish(('jti', jti, expires_at), expires_at)
+
+    def revoke_user(self, user_id: str, before: float = None):
+        """Revokes every token of user_id issued at or before before (default now)."""
+        if before is None:
+            before = self._clock()
+        expires_at = before + self.lifetime
+        with self._lock:
+            self._add_user(user_id, before, expires_at)
+        self.store.publish(('user', user_id, before, expires_at), expires_at)
+
+    def is_revoked(self, claims: dict) -> bool:
+        """Returns True if the token with claims was revoked."""
+        if self._clock() >= self._next_sync:
+            self.sync()
+        jti = claims.get('jti')
+        if jti is not None and (jti in self.filters[0] or jti in self.filters[1]):
+            if self.store.contains(jti):
+                return True
+            self.false_positives += 1
+        if self.users:
+            before = self.users.get(claims.get('userId'))
+            if before is not None and claims.get('iat', 0) <= before:
+                return True
+        return False
+
+    def sync(self):
+        """Rotates the filters, drops expired user revocations and reads the shared log."""
+        if not self._sync_lock.acquire(blocking=False):
+            # Another thread is on it
+            return
+        try:
+            now = self._clock()
+            self._next_sync = now + self.sync_interval
+            self.store.prune()
+            latest, entries = self.store.changes(self._since, tuple(self._pending))
+            with self._lock:
+                if now - self._rotated_at >= self.lifetime:
+                    self.filters = [BloomFilter(self.capacity), self.filters[0]]
+                    self._rotated_at = now
+                while self._user_expiry and self._user_expiry[0][0] <= now:
+                    _, user_id, before = heapq.heappop(self._user_expiry)
+                    if self.users.get(user_id) == before:
+                        del self.users[user_id]
+                for number, entry in entries.items():
+                    if entry is not None:
+                        self._pending.pop(number, None)
+                        self._apply(entry, now)
+                    elif number > latest - PENDING_WINDOW and self._pending.setdefault(number, now) + PENDING_GRACE >= now:
+                        continue
+                    else:
+                        # Expired, or its writer died between numbering and writing it
+                        self._pending.pop(number, None)
+                self._since = latest
+        finally:
+            self._sync_lock.release()
+
+    def _apply(self, entry, now):
+        if entry[0] == 'jti':
+            _, jti, expires_at = entry
+            if expires_at > now:
+                self.filters[0].add(jti)
+        else:
+            _, user_id, before, expires_at = entry
+            if expires_at > now:
+                self._add_user(user_id, before, expires_at)
+
+    def _add_user(self, user_id, before, expires_at):
+        if before > self.users.get(user_id, float('-inf')):
+            self.users[user_id] = before
+            heapq.heappush(self._user_expiry, (expires_at, user_id, before))
+
+    def stats(self):
+        """Returns the ids in each filter generation, the revoked users and the false positives seen."""
+        return {
+            "filtered": [bloom.count for bloom in self.filters],
+            "users": len(self.users),
+            "falsePositives": self.false_positives,
+        }
+
+
+revocation_list = RevocationList()
@@ -0,0 +1,199 @@
+import bisect
+import heapq
+import re
+import threading
+from array import array
+from collections import Counter
+
+from services.caching import ExpiringLRUCache
+
+# pg_trgm's default similarity_threshold, which its % operator applies
+SIMILARITY_THRESHOLD = 0.3
+
+_words = re.compile(r'[^\W_]+')
+
+
+def trigrams(text: str) -> set:
+    """
+    Returns the trigrams of text the way pg_trgm extracts them: each word
+    of letters and digits, lowercased, padded with two spaces in front and
+    one behind.
+    """
+    grams = set()
+    for word in _words.findall(text.lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(left: str, right: str) -> float:
+    """Returns pg_trgm's similarity() of left and right: shared trigrams over all their trigrams."""
+    a, b = trigrams(left), trigrams(right)
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class NameIndex:
+    """
+    The organization names of one user, sorted case-insensitively for
+    prefix lookups by bisection. The trigram postings behind fuzzy
+    lookups are built on the first one.
+
+    Attributes:
+        memberships: the MembershipSet the index was built for.
+    """
+
+    def __init__(self, rows, memberships=None):
+        entries = sorted((name.lower(), org_id) for org_id, name in rows)
+        self.keys = [key for key, _ in entries]
+        self.org_ids = [org_id for _, org_id in entries]
+        self.memberships = memberships
+        self._postings = None
+        self._sizes = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def prefix(self, text: str, limit: int) -> list:
+        """Returns the orgIds of the first limit names starting with text, in name order."""
+        text = text.lower()
+        start = bisect.bisect_left(self.keys, text)
+        end = min(start + limit, len(self.keys))
+        found = []
+        for position in range(start, end):
+            if not self.keys[position].startswith(text):
+                break
+            found.append(self.org_ids[position])
+        return found
+
+    def fuzzy(self, text: str, limit: int, threshold=SIMILARITY_THRESHOLD) -> list:
+        """Returns the orgIds of the limit names most similar to text, at least threshold similar."""
+        query = trigrams(text)
+        if not query:
+            return []
+        postings, sizes = self._trigram_postings()
+        shared = Counter()
+        for gram in query:
+            shared.update(postings.get(gram, ()))
+        matches = []
+        for position, count in shared.items():
+            score = count / (len(query) + sizes[position] - count)
+            if score >= threshold:
+                matches.append((-score, position))
+        # Positions follow name order, so ties come out like search_query's
+        return [self.org_ids[position] for _, position in heapq.nsmallest(limit, matches)]
+
+    def _trigram_postings(self):
+        with self._lock:
+            if self._postings is None:
+                postings = {}
+                sizes = array('H')
+                for position, key in enumerate(self.keys):
+                    grams = trigrams(key)
+                    sizes.append(min(len(grams), 0xFFFF))
+                    for gram in grams:
+                        posting = postings.get(gram)
+                        if posting is None:
+                            posting = postings[gram] = array('I')
+                        posting.append(position)
+                self._postings, self._sizes = postings, sizes
+            return self._postings, self._sizes
+
+
+class OrganizationSearch:
+    """
+    Finds the organizations of a user by name, by prefix or fuzzily.
+
+    On PostgreSQL the search is one query over the name indexes (see
+    Organization.search_query). Other databases have no trigram index, so
+    each user's names are loaded once into a NameIndex kept in process.
+    An index is rebuilt when the membership_cache set of the user no
+    longer holds the organizations it was built from.
+
+    Configuration (read in init_app):
+        ORGANISATIONS_SEARCH_INDEX_SIZE (int): users whose indexes are kept. 0 rebuilds on every search.
+    """
+
+    def __init__(self, maxsize=100):
+        self.indexes = ExpiringLRUCache(maxsize)
+
+    def init_app(self, app):
+        """Reads the index settings from the app config."""
+        app.config.setdefault('ORGANISATIONS_SEARCH_INDEX_SIZE', 100)
+        self.indexes.maxsize = app.config['ORGANISATIONS_SEARCH_INDEX_SIZE']
+        self.indexes.clear()
+        app.extensions['organization_search'] = self
+
+    def search(self, user_id, text: str, fuzzy=False, limit=20) -> list:
+        """Returns up to limit organizations of user_id matching text, best match first."""
+        from database import db
+        from models import Organization
+
+        if db.session.get_bind().dialect.name == 'postgresql':
+            return db.session.scalars(Organization.search_query(user_id, text, fuzzy, limit)).all()
+        index = self.index_for(user_id)
+        org_ids = index.fuzzy(text, limit) if fuzzy else index.prefix(text, limit)
+        return Organization.by_ids(org_ids)
+
+    async def search_async(self, session, user_id, text: str, fuzzy=False, limit=20) -> list:
+        """Async variant of search, querying through the AsyncSession session."""
+        from sqlalchemy import select
+        from models import Organization
+
+        if session.bind.dialect.name == 'postgresql':
+            return (await session.scalars(Organization.search_query(user_id, text, fuzzy, limit))).all()
+        index = await self.index_for_async(session, user_id)
+        org_ids = index.fuzzy(text, limit) if fuzzy else index.prefix(text, limit)
+        if not org_ids:
+            return []
+        organizations = await session.scalars(select(Organization).where(Organization.orgId.in_(org_ids)))
+        return Organization.in_order(org_ids, organizations)
+
+    def index_for(self, user_id) -> NameIndex:
+        """Returns the NameIndex of user_id, building it when missing or outdated."""
+        from models import Organization
+        from services.memberships import membership_cache
+
+        memberships = membership_cache.get(user_id, lambda: Organization.ids_for_member(user_id))
+        index = self._current_index(user_id, memberships)
+        if index is None:
+            index = NameIndex(Organization.names_for_member(user_id), memberships)
+            self.indexes.set(user_id, index)
+        return index
+
+    async def index_for_async(self, session, user_id) -> NameIndex:
+        """Async variant of index_for, querying through the AsyncSession session."""
+        from models import Organization
+        from services.memberships import membership_cache
+
+        async def load_ids():
+            return set(await session.scalars(Organization.ids_for_member_query(user_id)))
+
+        memberships = await membership_cache.get_async(user_id, load_ids)
+        index = self._current_index(user_id, memberships)
+        if index is None:
+            rows = (await session.execute(Organization.names_for_member_query(user_id))).all()
+            index = NameIndex(rows, memberships)
+            self.indexes.set(user_id, index)
+        return index
+
+    def _current_index(self, user_id, memberships):
+        """Returns the cached NameIndex of user_id if it still matches memberships, otherwise None."""
+        index = self.indexes.get(user_id)
+        if index is not None and index.memberships is not memberships:
+            if index.memberships.org_ids == memberships.org_ids:
+                # The set was reloaded after its TTL, with the same organizations
+                index.memberships = memberships
+            else:
+                index = None
+        return index
+
+    def stats(self):
+        """Returns size, hits and misses of the index cache."""
+        return self.indexes.stats()
+
+
+organization_search = OrganizationSearch()
@@ -0,0 +1,151 @@
+import base64
+import hashlib
+import json
+
+
+class SigningKey:
+    """
+    A private key that access tokens are signed with.
+
+    Attributes:
+        kid (str): RFC 7638 thumbprint of the public key, sent as the kid header.
+        algorithm (str): 'EdDSA' for Ed25519 keys, 'ES256' for P-256 keys.
+        private_key: the cryptography private key.
+        public_key: the cryptography public key.
+        jwk (dict): the public key as a JWK.
+    """
+
+    def __init__(self, private_key):
+        from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+        if isinstance(private_key, ed25519.Ed25519PrivateKey):
+            self.algorithm = 'EdDSA'
+        elif isinstance(private_key, ec.EllipticCurvePrivateKey) and private_key.curve.name == 'secp256r1':
+            self.algorithm = 'ES256'
+        else:
+            raise ValueError("signing keys must be Ed25519 or P-256 keys")
+        self.private_key = private_key
+        self.public_key = private_key.public_key()
+        jwk = self._public_jwk()
+        self.kid = _thumbprint(jwk)
+        self.jwk = {**jwk, "kid": self.kid, "alg": self.algorithm, "use": "sig"}
+
+    @classmethod
+    def from_pem(cls, pem):
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+        if isinstance(pem, str):
+            pem = pem.encode('utf-8')
+        return cls(load_pem_private_key(pem, password=None))
+
+    def _public_jwk(self):
+        from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+        if self.algorithm == 'EdDSA':
+            raw = self.public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+            return {"crv": "Ed25519", "kty": "OKP", "x": _b64(raw)}
+        numbers = self.public_key.public_numbers()
+        return {"crv": "P-256", "kty": "EC", "x": _b64(numbers.x.to_bytes(32, 'big')),
+                "y": _b64(numbers.y.to_bytes(32, 'big'))}
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _thumbprint(jwk: dict) -> str:
+    # The required members in lexicographic order, without whitespace
+    canonical = json.dumps(jwk, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return _b64(hashlib.sha256(canonical).digest())
+
+
+def generate_signing_key(algorithm='EdDSA') -> bytes:
+    """Returns a new unencrypted PKCS#8 PEM private key for algorithm ('EdDSA' or 'ES256')."""
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+    from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat
+
+    if algorithm == 'EdDSA':
+        key = ed25519.Ed25519PrivateKey.generate()
+    elif algorithm == 'ES256':
+        key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        raise ValueError(f"unsupported algorithm {algorithm}")
+    return key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+
+
+class KeyRing:
+    """
+    The asymmetric keys access tokens are signed and verified with.
+
+    Without keys, tokens are signed with HS256 and SECRET_KEY as before.
+    With keys, new tokens are signed by the signing key with its kid
+    header, and tokens of every key in the ring verify, so keys can be
+    rotated: add the new key, let caches of the JWKS expire, make it the
+    signing key, then drop the old key once its tokens have expired.
+
+    Configuration (read in init_app):
+        JWT_PRIVATE_KEYS (list): PEM private keys, Ed25519 or P-256.
+        JWT_KEY_FILES (list): paths of PEM private keys, added to the above.
+        JWT_SIGNING_KEY_ID (str): kid of the signing key, the first key when unset.
+        JWT_ACCEPT_HS256 (bool): keep accepting HS256 tokens without kid, e.g.
+            for a token lifetime after switching to keys.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.signing_key = None
+        self.accept_hs256 = True
+        self.jwks_body = b'{"keys":[]}'
+        self.jwks_etag = _etag(self.jwks_body)
+
+    def init_app(self, app):
+        """Loads the keys from the app config."""
+        app.config.setdefault('JWT_PRIVATE_KEYS', [])
+        app.config.setdefault('JWT_KEY_FILES', [])
+        app.config.setdefault('JWT_SIGNING_KEY_ID', None)
+        app.config.setdefault('JWT_ACCEPT_HS256', True)
+        pems = list(app.config['JWT_PRIVATE_KEYS'])
+        for path in app.config['JWT_KEY_FILES']:
+            with open(path, 'rb') as handle:
+                pems.append(handle.read())
+        self.load([SigningKey.from_pem(pem) for pem in pems], app.config['JWT_SIGNING_KEY_ID'])
+        self.accept_hs256 = bool(app.config['JWT_ACCEPT_HS256'])
+        app.extensions['key_ring'] = self
+
+    def load(self, keys, signing_kid=None):
+        """Replaces the keys of the ring and rebuilds the JWKS document."""
+        by_kid = {key.kid: key for key in keys}
+        if signing_kid is not None and signing_kid not in by_kid:
+            raise ValueError(f"JWT_SIGNING_KEY_ID {signing_kid} is not one of the configured keys")
+        self.keys = by_kid
+        self.signing_key = by_kid[signing_kid] if signing_kid else (keys[0] if keys else None)
+        self.jwks_body = json.dumps({"keys": [key.jwk for key in keys]}, separators=(',', ':')).encode('utf-8')
+        self.jwks_etag = _etag(self.jwks_body)
+
+    def encode(self, payload: dict, secret: str) -> str:
+        """Signs payload with the signing key, or with secret and HS256 when the ring is empty."""
+        import jwt
+        if self.signing_key is None:
+            return jwt.encode(payload, secret, algorithm='HS256')
+        key = self.signing_key
+        return jwt.encode(payload, key.private_key, algorithm=key.algorithm, headers={"kid": key.kid})
+
+    def decode(self, token: str, secret: str) -> dict:
+        """Verifies token with the key its kid names, raising the jwt exceptions of jwt.decode."""
+        import jwt
+        if not self.keys:
+            return jwt.decode(token, secret, algorithms=['HS256'])
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is None and self.accept_hs256:
+            return jwt.decode(token, secret, algorithms=['HS256'])
+        key = self.keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError("Unknown signing key")
+        return jwt.decode(token, key.public_key, algorithms=[key.algorithm])
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+key_ring = KeyRing()
@@ -0,0 +1,154 @@
+import math
+import threading
+import time
+
+from services.caching import ExpiringLRUCache
+
+
+class MemoryThrottleStore:
+    """
+    Keeps the attempt counters in process.
+
+    Each key holds its current fixed window and the counts of that window
+    and the one before it, three ints, and is dropped once both windows
+    have passed. At most maxsize keys are kept, least recently used first out.
+    """
+
+    def __init__(self, maxsize=100000, clock=time.time):
+        self.counters = ExpiringLRUCache(maxsize, clock=clock)
+        self._lock = threading.Lock()
+
+    def increment(self, key, window_index, expires_at):
+        """Adds one attempt to the current window of key and returns the (previous, current) counts after it."""
+        with self._lock:
+            previous, current = _shift(self.counters.get(key, count=False), window_index)
+            self.counters.set(key, (window_index, previous, current + 1), expires_at)
+            return previous, current + 1
+
+    def decrement(self, key, window_index, expires_at):
+        """Takes back an attempt added to the current window of key."""
+        with self._lock:
+            previous, current = _shift(self.counters.get(key, count=False), window_index)
+            if current > 0:
+                self.counters.set(key, (window_index, previous, current - 1), expires_at)
+
+
+def _shift(entry, window_index):
+    if entry is None:
+        return 0, 0
+    index, previous, current = entry
+    if index == window_index:
+        return previous, current
+    if index == window_index - 1:
+        return current, 0
+    return 0, 0
+
+
+class CachelibThrottleStore:
+    """
+    Keeps the attempt counters in a cachelib cache, e.g. RedisCache, so
+    that every process shares them. One key per key and window.
+    """
+
+    prefix = 'throttle:'
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def increment(self, key, window_index, expires_at):
+        # inc is atomic in the cache, so concurrent attempts each get their own count
+        name = f"{self.prefix}{key}:{window_index}"
+        self.cache.add(name, 0, timeout=max(1, math.ceil(expires_at - time.time())))
+        current = self.cache.inc(name)
+        previous = self.cache.get(f"{self.prefix}{key}:{window_index - 1}")
+        return previous or 0, current
+
+    def decrement(self, key, window_index, expires_at):
+        self.cache.dec(f"{self.prefix}{key}:{window_index}")
+
+
+class LoginThrottle:
+    """
+    Limits login attempts per email and per client IP with sliding-window
+    counters, so credential stuffing is turned away before it costs a
+    query or a bcrypt comparison.
+
+    The window is approximated from two fixed windows: the previous
+    window's count weighted by how much of it still overlaps the sliding
+    window, plus the current count. Each attempt is counted first and
+    checked against the count it got, so concurrent attempts cannot all
+    pass a check made before any of them was counted. Rejected attempts
+    are taken back.
+
+    Configuration (read in init_app):
+        LOGIN_THROTTLE_WINDOW (float): length of the window in seconds.
+        LOGIN_THROTTLE_EMAIL_LIMIT (int): attempts per email and window. 0 disables it.
+        LOGIN_THROTTLE_IP_LIMIT (int): attempts per client IP and window. 0 disables it.
+        LOGIN_THROTTLE_STORE (cachelib.BaseCache): shared counter store, in process when None.
+    """
+
+    def __init__(self, window=60.0, email_limit=10, ip_limit=30, store=None, clock=time.time):
+        self.window = window
+        self.email_limit = email_limit
+        self.ip_limit = ip_limit
+        self.store = store or MemoryThrottleStore(clock=clock)
+        self.rejected = 0
+        self._clock = clock
+
+    def init_app(self, app):
+        """Reads the limits and store from the app config."""
+        app.config.setdefault('LOGIN_THROTTLE_WINDOW', 60.0)
+        app.config.setdefault('LOGIN_THROTTLE_EMAIL_LIMIT', 10)
+        app.config.setdefault('LOGIN_THROTTLE_IP_LIMIT', 30)
+        app.config.setdefault('LOGIN_THROTTLE_STORE', None)
+        self.window = float(app.config['LOGIN_THROTTLE_WINDOW'])
+        self.email_limit = int(app.config['LOGIN_THROTTLE_EMAIL_LIMIT'])
+        self.ip_limit = int(app.config['LOGIN_THROTTLE_IP_LIMIT'])
+        shared = app.config['LOGIN_THROTTLE_STORE']
+        self.store = MemoryThrottleStore(clock=self._clock) if shared is None else CachelibThrottleStore(shared)
+        self.rejected = 0
+        app.extensions['login_throttle'] = self
+
+    def attempt(self, email, ip):
+        """
+        Records a login attempt for email from ip.
+
+        Returns None if it may proceed, otherwise the seconds to wait
+        before retrying, in which case nothing is recorded.
+        """
+        now = self._clock()
+        window_index = int(now // self.window)
+        elapsed = now - window_index * self.window
+        keys = []
+        if self.email_limit > 0 and email:
+            keys.append((f"email:{email.lower()}", self.email_limit))
+        if self.ip_limit > 0 and ip:
+            keys.append((f"ip:{ip}", self.ip_limit))
+        expires_at = (window_index + 2) * self.window
+        retry_after = 0
+        for key, limit in keys:
+            previous, current = self.store.increment(key, window_index, expires_at)
+            # Checked against the attempts counted before this one
+            retry_after = max(retry_after, self._wait(previous, current - 1, limit, elapsed))
+        if retry_after > 0:
+            for key, _ in keys:
+                self.store.decrement(key, window_index, expires_at)
+            self.rejected += 1
+            return retry_after
+        return None
+
+    def _wait(self, previous, current, limit, elapsed):
+        """Returns the whole seconds until one more attempt fits under limit, 0 if it does now."""
+        weight = 1 - elapsed / self.window
+        if previous * weight + current < limit:
+            return 0
+        if current < limit:
+            # The previous window's share has to decay below limit - current
+            wait = self.window * (1 - (limit - current) / previous) - elapsed
+        else:
+            # This window becomes the previous one, whose share then has to decay below limit
+            wait = self.window - elapsed + self.window * (1 - limit / current)
+        return math.floor(wait) + 1
+
+
+login_throttle = LoginThrottle()
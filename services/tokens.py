@@ -0,0 +1,108 @@
+import hashlib
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from services.caching import ExpiringLRUCache
+from services.metrics import metrics
+from services.revocation import revocation_list
+from services.signing import key_ring
+
+TOKEN_LIFETIME = timedelta(hours=24)
+
+
+class TokenCache:
+    """
+    Caches the claims of access tokens that have already been verified.
+
+    Entries are keyed by the SHA-256 digest of the token, so raw tokens are
+    not kept in memory, and each one expires at the token's exp claim.
+    The cache is purged automatically when the signing secret or key ring
+    changes and can be purged by hand with purge().
+    """
+
+    def __init__(self, maxsize=10000):
+        self.cache = ExpiringLRUCache(maxsize)
+        self._secret = None
+        self._keys = None
+
+    def init_app(self, app):
+        """Reads TOKEN_CACHE_SIZE from the app config. 0 disables the cache."""
+        app.config.setdefault('TOKEN_CACHE_SIZE', 10000)
+        self.cache.maxsize = app.config['TOKEN_CACHE_SIZE']
+        self.purge()
+
+    def purge(self):
+        """Drops every cached token, e.g. after the secret key rotated."""
+        self.cache.clear()
+
+    def stats(self):
+        """Returns size, hits and misses."""
+        return self.cache.stats()
+
+    def decode(self, token: str, secret: str, keys=None) -> dict:
+        """
+        Returns the verified claims of token, checked against the KeyRing
+        keys if given, else with HS256 and secret.
+
+        Raises the same jwt exceptions as jwt.decode on a cache miss.
+        """
+        # A reloaded ring has a new JWKS etag
+        ring = None if keys is None else (keys.jwks_etag, keys.accept_hs256)
+        if secret != self._secret or ring != self._keys:
+            self.cache.clear()
+            self._secret = secret
+            self._keys = ring
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        claims = self.cache.get(key)
+        if claims is not None:
+            return claims
+        if keys is None:
+            import jwt
+            claims = jwt.decode(token, secret, algorithms=['HS256'])
+        else:
+            claims = keys.decode(token, secret)
+        expires_at = claims.get('exp')
+        if expires_at is not None:
+            self.cache.set(key, claims, expires_at)
+        return claims
+
+
+token_cache = TokenCache()
+
+
+def encode_access_token(user_id: str, secret: str = None) -> str:
+    """
+    Mints an access token for user_id that is valid for TOKEN_LIFETIME.
+
+    Its jti claim identifies it for revocation, and its iat claim, to the
+    microsecond, orders it against revocations of every token of the user.
+    It is signed by the signing key of key_ring, or with HS256 when no keys
+    are configured.
+
+    secret defaults to the SECRET_KEY of the current Flask app.
+    """
+    if secret is None:
+        secret = current_app.config['SECRET_KEY']
+    expiration_time = datetime.now() + TOKEN_LIFETIME
+    payload = { "userId": user_id, "exp": expiration_time, "iat": time.time(), "jti": uuid.uuid4().hex }
+    return key_ring.encode(payload, secret)
+
+
+def decode_access_token(token: str, secret: str = None) -> dict:
+    """
+    Verifies token, using the claims cache, and returns its claims.
+    Revoked tokens raise jwt.InvalidTokenError like invalid ones.
+
+    secret defaults to the SECRET_KEY of the current Flask app.
+    """
+    if secret is None:
+        secret = current_app.config['SECRET_KEY']
+    with metrics.timer(metrics.jwt_verify_duration):
+        claims = token_cache.decode(token, secret, key_ring)
+    if revocation_list.is_revoked(claims):
+        import jwt
+        raise jwt.InvalidTokenError("Token has been revoked")
+    return claims
@@ -0,0 +1,309 @@
+import asyncio
+import gzip
+import json
+import unittest
+from unittest import mock
+
+from app import create_app
+from aio import AsyncApp, Router
+from aio.app import Response
+from services import metrics
+
+
+class ASGIClient:
+    """
+    Drives an ASGI app in-process and returns (status, headers, json body).
+    The ASGI messages of the last response are kept in sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.sent = []
+
+    async def request(self, method, path, json_body=None, headers=None):
+        body = json.dumps(json_body).encode() if json_body is not None else b''
+        path, _, query_string = path.partition('?')
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query_string.encode(),
+            'headers': [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.app(scope, receive, send)
+        self.sent = sent
+        status = sent[0]['status']
+        response_headers = {k.decode(): v.decode() for k, v in sent[0]['headers']}
+        payload = b''.join(m.get('body', b'') for m in sent[1:])
+        if payload and response_headers.get('content-type') == 'application/json':
+            payload = json.loads(payload)
+        return status, response_headers, payload
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, json=None, **kwargs):
+        return await self.request('POST', path, json_body=json, **kwargs)
+
+
+class AsyncModeTestCase(unittest.IsolatedAsyncioTestCase):
+    """The async serving mode keeps the JSON contracts of tests/auth_spec.py."""
+
+    async def asyncSetUp(self):
+        self.app = create_app(test=True, mode='async')
+        await self.app.create_all()
+        self.client = ASGIClient(self.app)
+        for first, email in (('John', 'john.doe@example.com'), ('John2', 'john.doe2@example.com')):
+            status, _, data = await self.client.post('/auth/register', json={
+                'firstName': first,
+                'lastName': 'Doe',
+                'email': email,
+                'password': 'password123'
+            })
+            self.assertEqual(status, 201)
+        self.userId2 = data['data']['user']['userId']
+        status, _, data = await self.client.post('/auth/login', json={
+            'email': 'john.doe@example.com',
+            'password': 'password123'
+        })
+        self.assertEqual(status, 200)
+        self.userId = data['data']['user']['userId']
+        self.headers = {'Authorization': f"Bearer {data['data']['accessToken']}"}
+
+    async def asyncTearDown(self):
+        await self.app.drop_all()
+        await self.app.dispose()
+
+    async def test_login_user_unsuccess(self):
+        status, _, data = await self.client.post('/auth/login', json={
+            'email': 'john.doe@example.com',
+            'password': 'password12'
+        })
+        self.assertEqual(status, 401)
+        self.assertEqual(data, {
+            "status": "Bad request",
+            "message": "Authentication failed",
+            "statusCode": 401
+        })
+
+    async def test_user_lookup(self):
+        status, _, data = await self.client.get(f'/api/users/{self.userId}', headers=self.headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(data['data']['email'], 'john.doe@example.com')
+        self.assertNotIn('password', data['data'])
+        status, _, _ = await self.client.get(f'/api/users/{self.userId2}', headers=self.headers)
+        self.assertEqual(status, 401)
+
+    async def test_logout_revokes_the_token(self):
+        status, _, data = await self.client.post('/auth/logout', headers=self.headers)
+        self.assertEqual(status, 200)
+        status, _, data = await self.client.get(f'/api/users/{self.userId}', headers=self.headers)
+        self.assertEqual(status, 401)
+        self.assertEqual(data['errors'][0]['message'], 'Invalid token')
+
+    async def test_missing_authorization(self):
+        status, _, data = await self.client.get(f'/api/users/{self.userId}')
+        self.assertEqual(status, 401)
+        self.assertEqual(data['errors'][0]['message'], 'Authorization header is required')
+
+    async def test_create_and_fetch_organization(self):
+        status, _, data = await self.client.post('/api/organisations', json={
+            'name': 'Johns Company'
+        }, headers=self.headers)
+        self.assertEqual(status, 201)
+        self.assertEqual(data['data']['description'], None)
+        orgId = data['data']['orgId']
+        status, _, data = await self.client.get(f'/api/organisations/{orgId}', headers=self.headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(data['data']['name'], 'Johns Company')
+        status, _, data = await self.client.get('/api/organisations', headers=self.headers)
+        self.assertEqual(sorted(org['name'] for org in data['data']), ["John's Organisation", 'Johns Company'])
+        status, _, _ = await self.client.post('/api/organisations', json={
+            'name': 'Johns Company'
+        }, headers=self.headers)
+        self.assertEqual(status, 400)
+
+    async def test_add_user_to_organization(self):
+        _, _, data = await self.client.get('/api/organisations', headers=self.headers)
+        orgId = data['data'][0]['orgId']
+        status, _, data = await self.client.post(f'/api/organisations/{orgId}/users', json={
+            'userId': 'fakecredentials'
+        }, headers=self.headers)
+        self.assertEqual(status, 404)
+        self.assertIn('The User was not found', data['message'])
+        status, _, data = await self.client.post('/api/organisations/invalid_org_id/users', json={
+            'userId': self.userId2
+        }, headers=self.headers)
+        self.assertEqual(status, 404)
+        self.assertIn('Organization not found', data['message'])
+        status, _, data = await self.client.post(f'/api/organisations/{orgId}/users', json={
+            'userId': self.userId2
+        }, headers=self.headers)
+        self.assertEqual(status, 200)
+        self.assertIn('User added to organization successfully', data['message'])
+
+    async def test_add_users_to_organization_in_batch(self):
+        _, _, data = await self.client.get('/api/organisations', headers=self.headers)
+        orgId = data['data'][0]['orgId']
+        status, _, data = await self.client.post(f'/api/organisations/{orgId}/users/batch', json={
+            'userIds': [self.userId2, 'fakecredentials', self.userId]
+        }, headers=self.headers)
+        self.assertEqual(status, 200)
+        self.assertEqual((data['data']['added'], data['data']['alreadyMember'], data['data']['notFound']), (1, 1, 1))
+        self.assertEqual([result['status'] for result in data['data']['results']],
+                         ['added', 'notFound', 'alreadyMember'])
+        status, _, data = await self.client.post('/api/organisations/invalid_org_id/users/batch', json={
+            'userIds': [self.userId2]
+        }, headers=self.headers)
+        self.assertEqual(status, 404)
+        self.assertIn('Organization not found', data['message'])
+        status, _, data = await self.client.post(f'/api/organisations/{orgId}/users/batch', json={
+            'userIds': [f'user-{n}' for n in range(self.app.config['ORGANISATIONS_BATCH_MAX_USERS'] + 1)]
+        }, headers=self.headers)
+        self.assertEqual(status, 422)
+        self.assertEqual(data['errors'][0]['field'], 'userIds')
+
+    async def test_search_organizations(self):
+        for name in ('Acme Labs', 'Acme Works', 'Globex'):
+            status, _, _ = await self.client.post('/api/organisations', json={'name': name}, headers=self.headers)
+            self.assertEqual(status, 201)
+        status, _, data = await self.client.get('/api/organisations/search?q=acme', headers=self.headers)
+        self.assertEqual(status, 200)
+        self.assertEqual([org['name'] for org in data['data']], ['Acme Labs', 'Acme Works'])
+        status, _, data = await self.client.get('/api/organisations/search?q=globx&mode=fuzzy',
+                                                headers=self.headers)
+        self.assertEqual(status, 200)
+        self.assertEqual([org['name'] for org in data['data']], ['Globex'])
+        status, _, data = await self.client.get('/api/organisations/search', headers=self.headers)
+        self.assertEqual(status, 400)
+        self.assertEqual(data['message'], 'Invalid q')
+
+    async def test_members_are_streamed_as_ndjson(self):
+        _, _, data = await self.client.get('/api/organisations', headers=self.headers)
+        orgId = data['data'][0]['orgId']
+        await self.client.post(f'/api/organisations/{orgId}/users', json={'userId': self.userId2}, headers=self.headers)
+        self.app.config['ORGANISATIONS_EXPORT_BATCH_SIZE'] = 1
+        status, headers, payload = await self.client.get(f'/api/organisations/{orgId}/users', headers=self.headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/x-ndjson')
+        members = [json.loads(line) for line in payload.splitlines()]
+        self.assertEqual({member['userId'] for member in members}, {self.userId, self.userId2})
+        # One chunk per batch of rows, then the closing empty body
+        bodies = [message for message in self.client.sent if message['type'] == 'http.response.body']
+        self.assertEqual([message.get('more_body', False) for message in bodies], [True, True, False])
+
+        status, headers, payload = await self.client.get(
+            f'/api/organisations/{orgId}/users', headers={**self.headers, 'Accept-Encoding': 'gzip'})
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(payload).splitlines()), 2)
+
+        status, _, data = await self.client.get('/api/organisations/invalid_org_id/users', headers=self.headers)
+        self.assertEqual(status, 404)
+        self.assertIn('You are not in this organization', data['message'])
+
+    async def test_jwks(self):
+        status, headers, data = await self.client.get('/.well-known/jwks.json')
+        self.assertEqual(status, 200)
+        self.assertEqual(data, {"keys": []})
+        status, _, _ = await self.client.get('/.well-known/jwks.json', headers={'If-None-Match': headers['ETag']})
+        self.assertEqual(status, 304)
+
+
+
+class AsyncMetricsAndAdminTestCase(unittest.IsolatedAsyncioTestCase):
+    """/metrics and the admin routes are served in async mode too."""
+
+    async def asyncSetUp(self):
+        self.app = create_app(test=True, config={'METRICS_ENABLED': True, 'ADMIN_API_KEY': 'admin-key'},
+                              mode='async')
+        await self.app.create_all()
+        self.client = ASGIClient(self.app)
+
+    async def asyncTearDown(self):
+        await self.app.drop_all()
+        await self.app.dispose()
+        metrics.enabled = False
+
+    async def test_requests_are_recorded(self):
+        status, _, data = await self.client.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password123'
+        })
+        self.assertEqual(status, 201)
+        headers = {'Authorization': f"Bearer {data['data']['accessToken']}"}
+        await self.client.get('/api/organisations', headers=headers)
+        await self.client.get('/missing')
+
+        status, response_headers, payload = await self.client.get('/metrics')
+        self.assertEqual(status, 200)
+        self.assertTrue(response_headers['content-type'].startswith('text/plain; version=0.0.4'))
+        body = payload.decode()
+        self.assertIn('http_request_duration_seconds_count{endpoint="/auth/register",method="POST",status="201"} 1',
+                      body)
+        self.assertIn('http_request_duration_seconds_count{endpoint="unmatched",method="GET",status="404"} 1', body)
+        queries = next(line for line in body.splitlines()
+                       if line.startswith('http_request_queries_sum{endpoint="/api/organisations"'))
+        self.assertGreater(float(queries.rsplit(' ', 1)[1]), 0)
+
+    async def test_admin_routes(self):
+        status, _, _ = await self.client.get('/api/admin/cache-stats')
+        self.assertEqual(status, 403)
+        admin = {'X-Admin-Key': 'admin-key'}
+        status, _, data = await self.client.get('/api/admin/cache-stats', headers=admin)
+        self.assertEqual(status, 200)
+        self.assertEqual(set(data['data']), {'tokens', 'profiles', 'memberships', 'revocations'})
+        status, _, data = await self.client.post('/api/admin/users/import', headers=admin)
+        self.assertEqual(status, 501)
+        self.assertIn('not served in async mode', data['message'])
+
+
+class AsyncAppTestCase(unittest.IsolatedAsyncioTestCase):
+    """Request handling of AsyncApp itself, on a router of test handlers."""
+
+    async def asyncSetUp(self):
+        router = Router()
+
+        @router.route("/fail")
+        async def fail(request):
+            raise RuntimeError("handler bug")
+
+        @router.route("/ok")
+        async def ok(request):
+            return Response(b'ok', content_type='text/plain')
+
+        self.app = AsyncApp(create_app(test=True).config, router)
+        self.client = ASGIClient(self.app)
+
+    async def asyncTearDown(self):
+        await self.app.drop_all()
+        await self.app.dispose()
+
+    async def test_handler_errors_are_logged_with_their_traceback(self):
+        with self.assertLogs('aio.app', 'ERROR') as logs:
+            status, _, payload = await self.client.get('/fail')
+        self.assertEqual(status, 500)
+        self.assertEqual(payload, b'Internal Server Error')
+        self.assertIn('GET /fail failed', logs.output[0])
+        self.assertIn('RuntimeError: handler bug', logs.output[0])
+
+    async def test_concurrent_first_requests_check_the_schema_once(self):
+        create_all = self.app.create_all
+        with mock.patch.object(self.app, 'create_all', side_effect=create_all) as checked:
+            results = await asyncio.gather(*(self.client.get('/ok') for _ in range(5)))
+        self.assertEqual([status for status, _, _ in results], [200] * 5)
+        self.assertEqual(checked.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
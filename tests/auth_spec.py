@@ -1,7 +1,12 @@
+import sqlite3
 import unittest
 import uuid
+from types import SimpleNamespace
+
+from sqlalchemy.exc import IntegrityError
 from app import create_app
 from models import User, Organization, db
+from tests.query_budget import query_budget
 
 class UserRegistrationLoginTestCase(unittest.TestCase):
     def setUp(self):
@@ -9,8 +14,6 @@ class UserRegistrationLoginTestCase(unittest.TestCase):
         with self.app.app_context():
             # Create tables
             db.create_all()
-        from views import app_views
-        self.app.register_blueprint(app_views)
         self.client = self.app.test_client()
 
     def tearDown(self):
@@ -19,12 +22,13 @@ class UserRegistrationLoginTestCase(unittest.TestCase):
             db.drop_all()
 
     def test_register_user_success_with_default_organization(self):
-        response = self.client.post('/auth/register', json={
-            'firstName': 'John',
-            'lastName': 'Doe',
-            'email': 'john.doe@example.com',
-            'password': 'password123'
-        })
+        with query_budget(self, 3):
+            response = self.client.post('/auth/register', json={
+                'firstName': 'John',
+                'lastName': 'Doe',
+                'email': 'john.doe@example.com',
+                'password': 'password123'
+            })
 
         self.assertEqual(response.status_code, 201)
         data = response.get_json()
@@ -45,10 +49,11 @@ class UserRegistrationLoginTestCase(unittest.TestCase):
             'password': 'password123'
         })
         # Then, try to log in
-        response = self.client.post('/auth/login', json={
-            'email': 'jane.doe@example.com',
-            'password': 'password123'
-        })
+        with query_budget(self, 1):
+            response = self.client.post('/auth/login', json={
+                'email': 'jane.doe@example.com',
+                'password': 'password123'
+            })
         self.assertEqual(response.status_code, 200)
         data = response.get_json()
         self.assertIn('accessToken', data['data'])
@@ -75,10 +80,11 @@ class UserRegistrationLoginTestCase(unittest.TestCase):
             'password': 'password123'
         })
         # Then, try to log in
-        response = self.client.post('/auth/login', json={
-            'email': 'jane.doe@example.com',
-            'password': 'password12'
-        })
+        with query_budget(self, 1):
+            response = self.client.post('/auth/login', json={
+                'email': 'jane.doe@example.com',
+                'password': 'password12'
+            })
         self.assertEqual(response.status_code, 401)
         data = response.get_json()
         expected = {
@@ -98,7 +104,8 @@ class UserRegistrationLoginTestCase(unittest.TestCase):
                 'password': 'password123'
             }
             payload.pop(field)
-            response = self.client.post('/auth/register', json=payload)
+            with query_budget(self, 0):
+                response = self.client.post('/auth/register', json=payload)
             self.assertEqual(response.status_code, 422)
             data = response.get_json()
             self.assertIn('errors', data)
@@ -113,16 +120,50 @@ class UserRegistrationLoginTestCase(unittest.TestCase):
             'password': 'password123'
         })
         # Try to register another user with the same email
+        with query_budget(self, 2):
+            response = self.client.post('/auth/register', json={
+                'firstName': 'Test2',
+                'lastName': 'User2',
+                'email': 'test.user@example.com',
+                'password': 'password1234'
+            })
+        self.assertEqual(response.status_code, 422)
+        data = response.get_json()
+        self.assertIn('errors', data)
+        self.assertTrue(any(error['message'] == 'Email already exists' for error in data['errors']))
+
+    def test_register_duplicate_email_is_case_insensitive(self):
+        self.client.post('/auth/register', json={
+            'firstName': 'Test',
+            'lastName': 'User',
+            'email': 'test.user@example.com',
+            'password': 'password123'
+        })
         response = self.client.post('/auth/register', json={
             'firstName': 'Test2',
             'lastName': 'User2',
-            'email': 'test.user@example.com',
+            'email': 'Test.User@Example.com',
             'password': 'password1234'
         })
         self.assertEqual(response.status_code, 422)
-        data = response.get_json()
-        self.assertIn('errors', data)
-        self.assertTrue(any(error['message'] == 'Email already exists' for error in data['errors']))
+        self.assertEqual(response.get_json()['errors'][0]['field'], 'email')
+        response = self.client.post('/auth/login', json={
+            'email': 'TEST.USER@example.com',
+            'password': 'password123'
+        })
+        self.assertEqual(response.status_code, 200)
+
+    def test_register_round_trips(self):
+        with query_budget(self, 3) as statements:
+            response = self.client.post('/auth/register', json={
+                'firstName': 'John',
+                'lastName': 'Doe',
+                'email': 'john.doe@example.com',
+                'password': 'password123'
+            })
+        self.assertEqual(response.status_code, 201)
+        # user, organization and membership inserts, no duplicate-email SELECT
+        self.assertEqual([statement.split()[0].upper() for statement in statements], ['INSERT', 'INSERT', 'INSERT'])
 
 
 class UserOrganizationTestCase(unittest.TestCase):
@@ -132,8 +173,6 @@ class UserOrganizationTestCase(unittest.TestCase):
         with self.app.app_context():
             # Create tables
             db.create_all()
-        from views import app_views
-        self.app.register_blueprint(app_views)
         self.client = self.app.test_client()
         
         # First, register a user
@@ -168,9 +207,10 @@ class UserOrganizationTestCase(unittest.TestCase):
 
     def test_create_organization_success(self):
         # Then, create an organization and add authorization header with the access token
-        response = self.client.post('/api/organisations', json={
-            'name': 'Johns Company'
-        }, headers={'Authorization': f'Bearer {self.accessToken}'})
+        with query_budget(self, 5):
+            response = self.client.post('/api/organisations', json={
+                'name': 'Johns Company'
+            }, headers={'Authorization': f'Bearer {self.accessToken}'})
         
         data = response.get_json()
         self.assertEqual(response.status_code, 201)
@@ -183,26 +223,29 @@ class UserOrganizationTestCase(unittest.TestCase):
 
     # Organisation - Ensure users can’t see data from organisations they don’t have access to.
     def test_user_not_found(self):
-        response3 = self.client.post('/api/organisations/:orgId/users', json={
-                            "userId": "fakecredentials"
-                            }, headers={"Authorization": f"Bearer {self.accessToken}"})
+        with query_budget(self, 2):
+            response3 = self.client.post('/api/organisations/:orgId/users', json={
+                                "userId": "fakecredentials"
+                                }, headers={"Authorization": f"Bearer {self.accessToken}"})
         data = response3.get_json()
         self.assertEqual(response3.status_code, 404)
         self.assertIn('The User was not found', data['message'])
 
     def test_organization_not_found(self):
         # Assume a valid user session setup
-        response4 = self.client.post('/api/organisations/invalid_org_id/users', json={
-                 'userId': self.userId
-            }, headers={"Authorization": f"Bearer {self.accessToken}"})
+        with query_budget(self, 3):
+            response4 = self.client.post('/api/organisations/invalid_org_id/users', json={
+                     'userId': self.userId
+                }, headers={"Authorization": f"Bearer {self.accessToken}"})
         dat = response4.get_json()        
         self.assertEqual(response4.status_code, 404)
         self.assertIn('Organization not found', dat['message'])
 
     def test_adding_user_not_found(self):
         # Assume a valid user and organization setup
-        response3 = self.client.post('/api/organisations/valid_org_id/users', json={
-            'userId': 'nvalid_user_id'}, headers={"Authorization": f"Bearer {self.accessToken}"})
+        with query_budget(self, 2):
+            response3 = self.client.post('/api/organisations/valid_org_id/users', json={
+                'userId': 'nvalid_user_id'}, headers={"Authorization": f"Bearer {self.accessToken}"})
         data = response3.get_json()
         self.assertEqual(response3.status_code, 404)
         self.assertIn('The User was not found', data['message'])
@@ -212,6 +255,7 @@ class UserOrganizationTestCase(unittest.TestCase):
         with self.app.app_context():
             user = User.query.filter_by(firstName='John').first()
             self.orgId = user.organizations[0].orgId
+        with query_budget(self, 3):
             response3 = self.client.post(f'/api/organisations/{self.orgId}/users', json={
                 "userId": self.userId }, headers={"Authorization": f"Bearer {self.accessToken}"})
         data = response3.get_json()
@@ -225,6 +269,8 @@ class UserOrganizationTestCase(unittest.TestCase):
             db.session.add(organization)
             db.session.commit()
             url = f'/api/organisations/{organization.orgId}/users'
+        # A membership cache miss is confirmed in the database before denying
+        with query_budget(self, 5):
             response2 = self.client.post(url,
                                     json={"userId": self.userId},
                                     headers={"Authorization": f"Bearer {self.accessToken}"})
@@ -240,8 +286,6 @@ class OrganizationAccessTestCase(unittest.TestCase):
         with self.app.app_context():
             # Create tables
             db.create_all()
-        from views import app_views
-        self.app.register_blueprint(app_views)
         self.client = self.app.test_client()
         
         # First, register a user
@@ -283,7 +327,9 @@ class OrganizationAccessTestCase(unittest.TestCase):
             'name': 'Johns Companies'
         }, headers={'Authorization': f'Bearer {self.accessToken}'})
         self.org1 = resp.get_json()['data']
-        response = self.client.get(f'/api/organisations/{self.org1["orgId"]}', headers={'Authorization': f'Bearer {self.accessToken2}'})
+        # Memberships, the EXISTS confirming the miss, then the user
+        with query_budget(self, 3):
+            response = self.client.get(f'/api/organisations/{self.org1["orgId"]}', headers={'Authorization': f'Bearer {self.accessToken2}'})
         data = response.get_json()
         
         self.assertEqual(response.status_code, 404)
@@ -295,17 +341,76 @@ class OrganizationAccessTestCase(unittest.TestCase):
             'name': 'Johns Companies'
         }, headers={'Authorization': f'Bearer {self.accessToken}'})
         self.org1 = resp.get_json()['data']
-        response = self.client.get(f'/api/organisations/{self.org1["orgId"]}', headers={'Authorization': f'Bearer {self.accessToken}'})
+        # Memberships, the EXISTS confirming the miss, then the user
+        with query_budget(self, 3):
+            response = self.client.get(f'/api/organisations/{self.org1["orgId"]}', headers={'Authorization': f'Bearer {self.accessToken}'})
         data = response.get_json()
         
         self.assertEqual(response.status_code, 200)
         self.assertEqual('Johns Companies', data['data']['name'])
 
+    def test_user_profile_query_budget(self):
+        with query_budget(self, 1) as statements:
+            response = self.client.get(f'/api/users/{self.userId}', headers={'Authorization': f'Bearer {self.accessToken}'})
+        self.assertEqual(response.status_code, 200)
+        # Only the profile columns are read, and no session cookie is set
+        self.assertNotIn('password', statements[0])
+        self.assertNotIn('Set-Cookie', response.headers)
+        # Served from the profile cache the second time
+        with query_budget(self, 0):
+            response = self.client.get(f'/api/users/{self.userId}', headers={'Authorization': f'Bearer {self.accessToken}'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_organizations_query_budget(self):
+        for name in ('First', 'Second', 'Third'):
+            self.client.post('/api/organisations', json={'name': name},
+                             headers={'Authorization': f'Bearer {self.accessToken}'})
+        # Does not grow with the number of organisations
+        with query_budget(self, 2):
+            response = self.client.get('/api/organisations', headers={'Authorization': f'Bearer {self.accessToken}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()['data']), 4)
+        with query_budget(self, 2):
+            response = self.client.get('/api/organisations?limit=2', headers={'Authorization': f'Bearer {self.accessToken}'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_batch_add_query_budget(self):
+        resp = self.client.post('/api/organisations', json={
+            'name': 'Johns Companies'
+        }, headers={'Authorization': f'Bearer {self.accessToken}'})
+        orgId = resp.get_json()['data']['orgId']
+        with query_budget(self, 3):
+            response = self.client.post(f'/api/organisations/{orgId}/users/batch', json={
+                'userIds': [self.userId2, str(uuid.uuid4())]
+            }, headers={'Authorization': f'Bearer {self.accessToken}'})
+        self.assertEqual(response.status_code, 200)
+
     def tearDown(self):
         """Tear down all initialized variables."""
         with self.app.app_context():
             db.session.remove()
             db.drop_all()
 
+
+class EmailConflictTestCase(unittest.TestCase):
+    """User.is_email_conflict matches constraint names, not the word email."""
+
+    def conflict(self, orig):
+        return User.is_email_conflict(IntegrityError('INSERT', None, orig))
+
+    def test_postgresql_constraint_names(self):
+        def error(name):
+            return SimpleNamespace(diag=SimpleNamespace(constraint_name=name))
+        self.assertTrue(self.conflict(error('ix_user_email_lower')))
+        self.assertTrue(self.conflict(error('user_email_key')))
+        self.assertFalse(self.conflict(error('user_pkey')))
+
+    def test_sqlite_messages(self):
+        self.assertTrue(self.conflict(sqlite3.IntegrityError("UNIQUE constraint failed: index 'ix_user_email_lower'")))
+        self.assertTrue(self.conflict(sqlite3.IntegrityError('UNIQUE constraint failed: user.email')))
+        self.assertFalse(self.conflict(sqlite3.IntegrityError('NOT NULL constraint failed: user.email')))
+        self.assertFalse(self.conflict(sqlite3.IntegrityError('UNIQUE constraint failed: user.userId')))
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,114 @@
+import json
+import os
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+from app import create_app
+from models import User, db
+from services import bulk_import
+from services.bulk_import import UserImporter, read_rows
+
+CSV = """firstName,lastName,email,password,phone
+Ann,Lee,ann@example.com,password123,
+Bob,Ray,bob@example.com,password123,555
+,Nobody,nobody@example.com,password123,
+Ann,Again,ann@example.com,password123,
+"""
+
+
+class BulkImportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(test=True, config={'ADMIN_API_KEY': 'admin-key'})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_endpoint_requires_admin_key(self):
+        response = self.client.post('/api/admin/users/import', data=CSV, content_type='text/csv')
+        self.assertEqual(response.status_code, 403)
+
+    def test_endpoint_imports_csv_and_reports_bad_rows(self):
+        response = self.client.post('/api/admin/users/import', data=CSV, content_type='text/csv',
+                                    headers={'X-Admin-Key': 'admin-key'})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()['data']
+        self.assertEqual(data['imported'], 2)
+        self.assertEqual(data['failed'], 2)
+        self.assertEqual([error['row'] for error in data['errors']], [3, 4])
+        self.assertEqual(data['errors'][0]['errors'][0]['field'], 'firstName')
+        self.assertEqual(data['errors'][1]['errors'][0]['message'], 'Email already exists')
+        with self.app.app_context():
+            user = User.query.filter_by(email='bob@example.com').first()
+            self.assertEqual(user.organizations[0].name, "Bob's Organisation")
+        response = self.client.post('/auth/login', json={'email': 'bob@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_checkpoint_resumes_after_last_committed_batch(self):
+        lines = [json.dumps({'firstName': f'U{i}', 'lastName': 'L', 'email': f'u{i}@example.com',
+                             'password': 'pw'}) for i in range(5)]
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = os.path.join(tmp, 'import.ckpt')
+            with self.app.app_context():
+                importer = UserImporter(batch_size=2, workers=0, checkpoint=checkpoint)
+                first = importer.run(read_rows(iter(lines[:3]), 'ndjson'))
+                self.assertEqual((first.imported, first.last_row), (3, 3))
+                second = importer.run(read_rows(iter(lines), 'ndjson'))
+                self.assertEqual((second.imported, second.failed, second.last_row), (2, 0, 5))
+                self.assertEqual(User.query.count(), 5)
+
+    def test_reported_errors_are_capped(self):
+        with self.app.app_context():
+            result = UserImporter(workers=0, max_errors=1).run(read_rows(iter(CSV.splitlines(True)), 'csv'))
+        data = result.to_dict()
+        self.assertEqual(data['failed'], 2)
+        self.assertEqual([error['row'] for error in data['errors']], [3])
+        self.assertTrue(data['errorsTruncated'])
+
+    def test_concurrent_duplicate_is_reported_per_row(self):
+        hash_password = bulk_import.bcrypt_hash
+
+        def register_meanwhile(password, rounds):
+            # Bob registers between the duplicate check and the insert
+            if not User.query.filter_by(email='bob@example.com').count():
+                db.session.add(User(userId=str(uuid.uuid4()), firstName='Bob', lastName='Ray',
+                                    email='bob@example.com', password='x'))
+                db.session.commit()
+            return hash_password(password, rounds)
+        with self.app.app_context(), mock.patch('services.bulk_import.bcrypt_hash', register_meanwhile):
+            result = UserImporter(workers=0, rounds=4).run(read_rows(iter(CSV.splitlines(True)), 'csv'))
+            self.assertEqual((result.imported, result.failed, result.last_row), (1, 3, 4))
+            self.assertEqual(result.errors[-1], {"row": 2, "email": "bob@example.com", "errors": [
+                {"field": "email", "message": "Email already exists"}]})
+            self.assertEqual(User.query.filter_by(email='ann@example.com').count(), 1)
+
+    def test_cli_defaults_come_from_the_config(self):
+        self.app.config.update(IMPORT_BATCH_SIZE=3, IMPORT_WORKERS=0)
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'users.csv')
+            with open(source, 'w') as handle:
+                handle.write(CSV)
+            with mock.patch('services.bulk_import.UserImporter', wraps=UserImporter) as importer:
+                result = self.app.test_cli_runner().invoke(args=['import-users', source])
+        self.assertIn('imported=2 failed=2', result.output)
+        self.assertEqual(importer.call_args.kwargs['batch_size'], 3)
+        self.assertEqual(importer.call_args.kwargs['workers'], 0)
+
+    def test_cli_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'users.csv')
+            errors = os.path.join(tmp, 'errors.ndjson')
+            with open(source, 'w') as handle:
+                handle.write(CSV)
+            result = self.app.test_cli_runner().invoke(
+                args=['import-users', source, '--workers', '0', '--errors', errors])
+            self.assertIn('imported=2 failed=2 lastRow=4', result.output)
+            with open(errors) as handle:
+                self.assertEqual(len(handle.readlines()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
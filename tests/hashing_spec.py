@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+import bcrypt
+from app import create_app
+from models import User, db
+from services.hashing import PasswordHasher, HashingUnavailable, calibrate_rounds, hash_rounds
+
+
+class PasswordHasherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.hasher = PasswordHasher()
+
+    def tearDown(self):
+        self.hasher.shutdown()
+
+    def test_inline_hash_and_check(self):
+        self.hasher.configure(pool_size=0, queue_depth=0, timeout=5)
+        hashed = self.hasher.hash_password('password123')
+        self.assertTrue(self.hasher.check_password('password123', hashed))
+        self.assertFalse(self.hasher.check_password('password12', hashed))
+
+    def test_pool_hash_and_check(self):
+        self.hasher.configure(pool_size=1, queue_depth=1, timeout=30)
+        hashed = self.hasher.hash_password('password123')
+        self.assertTrue(self.hasher.check_password('password123', hashed))
+
+        async def check():
+            return await self.hasher.check_password_async('password123', hashed)
+        self.assertTrue(asyncio.run(check()))
+
+    def test_full_queue_is_rejected(self):
+        self.hasher.configure(pool_size=1, queue_depth=0, timeout=30)
+        # Hold the only slot by taking it the way a running job would
+        self.assertTrue(self.hasher._slots.acquire(blocking=False))
+        with self.assertRaises(HashingUnavailable):
+            self.hasher.submit_hash('password123')
+        self.hasher._slots.release()
+
+    def test_hashes_use_the_configured_cost(self):
+        self.hasher.configure(pool_size=0, queue_depth=0, timeout=5, rounds=5)
+        hashed = self.hasher.hash_password('password123')
+        self.assertEqual(hash_rounds(hashed), 5)
+        self.assertFalse(self.hasher.needs_rehash(hashed))
+        self.assertTrue(self.hasher.needs_rehash(bcrypt.hashpw(b'password123', bcrypt.gensalt(4)).decode()))
+        self.assertIsNone(hash_rounds('not a hash'))
+
+    def test_calibration_picks_the_highest_cost_under_target(self):
+        # 10 ms at cost 8 doubles per round: 80 ms at 11, 160 ms at 12
+        with mock.patch('services.hashing._time_hash', return_value=0.01):
+            self.assertEqual(calibrate_rounds(0.1), 11)
+            self.assertEqual(calibrate_rounds(0.16), 12)
+            self.assertEqual(calibrate_rounds(0.001), 10)
+
+    def test_rehash_in_background(self):
+        self.hasher.configure(pool_size=0, queue_depth=0, timeout=5, rounds=4)
+        stored = []
+        done = threading.Event()
+
+        def store(new_hash):
+            stored.append(new_hash)
+            done.set()
+        self.assertTrue(self.hasher.rehash_in_background('password123', store))
+        self.assertTrue(done.wait(5))
+        self.assertEqual(hash_rounds(stored[0]), 4)
+        self.assertTrue(bcrypt.checkpw(b'password123', stored[0].encode()))
+
+
+    def test_slow_store_does_not_hold_up_the_pool(self):
+        self.hasher.configure(pool_size=1, queue_depth=1, timeout=3, rounds=4)
+        release = threading.Event()
+        stored = threading.Event()
+
+        def store(new_hash):
+            # A write waiting on a database lock
+            release.wait(10)
+            stored.set()
+        self.assertTrue(self.hasher.rehash_in_background('password123', store))
+        try:
+            hashed = self.hasher.hash_password('password456')
+            self.assertTrue(self.hasher.check_password('password456', hashed))
+        finally:
+            release.set()
+        self.assertTrue(stored.wait(5))
+
+
+class RehashOnLoginTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(test=True)
+        self.client = self.app.test_client()
+        self.userId = self.client.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password123'
+        }).get_json()['data']['user']['userId']
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def stored_hash(self):
+        with self.app.app_context():
+            return db.session.get(User, self.userId).password
+
+    def test_login_rehashes_at_the_configured_cost(self):
+        with self.app.app_context():
+            db.session.execute(User.password_rehash(
+                self.userId, self.stored_hash(), bcrypt.hashpw(b'password123', bcrypt.gensalt(5)).decode()))
+            db.session.commit()
+        response = self.client.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+        deadline = time.monotonic() + 5
+        while hash_rounds(self.stored_hash()) != 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(hash_rounds(self.stored_hash()), 4)
+        response = self.client.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import gzip
+import json
+import unittest
+import uuid
+from sqlalchemy import insert
+from app import create_app
+from models import User, Organization, db
+
+
+class MemberExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(test=True, config={'ORGANISATIONS_EXPORT_BATCH_SIZE': 100})
+        self.client = self.app.test_client()
+        self.userId, token = self.register('john.doe@example.com')
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.orgId = self.client.get('/api/organisations', headers=self.headers).get_json()['data'][0]['orgId']
+        self.memberIds = {self.userId}
+        with self.app.app_context():
+            rows = [{"userId": str(uuid.uuid4()), "firstName": "F", "lastName": "L",
+                     "email": f"member{i}@example.com", "password": "x"} for i in range(250)]
+            db.session.execute(insert(User), rows)
+            Organization.add_members(self.orgId, [row["userId"] for row in rows])
+            db.session.commit()
+        self.memberIds.update(row["userId"] for row in rows)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def register(self, email):
+        data = self.client.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': email,
+            'password': 'password123'
+        }).get_json()['data']
+        return data['user']['userId'], data['accessToken']
+
+    def test_members_are_streamed_as_ndjson(self):
+        response = self.client.get(f'/api/organisations/{self.orgId}/users', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        members = [json.loads(line) for line in response.get_data().splitlines()]
+        self.assertEqual({member['userId'] for member in members}, self.memberIds)
+        self.assertEqual(len(members), len(self.memberIds))
+        self.assertEqual(set(members[0]), {'userId', 'firstName', 'lastName', 'email', 'phone'})
+
+    def test_gzip_when_accepted(self):
+        response = self.client.get(f'/api/organisations/{self.orgId}/users',
+                                   headers={**self.headers, 'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(response.get_data()).splitlines()
+        self.assertEqual({json.loads(line)['userId'] for line in lines}, self.memberIds)
+
+    def test_only_members_can_export(self):
+        _, token = self.register('jane.doe@example.com')
+        headers = {'Authorization': f'Bearer {token}'}
+        response = self.client.get(f'/api/organisations/{self.orgId}/users', headers=headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('You are not in this organization', response.get_json()['message'])
+        response = self.client.get(f'/api/organisations/{uuid.uuid4()}/users', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f'/api/organisations/{self.orgId}/users')
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
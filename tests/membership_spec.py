@@ -0,0 +1,223 @@
+import unittest
+import uuid
+from unittest import mock
+from sqlalchemy import event
+from app import create_app
+from models import User, Organization, user_organization, db
+from services import membership_cache
+from views.organization import is_member
+
+
+class MembershipQueryTestCase(unittest.TestCase):
+    """Membership checks must not grow with the number of organizations a user is in."""
+
+    def setUp(self):
+        self.app = create_app(test=True)
+        self.client = self.app.test_client()
+        response = self.client.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password123'
+        })
+        data = response.get_json()['data']
+        self.userId = data['user']['userId']
+        self.headers = {'Authorization': f"Bearer {data['accessToken']}"}
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def add_organizations(self, count):
+        with self.app.app_context():
+            for i in range(count):
+                orgId = str(uuid.uuid4())
+                db.session.add(Organization(orgId=orgId, name=f'Org {i}'))
+                db.session.flush()
+                Organization.add_member(self.userId, orgId)
+            db.session.commit()
+            return orgId
+
+    def count_statements(self, method, url, **kwargs):
+        statements = []
+        with self.app.app_context():
+            engine = db.engine
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            response = getattr(self.client, method)(url, headers=self.headers, **kwargs)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        return response, statements
+
+    def test_reverse_index_is_declared(self):
+        self.assertIn('ix_user_organization_organization_id_user_id',
+                      {index.name for index in user_organization.indexes})
+
+    def test_statement_count_is_independent_of_membership_count(self):
+        orgId = self.add_organizations(1)
+        _, few = self.count_statements('get', f'/api/organisations/{orgId}')
+        orgId = self.add_organizations(50)
+        response, many = self.count_statements('get', f'/api/organisations/{orgId}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(few), len(many))
+
+    def test_name_clash_uses_single_lookup(self):
+        self.add_organizations(50)
+        response, statements = self.count_statements('post', '/api/organisations', json={'name': 'Org 7'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(statements), 2)
+
+    def test_keyset_pages_cover_every_organization_once(self):
+        self.add_organizations(7)
+        seen = []
+        cursor = None
+        while True:
+            url = '/api/organisations?limit=3' + (f'&cursor={cursor}' if cursor else '')
+            response = self.client.get(url, headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()
+            self.assertLessEqual(len(data['data']), 3)
+            seen.extend(org['orgId'] for org in data['data'])
+            cursor = data['pagination']['nextCursor']
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(sorted(seen), seen)
+        self.assertEqual(len(set(seen)), 8)
+
+    def test_page_size_is_capped_and_default_shape_kept(self):
+        self.add_organizations(3)
+        self.app.config['ORGANISATIONS_MAX_PAGE_SIZE'] = 2
+        data = self.client.get('/api/organisations?limit=1000', headers=self.headers).get_json()
+        self.assertEqual(data['pagination']['limit'], 2)
+        self.assertEqual(len(data['data']), 2)
+        data = self.client.get('/api/organisations', headers=self.headers).get_json()
+        self.assertNotIn('pagination', data)
+        self.assertEqual(len(data['data']), 4)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/organisations?cursor=not-a-cursor', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/organisations?limit=0', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_add_reports_each_user(self):
+        orgId = self.add_organizations(1)
+        with self.app.app_context():
+            others = [str(uuid.uuid4()) for _ in range(20)]
+            db.session.execute(User.__table__.insert(), [
+                {"userId": userId, "firstName": "F", "lastName": "L",
+                 "email": f"{userId}@example.com", "password": "x"} for userId in others
+            ])
+            db.session.commit()
+        userIds = others + [self.userId, 'missing-user', others[0]]
+        response, statements = self.count_statements(
+            'post', f'/api/organisations/{orgId}/users/batch', json={'userIds': userIds})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()['data']
+        self.assertEqual((data['added'], data['alreadyMember'], data['notFound']), (20, 1, 1))
+        statuses = {result['userId']: result['status'] for result in data['results']}
+        self.assertEqual(statuses[self.userId], 'alreadyMember')
+        self.assertEqual(statuses['missing-user'], 'notFound')
+        self.assertEqual(len(data['results']), 22)
+        # caller, org, membership, users IN, insert
+        self.assertLessEqual(len(statements), 5)
+        with self.app.app_context():
+            self.assertTrue(Organization.is_member(others[5], orgId))
+
+    def test_batch_add_validates_payload(self):
+        orgId = self.add_organizations(1)
+        response = self.client.post(f'/api/organisations/{orgId}/users/batch',
+                                    json={'userIds': 'nope'}, headers=self.headers)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.get_json()['errors'][0]['field'], 'userIds')
+
+    def test_batch_add_failure_is_logged(self):
+        orgId = self.add_organizations(1)
+        with mock.patch.object(Organization, 'add_members', side_effect=RuntimeError('insert failed')), \
+                self.assertLogs(self.app.logger, 'ERROR') as logs:
+            response = self.client.post(f'/api/organisations/{orgId}/users/batch',
+                                        json={'userIds': [self.userId]}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f'Adding users to organization {orgId} failed', logs.output[0])
+        self.assertIn('RuntimeError: insert failed', logs.output[0])
+
+    def test_membership_check_on_cache_hit_runs_no_query(self):
+        orgId = self.add_organizations(3)
+        with self.app.test_request_context():
+            self.assertTrue(is_member(self.userId, orgId))
+            engine = db.engine
+            statements = []
+
+            def record(conn, cursor, statement, *args):
+                statements.append(statement)
+            event.listen(engine, 'before_cursor_execute', record)
+            try:
+                self.assertTrue(is_member(self.userId, orgId.upper()))
+                self.assertFalse(is_member(self.userId, 'not-a-uuid'))
+                self.assertEqual(statements, [])
+                # A miss is confirmed with one EXISTS query
+                self.assertFalse(is_member(self.userId, str(uuid.uuid4())))
+                self.assertEqual(len(statements), 1)
+            finally:
+                event.remove(engine, 'before_cursor_execute', record)
+        _, statements = self.count_statements('get', f'/api/organisations/{orgId}')
+        self.assertEqual(len(statements), 1)
+
+    def test_created_organization_is_authorized_at_once(self):
+        orgId = self.add_organizations(1)
+        self.client.get(f'/api/organisations/{orgId}', headers=self.headers)
+        response = self.client.post('/api/organisations', json={'name': 'New'}, headers=self.headers)
+        newOrgId = response.get_json()['data']['orgId']
+        response = self.client.get(f'/api/organisations/{newOrgId}', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_added_member_is_authorized_at_once(self):
+        orgId = self.add_organizations(1)
+        other = self.client.post('/auth/register', json={
+            'firstName': 'Jane', 'lastName': 'Doe', 'email': 'jane.doe@example.com', 'password': 'password123'
+        }).get_json()['data']
+        other_headers = {'Authorization': f"Bearer {other['accessToken']}"}
+        response = self.client.get(f'/api/organisations/{orgId}', headers=other_headers)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(f'/api/organisations/{orgId}/users',
+                                    json={'userId': other['user']['userId']}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(f'/api/organisations/{orgId}', headers=other_headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_membership_added_by_another_process_is_authorized(self):
+        orgId = self.add_organizations(1)
+        other = self.client.post('/auth/register', json={
+            'firstName': 'Jane', 'lastName': 'Doe', 'email': 'jane.doe@example.com', 'password': 'password123'
+        }).get_json()['data']
+        other_headers = {'Authorization': f"Bearer {other['accessToken']}"}
+        self.assertEqual(self.client.get(f'/api/organisations/{orgId}', headers=other_headers).status_code, 404)
+        with self.app.app_context():
+            # Written past this process's cache invalidation, as another worker would
+            db.session.connection().execute(
+                user_organization.insert().values(user_id=other['user']['userId'], organization_id=orgId))
+            db.session.commit()
+        self.assertNotIn(orgId, membership_cache.sets.get(other['user']['userId'], count=False))
+        self.assertEqual(self.client.get(f'/api/organisations/{orgId}', headers=other_headers).status_code, 200)
+        with self.app.app_context():
+            self.assertIn(orgId, membership_cache.get(
+                other['user']['userId'], lambda: Organization.ids_for_member(other['user']['userId'])))
+
+    def test_rolled_back_membership_is_not_cached(self):
+        with self.app.app_context():
+            orgId = str(uuid.uuid4())
+            db.session.add(Organization(orgId=orgId, name='Draft'))
+            db.session.flush()
+            Organization.add_member(self.userId, orgId)
+            self.assertIn(orgId, membership_cache.get(self.userId, lambda: Organization.ids_for_member(self.userId)))
+            db.session.rollback()
+            self.assertNotIn(orgId, membership_cache.get(self.userId, lambda: Organization.ids_for_member(self.userId)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from app import create_app
+from models import db
+from services.metrics import Histogram, metrics
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_render_is_cumulative(self):
+        histogram = Histogram('latency_seconds', 'Latency.', ('endpoint',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, '/a')
+        histogram.observe(0.1, '/a')
+        histogram.observe(3, '/a')
+        lines = histogram.render().splitlines()
+        self.assertIn('latency_seconds_bucket{endpoint="/a",le="0.1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="/a",le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="/a",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{endpoint="/a"} 3.15', lines)
+        self.assertIn('latency_seconds_count{endpoint="/a"} 3', lines)
+
+
+class MetricsRouteTestCase(unittest.TestCase):
+    def make_client(self, enabled):
+        self.app = create_app(test=True, config={'METRICS_ENABLED': enabled})
+        return self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        metrics.enabled = False
+
+    def test_disabled_metrics_are_not_served(self):
+        client = self.make_client(False)
+        self.assertEqual(client.get('/metrics').status_code, 404)
+
+    def test_requests_are_recorded(self):
+        client = self.make_client(True)
+        response = client.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password123'
+        })
+        token = response.get_json()['data']['accessToken']
+        client.get('/api/organisations', headers={'Authorization': f'Bearer {token}'})
+        client.get('/missing')
+
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        body = response.get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_count{endpoint="/auth/register",method="POST",status="201"} 1', body)
+        self.assertIn('http_request_duration_seconds_count{endpoint="unmatched",method="GET",status="404"} 1', body)
+        self.assertIn('bcrypt_duration_seconds_count{operation="hash"} 1', body)
+        self.assertIn('jwt_verify_duration_seconds_count 1', body)
+        queries = next(line for line in body.splitlines()
+                       if line.startswith('http_request_queries_sum{endpoint="/api/organisations"'))
+        self.assertGreater(float(queries.rsplit(' ', 1)[1]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
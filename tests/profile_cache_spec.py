@@ -0,0 +1,90 @@
+import unittest
+from cachelib import SimpleCache
+from sqlalchemy import event
+from app import create_app
+from models import User, db
+from services import profile_cache
+
+
+class ProfileCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.shared = SimpleCache()
+        self.app = create_app(test=True, config={'ADMIN_API_KEY': 'admin-key', 'PROFILE_CACHE_SHARED': self.shared})
+        self.client = self.app.test_client()
+        response = self.client.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password123'
+        })
+        data = response.get_json()['data']
+        self.userId = data['user']['userId']
+        self.url = f'/api/users/{self.userId}'
+        self.headers = {'Authorization': f"Bearer {data['accessToken']}"}
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def get_profile(self):
+        statements = []
+        with self.app.app_context():
+            engine = db.engine
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.get(self.url, headers=self.headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['data'], statements
+
+    def test_second_read_is_served_from_cache(self):
+        first, statements = self.get_profile()
+        self.assertEqual(len(statements), 1)
+        second, statements = self.get_profile()
+        self.assertEqual(statements, [])
+        self.assertEqual(first, second)
+        self.assertEqual(second['email'], 'john.doe@example.com')
+        stats = profile_cache.stats()
+        self.assertEqual((stats['localHits'], stats['misses'], stats['hitRatio']), (1, 1, 0.5))
+
+    def test_shared_tier_refills_the_local_tier(self):
+        self.get_profile()
+        profile_cache.clear()
+        _, statements = self.get_profile()
+        self.assertEqual(statements, [])
+        self.assertEqual(profile_cache.stats()['sharedHits'], 1)
+
+    def test_updating_a_user_invalidates_both_tiers(self):
+        self.get_profile()
+        with self.app.app_context():
+            user = db.session.get(User, self.userId)
+            user.firstName = 'Jane'
+            db.session.commit()
+        self.assertIsNone(self.shared.get(profile_cache.prefix + self.userId))
+        data, statements = self.get_profile()
+        self.assertEqual(data['firstName'], 'Jane')
+        self.assertEqual(len(statements), 1)
+
+    def test_bulk_update_clears_the_local_tier(self):
+        self.get_profile()
+        with self.app.app_context():
+            db.session.execute(db.update(User).where(User.userId == self.userId).values(lastName='Roe'))
+            db.session.commit()
+        self.assertEqual(len(profile_cache.local), 0)
+
+    def test_stats_are_exposed_to_admins(self):
+        self.get_profile()
+        response = self.client.get('/api/admin/cache-stats', headers={'X-Admin-Key': 'admin-key'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['data']['profiles']['misses'], 1)
+        response = self.client.get('/api/admin/cache-stats')
+        self.assertEqual(response.status_code, 403)
+
+
+if __name__ == '__main__':
+    unittest.main()
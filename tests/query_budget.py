@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from models import db
+
+
+@contextmanager
+def query_budget(test_case, budget):
+    """
+    Fails test_case when more than budget SQL statements run on the
+    database of test_case.app inside the with block, e.g. around a
+    self.client call. Yields the list of statements recorded so far.
+    """
+    statements = []
+    with test_case.app.app_context():
+        engine = db.engine
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    if len(statements) > budget:
+        test_case.fail(f"{len(statements)} queries over a budget of {budget}:\n" + "\n".join(statements))
@@ -0,0 +1,92 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from app import create_app
+from models import db
+from services import replica_router
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.primary = os.path.join(self.dir, 'primary.sqlite3')
+        self.replica = os.path.join(self.dir, 'replica.sqlite3')
+        self.app = create_app(test=True, config={
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.primary}',
+            'SQLALCHEMY_REPLICA_URIS': [f'sqlite:///{self.replica}'],
+            'SQLALCHEMY_REPLICA_ENGINE_OPTIONS': {'pool_size': 2},
+            'PROFILE_CACHE_SIZE': 0,
+            'MEMBERSHIP_CACHE_SIZE': 0,
+        })
+        self.client = self.app.test_client()
+        self.userId, token = self.register('john.doe@example.com')
+        self.headers = {'Authorization': f'Bearer {token}'}
+        # The replica has caught up with the first registration, then lags
+        self.replicate()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        for engine in self.app.extensions['replica_engines']:
+            engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def register(self, email):
+        data = self.client.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': email,
+            'password': 'password123'
+        }).get_json()['data']
+        return data['user']['userId'], data['accessToken']
+
+    def replicate(self):
+        self.app.extensions['replica_engines'][0].dispose()
+        shutil.copyfile(self.primary, self.replica)
+
+    def end_sticky_window(self):
+        replica_router.local.clear()
+
+    def first_name(self, headers):
+        return self.client.get(f'/api/users/{self.userId}', headers=headers).get_json()['data']['firstName']
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        with sqlite3.connect(self.replica) as replica:
+            replica.execute('UPDATE user SET "firstName" = \'Replica\'')
+        # The registration made the client sticky
+        self.assertEqual(self.first_name(self.headers), 'John')
+        self.end_sticky_window()
+        self.assertEqual(self.first_name(self.headers), 'Replica')
+
+        response = self.client.post('/api/organisations', json={'name': 'Written'}, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        for path, count in ((self.primary, 1), (self.replica, 0)):
+            with sqlite3.connect(path) as connection:
+                rows = connection.execute("SELECT count(*) FROM organization WHERE name = 'Written'").fetchone()[0]
+            self.assertEqual(rows, count)
+        # Read your writes: sticky again after the commit
+        names = [org['name'] for org in self.client.get('/api/organisations', headers=self.headers).get_json()['data']]
+        self.assertIn('Written', names)
+        self.end_sticky_window()
+        names = [org['name'] for org in self.client.get('/api/organisations', headers=self.headers).get_json()['data']]
+        self.assertNotIn('Written', names)
+
+    def test_new_user_reads_from_the_primary_until_the_window_ends(self):
+        userId, token = self.register('jane.doe@example.com')
+        headers = {'Authorization': f'Bearer {token}'}
+        self.assertEqual(self.client.get(f'/api/users/{userId}', headers=headers).status_code, 200)
+        self.end_sticky_window()
+        # Not replicated yet
+        self.assertEqual(self.client.get(f'/api/users/{userId}', headers=headers).status_code, 404)
+
+    def test_replicas_get_their_own_engine_options(self):
+        engine, = self.app.extensions['replica_engines']
+        self.assertEqual(engine.pool.size(), 2)
+        self.assertEqual(str(engine.url), f'sqlite:///{self.replica}')
+
+
+if __name__ == '__main__':
+    unittest.main()
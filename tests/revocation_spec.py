@@ -0,0 +1,134 @@
+import time
+import unittest
+import uuid
+from unittest import mock
+from cachelib import SimpleCache
+from app import create_app
+from models import db
+from services import login_throttle, profile_cache, replica_router, revocation_list
+from services.caching import cache_from_url
+from services.revocation import BloomFilter, CachelibRevocationStore, RevocationList
+
+
+class BloomFilterTestCase(unittest.TestCase):
+    def test_no_false_negatives_and_few_false_positives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        added = [uuid.uuid4().hex for _ in range(1000)]
+        for item in added:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in added))
+        false_positives = sum(uuid.uuid4().hex in bloom for _ in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class RevocationListTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.revocations = RevocationList(sync_interval=0, lifetime=100, clock=lambda: self.now)
+
+    def test_revoked_token_until_expiry(self):
+        self.revocations.revoke_token('a', 1050)
+        self.assertTrue(self.revocations.is_revoked({'jti': 'a', 'userId': 'u'}))
+        self.assertFalse(self.revocations.is_revoked({'jti': 'b', 'userId': 'u'}))
+        self.now = 1060
+        self.assertFalse(self.revocations.is_revoked({'jti': 'a', 'userId': 'u'}))
+        self.revocations.sync()
+        self.assertEqual(self.revocations.store.entries, {})
+
+    def test_filter_rotation_keeps_live_ids(self):
+        self.revocations.revoke_token('a', 1100)
+        self.now = 1099
+        self.revocations.sync()
+        self.assertTrue(self.revocations.is_revoked({'jti': 'a'}))
+        # Rotated into the previous generation, then out
+        self.now = 1200
+        self.revocations.sync()
+        self.assertIn('a', self.revocations.filters[1])
+        self.now = 1300
+        self.revocations.sync()
+        self.assertFalse('a' in self.revocations.filters[0] or 'a' in self.revocations.filters[1])
+
+    def test_revoke_user_covers_earlier_tokens(self):
+        self.revocations.revoke_user('u', before=1000)
+        self.assertTrue(self.revocations.is_revoked({'jti': 'a', 'userId': 'u', 'iat': 999.5}))
+        self.assertTrue(self.revocations.is_revoked({'userId': 'u'}))
+        self.assertFalse(self.revocations.is_revoked({'jti': 'b', 'userId': 'u', 'iat': 1000.5}))
+        self.assertFalse(self.revocations.is_revoked({'jti': 'c', 'userId': 'v', 'iat': 999}))
+        self.now = 1101
+        self.assertFalse(self.revocations.is_revoked({'userId': 'u'}))
+        self.assertEqual(self.revocations.users, {})
+
+    def test_shared_store_reaches_other_processes(self):
+        shared = SimpleCache()
+        first = RevocationList(store=CachelibRevocationStore(shared), sync_interval=0)
+        second = RevocationList(store=CachelibRevocationStore(shared), sync_interval=0)
+        jti = uuid.uuid4().hex
+        first.revoke_token(jti, 2 ** 40)
+        now = time.time()
+        first.revoke_user('u', before=now)
+        self.assertTrue(second.is_revoked({'jti': jti}))
+        self.assertTrue(second.is_revoked({'userId': 'u', 'iat': now - 1}))
+        # A process started later reads the whole log
+        third = RevocationList(store=CachelibRevocationStore(shared), sync_interval=0)
+        self.assertTrue(third.is_revoked({'jti': jti}))
+
+
+class SharedCacheTestCase(unittest.TestCase):
+    def test_every_shared_store_uses_the_cache_url(self):
+        shared = SimpleCache()
+        with mock.patch('cachelib.RedisCache', return_value=shared) as redis_cache:
+            app = create_app(test=True, config={'SHARED_CACHE_URL': 'rediss://:s%40cret@cache.internal:6380/2'})
+        redis_cache.assert_called_once_with(host='cache.internal', port=6380, password='s@cret', db=2, ssl=True)
+        self.assertIs(revocation_list.store.cache, shared)
+        self.assertIs(login_throttle.store.cache, shared)
+        self.assertIs(profile_cache.shared, shared)
+        self.assertIs(replica_router.shared, shared)
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        create_app(test=True)
+        self.assertIsNone(profile_cache.shared)
+
+    def test_only_redis_urls_are_accepted(self):
+        with self.assertRaises(ValueError):
+            cache_from_url('memcached://localhost:11211')
+
+
+class RevocationRouteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(test=True)
+        self.client = self.app.test_client()
+        self.client.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def login(self):
+        response = self.client.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password123'})
+        return {'Authorization': f"Bearer {response.get_json()['data']['accessToken']}"}
+
+    def test_logout_revokes_only_that_token(self):
+        first, second = self.login(), self.login()
+        self.assertEqual(self.client.post('/auth/logout', headers=first).status_code, 200)
+        response = self.client.get('/api/organisations', headers=first)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.get_json()['errors'][0]['message'], 'Invalid token')
+        self.assertEqual(self.client.get('/api/organisations', headers=second).status_code, 200)
+
+    def test_revoke_ends_every_session(self):
+        first, second = self.login(), self.login()
+        self.assertEqual(self.client.post('/auth/revoke', headers=first).status_code, 200)
+        self.assertEqual(self.client.get('/api/organisations', headers=first).status_code, 401)
+        self.assertEqual(self.client.get('/api/organisations', headers=second).status_code, 401)
+        self.assertEqual(self.client.get('/api/organisations', headers=self.login()).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
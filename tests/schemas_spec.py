@@ -0,0 +1,37 @@
+import unittest
+import msgspec
+from schemas import PayloadError, RegisterPayload, UserData, encode
+
+
+class SchemasTestCase(unittest.TestCase):
+    def test_register_payload_decodes(self):
+        payload = RegisterPayload.decode(
+            b'{"firstName": "A", "lastName": "B", "email": "a@b.c", "password": "pw", "extra": 1}')
+        self.assertEqual(payload.email, 'a@b.c')
+        self.assertIsNone(payload.phone)
+
+    def test_every_invalid_field_is_reported(self):
+        with self.assertRaises(PayloadError) as raised:
+            RegisterPayload.decode(b'{"firstName": "", "lastName": 3, "email": "a@b.c", "phone": 5}')
+        self.assertEqual(raised.exception.errors, [
+            {"field": "firstName", "message": "This field is required and must be a string"},
+            {"field": "lastName", "message": "This field is required and must be a string"},
+            {"field": "password", "message": "This field is required and must be a string"},
+            {"field": "phone", "message": "This field must be a string"},
+        ])
+
+    def test_malformed_body(self):
+        for body in (b'not json', b'[]', b''):
+            with self.assertRaises(PayloadError) as raised:
+                RegisterPayload.decode(body)
+            self.assertIsNone(raised.exception.errors[0]['field'])
+
+    def test_response_structs_encode_like_dicts(self):
+        data = UserData('id', 'A', 'B', 'a@b.c', None)
+        self.assertEqual(msgspec.json.decode(encode({"data": data})), {
+            "data": {"userId": "id", "firstName": "A", "lastName": "B", "email": "a@b.c", "phone": None}
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import uuid
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+from app import create_app
+from models import Organization, db
+from services import membership_cache, organization_search
+from services.search import NameIndex, similarity
+
+
+class NameIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        names = ['Acme Corp', 'acme labs', 'Acne Studio', 'Beta_1', 'Zeta', 'ACME']
+        self.index = NameIndex([(f'org-{i}', name) for i, name in enumerate(names)])
+
+    def test_prefix_matches_in_name_order(self):
+        self.assertEqual(self.index.prefix('ACM', 10), ['org-5', 'org-0', 'org-1'])
+        self.assertEqual(self.index.prefix('acme', 2), ['org-5', 'org-0'])
+        self.assertEqual(self.index.prefix('beta_', 10), ['org-3'])
+        self.assertEqual(self.index.prefix('zz', 10), [])
+
+    def test_fuzzy_ranks_by_trigram_similarity(self):
+        self.assertEqual(self.index.fuzzy('acme corp', 10)[0], 'org-0')
+        self.assertIn('org-0', self.index.fuzzy('Acme Crop', 10))
+        self.assertEqual(self.index.fuzzy('zeta', 1), ['org-4'])
+        self.assertEqual(self.index.fuzzy('qqqq', 10), [])
+        self.assertEqual(self.index.fuzzy('!!', 10), [])
+
+    def test_similarity_matches_pg_trgm(self):
+        # SELECT similarity('word', 'two words') is 0.363636
+        self.assertAlmostEqual(similarity('word', 'two words'), 4 / 11)
+        self.assertEqual(similarity('Acme', 'ACME'), 1.0)
+
+
+class PostgresSearchTestCase(unittest.TestCase):
+    def test_indexes_are_declared_for_postgresql(self):
+        indexes = {index.name: str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+                   for index in Organization.__table__.indexes}
+        self.assertIn('lower(name) text_pattern_ops', indexes['ix_organization_name_lower_pattern'])
+        self.assertIn('USING gin (lower(name) gin_trgm_ops)', indexes['ix_organization_name_trgm'])
+
+    def test_search_query_uses_the_indexed_expressions(self):
+        userId = str(uuid.uuid4())
+        prefix = str(Organization.search_query(userId, 'Ac_me').compile(dialect=postgresql.dialect()))
+        self.assertIn("lower(organization.name) LIKE", prefix)
+        self.assertIn("ESCAPE '/'", prefix)
+        fuzzy = str(Organization.search_query(userId, 'acme', fuzzy=True).compile(dialect=postgresql.dialect()))
+        self.assertIn("lower(organization.name) %% ", fuzzy)
+        self.assertIn("similarity(lower(organization.name)", fuzzy)
+
+
+class SearchEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(test=True)
+        self.client = self.app.test_client()
+        self.userId, self.headers = self.register('john.doe@example.com')
+        for name in ('Acme Corp', 'acme labs', 'Acne Studio', '100%_Org'):
+            self.create(name, self.headers)
+        self.create('Acme Secret', self.register('jane.doe@example.com')[1])
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def register(self, email):
+        data = self.client.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': email,
+            'password': 'password123'
+        }).get_json()['data']
+        return data['user']['userId'], {'Authorization': f"Bearer {data['accessToken']}"}
+
+    def create(self, name, headers):
+        response = self.client.post('/api/organisations', json={'name': name}, headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+    def search(self, query, status=200):
+        response = self.client.get(f'/api/organisations/search?{query}', headers=self.headers)
+        self.assertEqual(response.status_code, status)
+        return response.get_json()
+
+    def names(self, query):
+        return [organization['name'] for organization in self.search(query)['data']]
+
+    def test_prefix_search_covers_only_the_callers_organizations(self):
+        self.assertEqual(self.names('q=ACME'), ['Acme Corp', 'acme labs'])
+        self.assertEqual(self.names('q=ac&limit=2'), ['Acme Corp', 'acme labs'])
+        self.assertEqual(self.names('q=100%25_'), ['100%_Org'])
+        self.assertEqual(self.names('q=100__'), [])
+
+    def test_fuzzy_search_tolerates_typos(self):
+        self.assertEqual(self.names('q=acme%20crop&mode=fuzzy')[0], 'Acme Corp')
+        self.assertNotIn('Acme Secret', self.names('q=acme%20secret&mode=fuzzy'))
+
+    def test_new_organizations_are_found(self):
+        self.assertEqual(self.names('q=acme%20n'), [])
+        self.create('Acme North', self.headers)
+        self.assertEqual(self.names('q=acme%20n'), ['Acme North'])
+
+    def test_index_is_reused_until_memberships_change(self):
+        self.names('q=acme')
+        with self.app.app_context():
+            before = organization_search.stats()
+        self.names('q=acne')
+        with self.app.app_context():
+            after = organization_search.stats()
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        self.assertEqual(after['size'], 1)
+        index = organization_search.indexes.get(self.userId, count=False)
+        # An expired membership set reloads the same organizations
+        membership_cache.clear()
+        self.names('q=acme')
+        self.assertIs(organization_search.indexes.get(self.userId, count=False), index)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.search('q=', 400)['message'], 'Invalid q')
+        self.assertEqual(self.search('q=acme&mode=regex', 400)['message'], 'Invalid mode')
+        self.assertEqual(self.search('q=acme&limit=0', 400)['message'], 'Invalid limit')
+        response = self.client.get('/api/organisations/search?q=acme')
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MASTER = r'''
+import os, sys
+from server import Master
+
+def factory():
+    from app import create_app
+    open(os.path.join(sys.argv[2], str(os.getpid())), 'w').close()
+    return create_app(test=True)
+
+Master(factory, host='127.0.0.1', port=int(sys.argv[1]), workers=2, max_requests=int(sys.argv[3]),
+       graceful_timeout=5, reuse_port=sys.argv[4] == '1', log_level='warning').run()
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class MasterTestCase(unittest.TestCase):
+    def start(self, max_requests=0, reuse_port=False):
+        self.port = free_port()
+        self.pids = tempfile.mkdtemp()
+        self.master = subprocess.Popen(
+            [sys.executable, '-c', MASTER, str(self.port), self.pids, str(max_requests), '1' if reuse_port else '0'],
+            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.wait_for(lambda: len(self.started()) == 2 and self.get() == 200)
+
+    def tearDown(self):
+        if self.master.poll() is None:
+            self.master.kill()
+            self.master.wait()
+
+    def started(self):
+        return set(os.listdir(self.pids))
+
+    def get(self):
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{self.port}/', timeout=5) as response:
+                return response.status
+        except OSError:
+            return None
+
+    def wait_for(self, condition, timeout=30):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "timed out")
+            time.sleep(0.05)
+
+    def test_reload_replaces_workers_and_stop_drains(self):
+        self.start()
+        first = self.started()
+        self.master.send_signal(signal.SIGHUP)
+        self.wait_for(lambda: len(self.started()) == 4)
+        self.wait_for(lambda: not any(_alive(int(pid)) for pid in first))
+        self.assertEqual(self.get(), 200)
+        self.master.send_signal(signal.SIGTERM)
+        self.assertEqual(self.master.wait(timeout=30), 0)
+        self.assertFalse(any(_alive(int(pid)) for pid in self.started()))
+
+    def test_workers_are_recycled_after_max_requests(self):
+        self.start(max_requests=5, reuse_port=True)
+        for _ in range(30):
+            self.assertEqual(self.get(), 200)
+        self.wait_for(lambda: len(self.started()) > 2)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # Exited but not reaped yet
+    with open(f'/proc/{pid}/stat') as stat:
+        return stat.read().split(') ')[1][0] != 'Z'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import time
+import unittest
+import jwt
+from app import create_app
+from models import db
+from services.signing import SigningKey, generate_signing_key
+
+
+class SigningTestCase(unittest.TestCase):
+    def setUp(self):
+        self.old_pem = generate_signing_key('ES256')
+        self.new_pem = generate_signing_key('EdDSA')
+        self.apps = []
+
+    def tearDown(self):
+        for app in self.apps:
+            with app.app_context():
+                db.session.remove()
+                db.drop_all()
+        # Leave the shared key ring empty for the other tests
+        create_app(test=True)
+
+    def make_client(self, **config):
+        app = create_app(test=True, config=config)
+        self.apps.append(app)
+        return app.test_client()
+
+    def register(self, client):
+        response = client.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password123'
+        })
+        data = response.get_json()['data']
+        return data['user']['userId'], data['accessToken']
+
+    def test_tokens_are_signed_with_the_key_and_verify_from_the_jwks(self):
+        for pem, algorithm in ((self.new_pem, 'EdDSA'), (self.old_pem, 'ES256')):
+            with self.subTest(algorithm=algorithm):
+                client = self.make_client(JWT_PRIVATE_KEYS=[pem])
+                userId, token = self.register(client)
+                header = jwt.get_unverified_header(token)
+                self.assertEqual(header['alg'], algorithm)
+                self.assertEqual(header['kid'], SigningKey.from_pem(pem).kid)
+                response = client.get(f'/api/users/{userId}', headers={'Authorization': f'Bearer {token}'})
+                self.assertEqual(response.status_code, 200)
+
+                jwks = client.get('/.well-known/jwks.json').get_json()
+                key = jwt.PyJWKSet.from_dict(jwks)[header['kid']]
+                claims = jwt.decode(token, key.key, algorithms=[algorithm])
+                self.assertEqual(claims['userId'], userId)
+
+    def test_rotation_keeps_old_tokens_valid(self):
+        client = self.make_client(JWT_PRIVATE_KEYS=[self.old_pem])
+        userId, old_token = self.register(client)
+        new_kid = SigningKey.from_pem(self.new_pem).kid
+        create_app(test=True, config={'JWT_PRIVATE_KEYS': [self.old_pem, self.new_pem],
+                                      'JWT_SIGNING_KEY_ID': new_kid})
+        headers = {'Authorization': f'Bearer {old_token}'}
+        self.assertEqual(client.get(f'/api/users/{userId}', headers=headers).status_code, 200)
+        token = client.post('/auth/login', json={
+            'email': 'john.doe@example.com', 'password': 'password123'}).get_json()['data']['accessToken']
+        self.assertEqual(jwt.get_unverified_header(token)['kid'], new_kid)
+
+        # The old key dropped, its tokens no longer verify
+        create_app(test=True, config={'JWT_PRIVATE_KEYS': [self.new_pem]})
+        response = client.get(f'/api/users/{userId}', headers=headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(client.get(f'/api/users/{userId}', headers={'Authorization': f'Bearer {token}'}).status_code, 200)
+
+    def test_hs256_tokens_are_accepted_only_while_allowed(self):
+        client = self.make_client()
+        userId, token = self.register(client)
+        self.assertNotIn('kid', jwt.get_unverified_header(token))
+        headers = {'Authorization': f'Bearer {token}'}
+        create_app(test=True, config={'JWT_PRIVATE_KEYS': [self.new_pem]})
+        self.assertEqual(client.get(f'/api/users/{userId}', headers=headers).status_code, 200)
+        create_app(test=True, config={'JWT_PRIVATE_KEYS': [self.new_pem], 'JWT_ACCEPT_HS256': False})
+        self.assertEqual(client.get(f'/api/users/{userId}', headers=headers).status_code, 401)
+
+    def test_unknown_kid_is_rejected(self):
+        client = self.make_client(JWT_PRIVATE_KEYS=[self.new_pem])
+        userId, _ = self.register(client)
+        forged = jwt.encode({"userId": userId, "exp": int(time.time()) + 60}, SigningKey.from_pem(self.old_pem).private_key,
+                            algorithm='ES256', headers={"kid": "unknown"})
+        response = client.get(f'/api/users/{userId}', headers={'Authorization': f'Bearer {forged}'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_jwks_is_cacheable(self):
+        client = self.make_client(JWT_PRIVATE_KEYS=[self.new_pem])
+        response = client.get('/.well-known/jwks.json')
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=300')
+        self.assertEqual([key['kid'] for key in response.get_json()['keys']], [SigningKey.from_pem(self.new_pem).kid])
+        self.assertNotIn('d', response.get_json()['keys'][0])
+        response = client.get('/.well-known/jwks.json', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_key_files_are_loaded(self):
+        handle, path = tempfile.mkstemp(suffix='.pem')
+        with os.fdopen(handle, 'wb') as key_file:
+            key_file.write(self.new_pem)
+        try:
+            client = self.make_client(JWT_KEY_FILES=[path])
+        finally:
+            os.remove(path)
+        kid = client.get('/.well-known/jwks.json').get_json()['keys'][0]['kid']
+        self.assertEqual(kid, SigningKey.from_pem(self.new_pem).kid)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import threading
+import time
+import unittest
+from cachelib import SimpleCache
+from sqlalchemy import event
+from app import create_app
+from models import db
+from services.throttling import CachelibThrottleStore, LoginThrottle
+
+
+class SlowCache(SimpleCache):
+    """A cache whose reads take a round trip and whose inc is atomic, like Redis."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        time.sleep(0.002)
+        return super().get(key)
+
+    def inc(self, key, delta=1):
+        with self._lock:
+            return super().inc(key, delta)
+
+    def dec(self, key, delta=1):
+        with self._lock:
+            return super().dec(key, delta)
+
+
+class LoginThrottleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 6000.0
+        self.throttle = LoginThrottle(window=60, email_limit=3, ip_limit=5, clock=lambda: self.now)
+
+    def test_email_limit_rejects_with_retry_after(self):
+        for _ in range(3):
+            self.assertIsNone(self.throttle.attempt('a@example.com', '10.0.0.1'))
+        self.assertEqual(self.throttle.attempt('A@example.com', '10.0.0.2'), 61)
+        self.assertIsNone(self.throttle.attempt('b@example.com', '10.0.0.1'))
+        self.assertEqual(self.throttle.rejected, 1)
+
+    def test_ip_limit_covers_every_email(self):
+        for i in range(5):
+            self.assertIsNone(self.throttle.attempt(f'{i}@example.com', '10.0.0.1'))
+        self.assertIsNotNone(self.throttle.attempt('new@example.com', '10.0.0.1'))
+        self.assertIsNone(self.throttle.attempt('new@example.com', '10.0.0.2'))
+
+    def test_previous_window_decays(self):
+        for _ in range(3):
+            self.throttle.attempt('a@example.com', None)
+        self.now += 60
+        # The previous window still counts in full at the start of the next one
+        self.assertEqual(self.throttle.attempt('a@example.com', None), 1)
+        self.now += 1
+        self.assertIsNone(self.throttle.attempt('a@example.com', None))
+        # 3 * 59/60 + 1 leaves no room until the previous share is below 2, 20s on
+        self.assertEqual(self.throttle.attempt('a@example.com', None), 20)
+        self.now += 20
+        self.assertIsNone(self.throttle.attempt('a@example.com', None))
+
+    def test_rejected_attempts_are_not_counted(self):
+        for _ in range(3):
+            self.throttle.attempt('a@example.com', None)
+        for _ in range(10):
+            self.throttle.attempt('a@example.com', None)
+        self.now += 120
+        self.assertIsNone(self.throttle.attempt('a@example.com', None))
+
+    def test_concurrent_burst_stays_within_the_limit(self):
+        for store in (None, CachelibThrottleStore(SlowCache())):
+            with self.subTest(store=store):
+                self.throttle = LoginThrottle(window=60, email_limit=3, ip_limit=5, store=store,
+                                              clock=lambda: self.now)
+                self.assert_burst_limited()
+
+    def assert_burst_limited(self):
+        barrier = threading.Barrier(20)
+        results = []
+
+        def attempt():
+            barrier.wait()
+            results.append(self.throttle.attempt('a@example.com', None))
+        threads = [threading.Thread(target=attempt) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(None), 3)
+        self.assertEqual(self.throttle.rejected, 17)
+
+    def test_cachelib_store_shares_counters(self):
+        shared = SimpleCache()
+        first = LoginThrottle(window=60, email_limit=2, ip_limit=0, store=CachelibThrottleStore(shared),
+                              clock=lambda: self.now)
+        second = LoginThrottle(window=60, email_limit=2, ip_limit=0, store=CachelibThrottleStore(shared),
+                               clock=lambda: self.now)
+        self.assertIsNone(first.attempt('a@example.com', None))
+        self.assertIsNone(second.attempt('a@example.com', None))
+        self.assertIsNotNone(first.attempt('a@example.com', None))
+
+
+class LoginThrottleRouteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(test=True, config={'LOGIN_THROTTLE_EMAIL_LIMIT': 2})
+        self.client = self.app.test_client()
+        self.client.post('/auth/register', json={
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john.doe@example.com',
+            'password': 'password123'
+        })
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_throttled_login_runs_no_query(self):
+        for _ in range(2):
+            response = self.client.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'wrong'})
+            self.assertEqual(response.status_code, 401)
+        statements = []
+        with self.app.app_context():
+            engine = db.engine
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.post('/auth/login', json={'email': 'john.doe@example.com', 'password': 'password123'})
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(int(response.headers['Retry-After']), range(1, 62))
+        self.assertEqual(response.get_json()['statusCode'], 429)
+        self.assertEqual(statements, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
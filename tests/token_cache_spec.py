@@ -0,0 +1,66 @@
+import time
+import unittest
+from unittest import mock
+import jwt
+from services.caching import ExpiringLRUCache
+from services.tokens import TokenCache
+
+
+class ExpiringLRUCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = ExpiringLRUCache(maxsize=2, clock=lambda: self.now)
+
+    def test_entry_expires_at_its_time(self):
+        self.cache.set('a', 1, expires_at=1010)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.now = 1010
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats(), {"size": 0, "hits": 1, "misses": 1})
+
+    def test_expired_entries_are_swept_before_lru_eviction(self):
+        self.cache.set('old', 1, expires_at=1001)
+        self.cache.set('live', 2, expires_at=2000)
+        self.now = 1500
+        self.cache.set('new', 3, expires_at=2000)
+        self.assertEqual(self.cache.get('live'), 2)
+        self.assertEqual(self.cache.get('new'), 3)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = TokenCache(maxsize=10)
+        self.token = jwt.encode({"userId": "u1", "exp": int(time.time()) + 60}, 'secret', algorithm='HS256')
+
+    def test_second_verification_skips_jwt_decode(self):
+        with mock.patch('jwt.decode', wraps=jwt.decode) as decode:
+            self.assertEqual(self.cache.decode(self.token, 'secret')['userId'], 'u1')
+            self.assertEqual(self.cache.decode(self.token, 'secret')['userId'], 'u1')
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_secret_rotation_purges_cache(self):
+        self.cache.decode(self.token, 'secret')
+        with self.assertRaises(jwt.InvalidSignatureError):
+            self.cache.decode(self.token, 'rotated')
+        self.assertEqual(len(self.cache.cache), 0)
+
+    def test_entry_is_dropped_at_token_expiry(self):
+        self.cache.decode(self.token, 'secret')
+        expiry = jwt.decode(self.token, 'secret', algorithms=['HS256'])['exp']
+        self.cache.cache._clock = lambda: expiry
+        with mock.patch('jwt.decode', wraps=jwt.decode) as decode:
+            self.cache.decode(self.token, 'secret')
+        self.assertEqual(decode.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+import uuid
+from sqlalchemy import create_engine, text
+from app import create_app
+from migrations import lookup_indexes, org_name_search
+from migrations.uuid_keys import TEXT_KEY_SCHEMA, needs_upgrade, upgrade
+from migrations.version import SCHEMA_VERSION, SchemaVersionError, current_version, stamp
+from models import User, Organization, db
+
+
+class UUIDKeyTestCase(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.uri = f'sqlite:///{self.path}'
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_keys_are_stored_as_bytes_and_read_as_strings(self):
+        app = create_app(test=True)
+        userId = str(uuid.uuid4())
+        with app.app_context():
+            db.session.add(User(userId=userId, firstName='F', lastName='L', email='f@example.com', password='x'))
+            db.session.commit()
+            raw = db.session.execute(text('SELECT "userId" FROM user')).scalar()
+            self.assertEqual(raw, uuid.UUID(userId).bytes)
+            self.assertEqual(db.session.get(User, userId).userId, userId)
+            self.assertEqual(db.session.get(User, userId.upper()).userId, userId)
+            self.assertIsNone(db.session.get(User, 'not-a-uuid'))
+            db.session.remove()
+            db.drop_all()
+
+    def test_upgrade_converts_legacy_tables(self):
+        engine = create_engine(self.uri)
+        userIds = [str(uuid.uuid4()) for _ in range(5)]
+        orgId = str(uuid.uuid4())
+        with engine.begin() as conn:
+            for statement in TEXT_KEY_SCHEMA:
+                conn.execute(text(statement))
+            conn.execute(text('INSERT INTO organization ("orgId", name) VALUES (:orgId, \'Org\')'), {"orgId": orgId})
+            for userId in userIds:
+                conn.execute(text('INSERT INTO user ("userId", "firstName", "lastName", email, password) '
+                                  'VALUES (:userId, \'F\', \'L\', :email, \'x\')'),
+                             {"userId": userId, "email": f"{userId}@example.com"})
+                conn.execute(text('INSERT INTO user_organization VALUES (:userId, :orgId)'),
+                             {"userId": userId, "orgId": orgId})
+        self.assertTrue(needs_upgrade(engine))
+        app = create_app(test=True, config={'SQLALCHEMY_DATABASE_URI': self.uri})
+        self.assertEqual(app.test_client().get('/').status_code, 503)
+        with app.app_context():
+            db.engine.dispose()
+        upgrade(engine, batch_size=2, log=lambda message: None)
+        self.assertFalse(needs_upgrade(engine))
+        with engine.connect() as conn:
+            self.assertEqual(current_version(conn), 2)
+        org_name_search.upgrade(engine, log=lambda message: None)
+        lookup_indexes.upgrade(engine, log=lambda message: None)
+        with engine.connect() as conn:
+            self.assertEqual(current_version(conn), SCHEMA_VERSION)
+        engine.dispose()
+
+        app = create_app(test=True, config={'SQLALCHEMY_DATABASE_URI': self.uri})
+        with app.app_context():
+            self.assertEqual(User.existing_ids(userIds), set(userIds))
+            self.assertTrue(all(Organization.is_member(userId, orgId) for userId in userIds))
+            self.assertEqual(User.by_email(f"{userIds[0].upper()}@EXAMPLE.COM").userId, userIds[0])
+            db.session.remove()
+            db.engine.dispose()
+
+    def test_startup_creates_and_stamps_an_empty_database(self):
+        create_app(test=True, config={'SQLALCHEMY_DATABASE_URI': self.uri})
+        engine = create_engine(self.uri)
+        with engine.begin() as conn:
+            self.assertEqual(current_version(conn), SCHEMA_VERSION)
+            self.assertEqual(conn.execute(text('SELECT count(*) FROM user')).scalar(), 0)
+            stamp(conn, SCHEMA_VERSION + 1)
+        engine.dispose()
+        app = create_app(test=True, config={'SQLALCHEMY_DATABASE_URI': self.uri})
+        response = app.test_client().post('/auth/login', json={'email': 'a@example.com', 'password': 'x'})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('newer than', response.get_json()['message'])
+        with app.app_context():
+            db.engine.dispose()
+
+    def version_3_database(self, emails):
+        """Returns an engine on a version 3 database made before the lookup indexes, holding emails."""
+        app = create_app(test=True, config={'SQLALCHEMY_DATABASE_URI': self.uri})
+        with app.app_context():
+            db.engine.dispose()
+        engine = create_engine(self.uri)
+        with engine.begin() as conn:
+            conn.execute(text('DROP INDEX ix_user_email_lower'))
+            conn.execute(text('DROP INDEX ix_organization_name'))
+            for email in emails:
+                conn.execute(text('INSERT INTO user ("userId", "firstName", "lastName", email, password) '
+                                  'VALUES (:userId, \'F\', \'L\', :email, \'x\')'),
+                             {"userId": uuid.uuid4().bytes, "email": email})
+            stamp(conn, 3)
+        return engine
+
+    def test_lookup_indexes_are_created_on_older_databases(self):
+        engine = self.version_3_database(['a@example.com'])
+        lookup_indexes.upgrade(engine, log=lambda message: None)
+        with engine.connect() as conn:
+            indexes = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+            self.assertTrue({'ix_user_email_lower', 'ix_organization_name'} <= indexes)
+            self.assertEqual(current_version(conn), SCHEMA_VERSION)
+        engine.dispose()
+
+    def test_lookup_indexes_stop_on_emails_differing_in_case(self):
+        engine = self.version_3_database(['a@example.com', 'A@example.com'])
+        with self.assertRaises(SchemaVersionError) as raised:
+            lookup_indexes.upgrade(engine, log=lambda message: None)
+        self.assertIn('a@example.com', str(raised.exception))
+        with engine.connect() as conn:
+            self.assertEqual(current_version(conn), 3)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,3 +3,6 @@ app_views = Blueprint('app_views', __name__)
 
 from views.user import *
 from views.organization import *
+from views.admin import *
+from views.metrics import *
+from views.jwks import *
@@ -0,0 +1,69 @@
+import io
+from middlewares.user_validation import admin_route
+from views import app_views
+from flask import request, current_app
+from schemas import json_response
+from services import membership_cache, profile_cache, revocation_list, token_cache
+from services.bulk_import import UserImporter, read_rows
+
+IMPORT_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+}
+
+
+@app_views.route("/api/admin/users/import", methods=["POST"])
+@admin_route
+def import_users():
+    """
+    This is the bulk user import function.
+
+    The body is streamed as CSV (text/csv) or NDJSON (application/x-ndjson).
+    Rows up to and including ?startAfter=<row> are skipped, so a client can
+    resume from the lastRow of an interrupted import. The errors of the first
+    IMPORT_MAX_REPORTED_ERRORS rejected rows are returned, failed counts them all.
+    """
+    fmt = IMPORT_FORMATS.get(request.mimetype)
+    if fmt is None:
+        return json_response({
+            "status": "Bad request",
+            "message": "Content-Type must be text/csv or application/x-ndjson",
+            "statusCode": 415
+        }), 415
+    try:
+        start_after = int(request.args.get('startAfter', 0))
+    except ValueError:
+        return json_response({
+            "status": "Bad request",
+            "message": "startAfter must be an integer",
+            "statusCode": 400
+        }), 400
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    importer = UserImporter(
+        batch_size=current_app.config['IMPORT_BATCH_SIZE'],
+        workers=current_app.config.get('IMPORT_WORKERS'),
+        max_errors=current_app.config['IMPORT_MAX_REPORTED_ERRORS'],
+    )
+    result = importer.run(read_rows(stream, fmt), start_after=start_after)
+    return json_response({
+        "status": "success",
+        "message": "Import finished",
+        "data": result.to_dict()
+    }), 200
+
+
+@app_views.route("/api/admin/cache-stats", methods=["GET"])
+@admin_route
+def cache_stats():
+    """This returns the size and hit counters of the in-process caches."""
+    return json_response({
+        "status": "success",
+        "message": "Cache statistics",
+        "data": {
+            "tokens": token_cache.stats(),
+            "profiles": profile_cache.stats(),
+            "memberships": membership_cache.stats(),
+            "revocations": revocation_list.stats(),
+        }
+    }), 200
@@ -0,0 +1,12 @@
+from views import app_views
+from flask import current_app, request
+from services import key_ring
+
+
+@app_views.route("/.well-known/jwks.json", methods=["GET"])
+def jwks():
+    """This serves the public keys access tokens are signed with, for verification by other services."""
+    headers = {"Cache-Control": "public, max-age=300", "ETag": key_ring.jwks_etag}
+    if request.headers.get('If-None-Match') == key_ring.jwks_etag:
+        return current_app.response_class(status=304, headers=headers)
+    return current_app.response_class(key_ring.jwks_body, content_type='application/json', headers=headers)
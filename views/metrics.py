@@ -0,0 +1,16 @@
+from views import app_views
+from flask import current_app
+from schemas import json_response
+from services import metrics
+
+
+@app_views.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """This serves the metrics in the Prometheus text format, while METRICS_ENABLED is on."""
+    if not metrics.enabled:
+        return json_response({
+            "status": "Not found",
+            "message": "Metrics are disabled",
+            "statusCode": 404
+        }), 404
+    return current_app.response_class(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
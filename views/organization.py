@@ -1,103 +1,199 @@
 import uuid
-from middlewares.user_validation import protected_route
+from middlewares.replicas import read_only
+from middlewares.user_validation import protected_route, validate_payload
 from views import app_views
-from flask import request, jsonify, session
+from flask import request, current_app, g
 from models import User, Organization
 from database import db
+from schemas import (AddUserPayload, AddUsersPayload, OrganizationData, OrganizationPayload,
+                     Pagination, UserData, encode_lines, json_response, ndjson_response)
+from services import InvalidPageRequest, encode_cursor, parse_page_args, membership_cache, organization_search
+
+
+def is_member(user_id, org_id) -> bool:
+    """
+    Returns True if user_id belongs to org_id. No query when the user's
+    cached memberships hold org_id.
+
+    A miss is confirmed in the database: the cache is only invalidated in
+    the process that wrote, so another worker may have added the membership.
+    """
+    try:
+        org_id = str(uuid.UUID(org_id))
+    except (TypeError, ValueError):
+        return False
+    if org_id in membership_cache.get(user_id, lambda: Organization.ids_for_member(user_id)):
+        return True
+    if not Organization.is_member(user_id, org_id):
+        return False
+    # Reloaded on the next check
+    membership_cache.invalidate(user_id)
+    return True
 
 
 @app_views.route("/api/organisations/<orgId>/users", methods=["POST"])
 @protected_route
+@validate_payload(AddUserPayload)
 def add_existing_user_to_organization(orgId=None):
     """This is the add existing user to organization function"""
     try:
-        orgOwner = session.get('user_id')
-        orgUser = User.query.filter_by(userId=orgOwner).first()
-        if orgUser is None:
-            return jsonify({
+        orgOwner = g.auth.user_id
+        # A member exists and so does the organization, which spares both lookups
+        owner_is_member = is_member(orgOwner, orgId)
+        if not owner_is_member and not g.auth.exists():
+            return json_response({
                 "status": "Bad request",
                 "message": "User not found",
                 "statusCode": 404
             }), 404
-        request_data = request.get_json()
-        userId = request_data.get('userId')
-        user = User.query.filter_by(userId=userId).first()
-        if user is None:
-            return jsonify({
+        userId = g.payload.userId
+        if not User.exists(userId):
+            return json_response({
                 "status": "Bad request",
                 "message": "The User was not found",
                 "statusCode": 404
             }), 404
-        org_check = Organization.query.filter_by(orgId=orgId).first()
-        if org_check is None:
-            return jsonify({
-                "status": "Bad request",
-                "message": "Organization not found",
-                "statusCode": 404
-            }), 404
-        organization = [org for org in orgUser.organizations if org.orgId == orgId]
-        if not organization:
-            return jsonify({
+        if not owner_is_member:
+            if db.session.get(Organization, orgId) is None:
+                return json_response({
+                    "status": "Bad request",
+                    "message": "Organization not found",
+                    "statusCode": 404
+                }), 404
+            return json_response({
                 "status": "Bad request",
                 "message": "You are not in this organization",
                 "statusCode": 401
             }), 401
-        
-        user.organizations.append(org_check)
+
+        Organization.add_member(userId, orgId)
         db.session.commit()
-        return jsonify({
+        return json_response({
             "status": "success",
             "message": "User added to organization successfully"
         }), 200
     except Exception as e:
         print(e)
-        return jsonify({
+        db.session.rollback()
+        return json_response({
             "status": "Bad request",
             "message": "Server error",
             "statusCode": 400
         }), 400
 
 
+@app_views.route("/api/organisations/<orgId>/users/batch", methods=["POST"])
+@protected_route
+@validate_payload(AddUsersPayload)
+def add_existing_users_to_organization(orgId=None):
+    """
+    This is the batch variant of add_existing_user_to_organization.
+
+    It takes {"userIds": [...]} and reports, per user, whether it was
+    added, was already a member or was not found.
+    """
+    orgOwner = g.auth.user_id
+    owner_is_member = is_member(orgOwner, orgId)
+    if not owner_is_member and not g.auth.exists():
+        return json_response({
+            "status": "Bad request",
+            "message": "User not found",
+            "statusCode": 404
+        }), 404
+    userIds = g.payload.userIds
+    max_users = current_app.config['ORGANISATIONS_BATCH_MAX_USERS']
+    if len(userIds) > max_users:
+        return json_response({
+            "errors": [
+                {
+                    "field": "userIds",
+                    "message": f"This field must hold at most {max_users} userIds"
+                }
+            ]
+        }), 422
+    if not owner_is_member:
+        if db.session.get(Organization, orgId) is None:
+            return json_response({
+                "status": "Bad request",
+                "message": "Organization not found",
+                "statusCode": 404
+            }), 404
+        return json_response({
+            "status": "Bad request",
+            "message": "You are not in this organization",
+            "statusCode": 401
+        }), 401
+
+    userIds = list(dict.fromkeys(userIds))
+    try:
+        found = User.existing_ids(userIds)
+        added = Organization.add_members(orgId, [userId for userId in userIds if userId in found])
+        db.session.commit()
+    except Exception:
+        current_app.logger.exception("Adding users to organization %s failed", orgId)
+        db.session.rollback()
+        return json_response({
+            "status": "Bad request",
+            "message": "Server error",
+            "statusCode": 400
+        }), 400
+    results = []
+    for userId in userIds:
+        if userId not in found:
+            status = "notFound"
+        elif userId in added:
+            status = "added"
+        else:
+            status = "alreadyMember"
+        results.append({"userId": userId, "status": status})
+    return json_response({
+        "status": "success",
+        "message": "Users processed",
+        "data": {
+            "added": len(added),
+            "alreadyMember": len(found) - len(added),
+            "notFound": len(userIds) - len(found),
+            "results": results
+        }
+    }), 200
+
+
 @app_views.route("/api/organisations", methods=["POST"])
 @protected_route
+@validate_payload(OrganizationPayload)
 def create_organization():
     """This is the create organization function"""
-    user_id = session.get('user_id')
-    user = User.query.filter_by(userId=user_id).first()
-    if user is None:
-        return jsonify({
+    user_id = g.auth.user_id
+    if not g.auth.exists():
+        return json_response({
             "status": "Bad request",
             "message": "User not found",
             "statusCode": 404
         }), 404
-    request_data = request.get_json()
-    name = request_data.get('name')
-    description = request_data.get('description')
+    name = g.payload.name
+    description = g.payload.description
 
     try:
-        organization = [orgName for orgName in user.organizations if orgName.name == name]
-        if organization:
-            return jsonify({
+        if Organization.name_taken(user_id, name):
+            return json_response({
                 "status": "Bad Request",
                 "message": "Client error",
                 "statusCode": 400
         }), 400
 
         organization = Organization(orgId=str(uuid.uuid4()), name=name, description=description)
-        user.organizations.append(organization)
         db.session.add(organization)
+        db.session.flush()
+        Organization.add_member(user_id, organization.orgId)
         db.session.commit()
-        return jsonify({
+        return json_response({
             "status": "success",
             "message": "Organisation created successfully",
-            "data": {
-                "orgId": organization.orgId,
-                "name": organization.name,
-                "description": organization.description
-            }
+            "data": OrganizationData.from_model(organization)
         }), 201
     except Exception as e:
-        return jsonify({
+        db.session.rollback()
+        return json_response({
             "status": "Bad Request",
             "message": "Client error",
             "statusCode": 400
@@ -106,56 +202,177 @@ def create_organization():
 
 @app_views.route("/api/organisations/<orgId>", methods=["GET"])
 @protected_route
+@read_only
 def organization(orgId=None):
     """This is the organization function"""
-    user_id = session.get('user_id')
-    user = User.query.filter_by(userId=user_id).first()
-    if user is None:
-        return jsonify({
+    user_id = g.auth.user_id
+    member = is_member(user_id, orgId)
+    if not member and not g.auth.exists():
+        return json_response({
             "status": "Bad request",
             "message": "User not found",
             "statusCode": 404
         }), 404
 
-    organization = [org for org in user.organizations if org and org.orgId == orgId]
-    if not organization:
-        return jsonify({
+    organization = db.session.get(Organization, orgId) if member else None
+    if organization is None:
+        return json_response({
             "status": "Bad request",
             "message": "You are not in this organization or you did not create it",
             "statusCode": 404
         }), 404
-    return jsonify({
+    return json_response({
         "status": "success",
         "message": "Organization found",
-        "data": {
-            "orgId": organization[0].orgId,
-            "name": organization[0].name,
-            "description": organization[0].description
-        }
+        "data": OrganizationData.from_model(organization)
     }), 200
 
 
+@app_views.route("/api/organisations/<orgId>/users", methods=["GET"])
+@protected_route
+@read_only
+def organization_members(orgId=None):
+    """
+    This streams the members of an organization as NDJSON, one user per
+    line, gzip-compressed when the client accepts it.
+
+    The rows come from a server-side cursor, ORGANISATIONS_EXPORT_BATCH_SIZE
+    at a time, so memory stays flat however large the organization.
+    """
+    user_id = g.auth.user_id
+    member = is_member(user_id, orgId)
+    if not member and not g.auth.exists():
+        return json_response({
+            "status": "Bad request",
+            "message": "User not found",
+            "statusCode": 404
+        }), 404
+    if not member:
+        return json_response({
+            "status": "Bad request",
+            "message": "You are not in this organization or you did not create it",
+            "statusCode": 404
+        }), 404
+    batch_size = current_app.config['ORGANISATIONS_EXPORT_BATCH_SIZE']
+    return ndjson_response(member_lines(orgId, batch_size), gzip='gzip' in request.accept_encodings)
+
+
+def member_lines(org_id, batch_size):
+    """Yields the members of org_id as NDJSON, one chunk per batch of rows"""
+    result = db.session.execute(
+        Organization.member_users_query(org_id).execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        yield encode_lines(UserData.from_model(row) for row in rows)
+
+
 @app_views.route("/api/organisations", methods=["GET"])
 @protected_route
+@read_only
 def organizations():
-    """This is the organizations function"""
-    user_id = session.get('user_id')
-    user = User.query.filter_by(userId=user_id).first()
-    if user is None:
-        return jsonify({
+    """
+    This is the organizations function.
+
+    With a limit or cursor query parameter the result is keyset-paginated
+    and carries a pagination object holding the nextCursor.
+    """
+    user_id = g.auth.user_id
+    if 'limit' in request.args or 'cursor' in request.args:
+        return organizations_page(user_id)
+    if not g.auth.exists():
+        return json_response({
+            "status": "Bad request",
+            "message": "User not found",
+            "statusCode": 404
+        }), 404
+    organizations = db.session.scalars(Organization.member_query(user_id))
+    return json_response({
+        "status": "success",
+        "message": "Organizations found",
+        "data": [OrganizationData.from_model(organization) for organization in organizations]
+    }), 200
+
+
+def organizations_page(user_id):
+    """Returns one keyset-paginated page of the organizations of user_id"""
+    try:
+        limit, after = parse_page_args(
+            request.args.get('limit'),
+            request.args.get('cursor'),
+            current_app.config['ORGANISATIONS_DEFAULT_PAGE_SIZE'],
+            current_app.config['ORGANISATIONS_MAX_PAGE_SIZE'],
+        )
+    except InvalidPageRequest as e:
+        return json_response({
+            "status": "Bad Request",
+            "message": str(e),
+            "statusCode": 400
+        }), 400
+    if not g.auth.exists():
+        return json_response({
+            "status": "Bad request",
+            "message": "User not found",
+            "statusCode": 404
+        }), 404
+    organizations = db.session.scalars(Organization.member_page_query(user_id, after, limit)).all()
+    next_cursor = None
+    if len(organizations) > limit:
+        organizations = organizations[:limit]
+        next_cursor = encode_cursor(organizations[-1].orgId)
+    return json_response({
+        "status": "success",
+        "message": "Organizations found",
+        "data": [OrganizationData.from_model(organization) for organization in organizations],
+        "pagination": Pagination(limit, next_cursor)
+    }), 200
+
+
+@app_views.route("/api/organisations/search", methods=["GET"])
+@protected_route
+@read_only
+def search_organizations():
+    """
+    This searches the caller's organizations by name.
+
+    q is matched case-insensitively against the start of the names, or
+    with mode=fuzzy by trigram similarity, best match first. limit caps the
+    results at ORGANISATIONS_SEARCH_MAX_LIMIT.
+    """
+    text = request.args.get('q', '').strip()
+    mode = request.args.get('mode', 'prefix')
+    try:
+        limit, _ = parse_page_args(
+            request.args.get('limit'),
+            None,
+            current_app.config['ORGANISATIONS_SEARCH_DEFAULT_LIMIT'],
+            current_app.config['ORGANISATIONS_SEARCH_MAX_LIMIT'],
+        )
+    except InvalidPageRequest as e:
+        return json_response({
+            "status": "Bad Request",
+            "message": str(e),
+            "statusCode": 400
+        }), 400
+    if not text or len(text) > 255:
+        message = "Invalid q"
+    elif mode not in ('prefix', 'fuzzy'):
+        message = "Invalid mode"
+    else:
+        message = None
+    if message is not None:
+        return json_response({
+            "status": "Bad Request",
+            "message": message,
+            "statusCode": 400
+        }), 400
+    if not g.auth.exists():
+        return json_response({
             "status": "Bad request",
             "message": "User not found",
             "statusCode": 404
         }), 404
-    organizations = user.organizations
-    return jsonify({
+    organizations = organization_search.search(g.auth.user_id, text, fuzzy=mode == 'fuzzy', limit=limit)
+    return json_response({
         "status": "success",
         "message": "Organizations found",
-        "data": [
-            {
-                "orgId": organization.orgId,
-                "name": organization.name,
-                "description": organization.description
-            } for organization in organizations
-        ]
+        "data": [OrganizationData.from_model(organization) for organization in organizations]
     }), 200
@@ -1,13 +1,23 @@
 import uuid
-from middlewares.user_validation import protected_route, validate_user
+from middlewares.replicas import read_only
+from middlewares.user_validation import protected_route, throttle_login, validate_payload, validate_user
 from views import app_views
-from flask import request, jsonify, session
+from flask import current_app, g
+from sqlalchemy.exc import IntegrityError
 from models import User, Organization
 from database import db
-import jwt
-import bcrypt
-from datetime import datetime, timedelta
-import os
+from schemas import AuthData, LoginPayload, UserData, json_response
+from services import (password_hasher, HashingUnavailable, encode_access_token, profile_cache, profile_data,
+                      revocation_list)
+
+def server_busy():
+    """Response for requests rejected because the hashing pool is saturated"""
+    return json_response({
+        "status": "Service unavailable",
+        "message": "Server is busy, try again later",
+        "statusCode": 503
+    }), 503, {"Retry-After": "1"}
+
 
 @app_views.route("/", methods=["GET"])
 def helloworld():
@@ -16,121 +26,156 @@ def helloworld():
 
 @app_views.route("/api/users/<id>", methods=["GET"])
 @protected_route
+@read_only
 def user(id=None):
     """This is the user function"""
-    user_id = session.get('user_id')
+    user_id = g.auth.user_id
     if id is not None and id != user_id:
-        return jsonify({
+        return json_response({
             "status": "Bad request",
             "message": "Unauthorized",
             "statusCode": 401
         }), 401
-    user = User.query.filter_by(userId=user_id).first()
+    profile = profile_cache.get(user_id, lambda: g.auth.user(*User.PROFILE_COLUMNS))
     
-    if user is None:
-        return jsonify({
+    if profile is None:
+        return json_response({
             "status": "Bad request",
             "message": "User not found",
             "statusCode": 404
         }), 404
-    return jsonify({
+    return json_response({
         "status": "success",
         "message": "User found",
-        "data": {
-            "userId": user.userId,
-            "firstName": user.firstName,
-            "lastName": user.lastName,
-            "email": user.email,
-            "phone": user.phone
-        }
+        "data": profile_data(profile)
     }), 200
 
 
 @app_views.route("/auth/login", methods=["POST"])
+@validate_payload(LoginPayload)
+@throttle_login
 def login():
     """This is the login function"""
-    request_data = request.get_json()
-    email = request_data.get('email')
-    password = request_data.get('password')
-    user = User.query.filter_by(email=email).first()
+    email = g.payload.email
+    password = g.payload.password
+    user = User.by_email(email)
     if user is None:
-        return jsonify({
+        return json_response({
             "status": "Bad request",
             "message": "Authentication failed",
             "statusCode": 401
         }), 401
-    if bcrypt.checkpw(password.encode('utf-8'), user.password.encode('utf-8')):
-        expiration_time = datetime.now() + timedelta(hours=24)
-        payload = { "userId": user.userId, "exp": expiration_time }
-        accessToken = jwt.encode(payload, os.environ.get('SECRET_KEY'), algorithm='HS256')
-        return jsonify({
+    try:
+        password_matches = password_hasher.check_password(password, user.password)
+    except HashingUnavailable:
+        return server_busy()
+    if password_matches:
+        if password_hasher.needs_rehash(user.password):
+            rehash_password(user.userId, password, user.password)
+        accessToken = encode_access_token(user.userId)
+        return json_response({
             "status": "success",
             "message": "Login successful",
-            "data": {
-                "accessToken": accessToken,
-                "user": {
-                    "userId": user.userId,
-                    "firstName": user.firstName,
-                    "lastName": user.lastName,
-                    "email": user.email,
-                    "phone": user.phone
-                }
-            }
+            "data": AuthData(accessToken, UserData.from_model(user))
         }), 200
     else:
-        return jsonify({
+        return json_response({
             "status": "Bad request",
             "message": "Authentication failed",
             "statusCode": 401
         }), 401
 
 
+def rehash_password(user_id, password, old_hash):
+    """Replaces the stored hash of user_id with one at the configured cost, in the background"""
+    app = current_app._get_current_object()
+
+    def store(new_hash):
+        with app.app_context():
+            try:
+                db.session.execute(User.password_rehash(user_id, old_hash, new_hash))
+                db.session.commit()
+            except Exception:
+                app.logger.exception("Rehashing the password of %s failed", user_id)
+    password_hasher.rehash_in_background(password, store)
+
+
 @app_views.route("/auth/register", methods=["POST"])
-# @validate_user
+@validate_user
 def register():
     """This is the register function"""
-    register_data = request.get_json()
-    password = register_data.get('password')
-    firstName = register_data.get('firstName')
-    lastName = register_data.get('lastName')
-    email = register_data.get('email')
-    phone = register_data.get('phone')
+    register_data = g.payload
+    password = register_data.password
+    firstName = register_data.firstName
+    lastName = register_data.lastName
+    email = register_data.email
+    phone = register_data.phone
     # generate userId
     userId = str(uuid.uuid4())
     
     # hash password
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    try:
+        hashed_password = password_hasher.hash_password(password)
+    except HashingUnavailable:
+        return server_busy()
     
     # jwt token
-    expiration_time = datetime.now() + timedelta(hours=24)
-    payload = { "userId": userId, "exp": expiration_time }
-    accessToken = jwt.encode(payload, os.environ.get('SECRET_KEY'), algorithm='HS256')
+    accessToken = encode_access_token(userId)
+    user = User(userId=userId, firstName=firstName, lastName=lastName, email=email, password=hashed_password, phone=phone)
+    orgId = str(uuid.uuid4())
+    organization = Organization(name=f"{firstName}'s Organisation", orgId=orgId)
+    organization.users.append(user)
+    db.session.add(user)
+    db.session.add(organization)
     try:
-        user = User(userId=userId, firstName=firstName, lastName=lastName, email=email, password=hashed_password, phone=phone)
-        orgId = str(uuid.uuid4())
-        organization = Organization(name=f"{firstName}'s Organisation", orgId=orgId)
-        organization.users.append(user)
-        db.session.add(user)
-        db.session.add(organization)
+        # One transaction, no SELECT first: a duplicate email surfaces as a unique violation
         db.session.commit()
-        return jsonify({
-            "status": "success",
-            "message": "Registration successful",
-            "data": {
-                "accessToken": accessToken,
-                "user": {
-                    "userId": userId,
-                    "firstName": firstName,
-                    "lastName": lastName,
-                    "email": email,
-                    "phone": phone,
-                }
-            }
-        }), 201
-    except Exception as e:
+    except IntegrityError as e:
+        db.session.rollback()
+        if User.is_email_conflict(e):
+            return json_response({
+                "errors": [
+                    {
+                        "field": "email",
+                        "message": "Email already exists"
+                    }
+                ]
+            }), 422
         print(e)
-        return jsonify({
+        return json_response({
             "status": "Bad request",
             "message": "Registration unsuccessful",
             "statusCode": 400
         }), 400
+    return json_response({
+        "status": "success",
+        "message": "Registration successful",
+        "data": AuthData(accessToken, UserData(userId, firstName, lastName, email, phone))
+    }), 201
+
+
+@app_views.route("/auth/logout", methods=["POST"])
+@protected_route
+def logout():
+    """This revokes the access token of the request"""
+    claims = g.auth.claims
+    if claims.get('jti') is None:
+        # Issued before tokens carried an id, only the user can be revoked
+        revocation_list.revoke_user(claims['userId'])
+    else:
+        revocation_list.revoke_token(claims['jti'], claims['exp'])
+    return json_response({
+        "status": "success",
+        "message": "Logout successful"
+    }), 200
+
+
+@app_views.route("/auth/revoke", methods=["POST"])
+@protected_route
+def revoke():
+    """This revokes every access token issued to the user so far"""
+    revocation_list.revoke_user(g.auth.user_id)
+    return json_response({
+        "status": "success",
+        "message": "Every access token was revoked"
+    }), 200